@@ -1,17 +1,31 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
-import requests
 from PyQt5.QtCore import QObject, pyqtSignal, QThread
 
+from core.state_store import get_store
+from core.backends import BACKENDS
+from core.request_dedup import request_registry, request_key
+from core.tokens import count_tokens, count_message_tokens
+from core.usage_ledger import UsageLedger
+from core.entities import setting_files
 
+# 加入{retrieved}之前的默认续写提示词，未修改过的在加载配置时更新
+LEGACY_CONTINUE_PROMPTS = {
+    '设定参考：\n{setting}\n\n请根据上文内容，继续写作，保持风格和语气一致：\n\n{context}':
+        '设定参考：\n{setting}\n\n前文中的相关片段：\n{retrieved}\n\n请根据上文内容，继续写作，保持风格和语气一致：\n\n{context}',
+    '## 设定\n{setting}\n请根据上文内容和小说设定，继续写作，保持风格和语气一致：\n\n{context}':
+        '## 设定\n{setting}\n## 前文中的相关片段\n{retrieved}\n请根据上文内容和小说设定，继续写作，保持风格和语气一致：\n\n{context}',
+}
 
 
 class AIHandler:
     """AI处理器"""
     def __init__(self, work_dir):
         self.work_dir = work_dir
+        self.root_path = None  # 用量记录在当前工作区中
+        self.backends = {}  # 后端名称 -> GenerationBackend
+        self.retriever = None  # PassageIndex，续写时检索前文中相关的片段
         self.config = self.load_config()
         
     def load_config(self):
@@ -20,78 +34,97 @@ class AIHandler:
             'api_key': '',
             'base_url': 'https://api.openai.com/v1',
             'model': 'gpt-3.5-turbo',
+            'chat_token_budget': 4000,
+            'mention_token_limit': 2000,
+            'mention_total_limit': 8000,
+            'request_usage': True,
+            'endpoints': [],
+            'routing': 'health',
+            'hedge_delay': 0,
+            'local_backend': {
+                'base_url': 'http://127.0.0.1:8080',
+                'api': 'openai',
+                'model': '',
+                'api_key': '',
+            },
+            'action_backends': {},
+            'chunk_token_limit': 3000,
+            'chunk_concurrency': 4,
+            'reduce_summaries': True,
+            'retrieval_token_budget': 1500,
             'prompts': {
-                'continue': '设定参考：\n{setting}\n\n请根据上文内容，继续写作，保持风格和语气一致：\n\n{context}',
+                'continue': '设定参考：\n{setting}\n\n前文中的相关片段：\n{retrieved}\n\n请根据上文内容，继续写作，保持风格和语气一致：\n\n{context}',
                 'expand': '设定参考：\n{setting}\n\n请将以下内容进行扩写，增加更多细节和描述，但保持原意不变：\n\n{context}',
                 'summarize': '设定参考：\n{setting}\n\n请将以下内容进行缩写，保留核心信息，使其更加简洁：\n\n{context}',
-                'custom': '设定参考：\n{setting}\n\n{prompt}\n\n文本内容：\n{context}'
+                'custom': '设定参考：\n{setting}\n\n{prompt}\n\n文本内容：\n{context}',
+                'reduce': '设定参考：\n{setting}\n\n以下是一段长文本按顺序分段缩写的结果，请将它们合并为一篇连贯的缩写，去掉重复内容，保留核心信息：\n\n{context}'
             }
         }
         
         if self.work_dir:
-            config_path = os.path.join(self.work_dir, 'ai_config.json')
-            if os.path.exists(config_path):
-                try:
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        loaded_config = json.load(f)
-                        # 合并配置
-                        for key in default_config:
-                            if key in loaded_config:
-                                if isinstance(default_config[key], dict):
-                                    default_config[key].update(loaded_config[key])
-                                else:
-                                    default_config[key] = loaded_config[key]
-                except Exception as e:
-                    print(f"加载AI配置失败: {e}")
-                    
+            loaded_config = self.config_store().get() or {}
+            # 合并配置
+            for key in default_config:
+                if key in loaded_config:
+                    if isinstance(default_config[key], dict):
+                        default_config[key].update(loaded_config[key])
+                    else:
+                        default_config[key] = loaded_config[key]
+                        
+        prompts = default_config['prompts']
+        prompts['continue'] = LEGACY_CONTINUE_PROMPTS.get(prompts['continue'], prompts['continue'])
         return default_config
         
+    def set_workspace(self, root_path):
+        """切换记录用量的工作区"""
+        self.root_path = root_path
+        
+    def usage_ledger(self):
+        """当前工作区的用量记录"""
+        return UsageLedger(self.work_dir, self.root_path)
+        
+    def config_store(self):
+        """AI配置的共享存储"""
+        return get_store(os.path.join(self.work_dir, 'ai_config.json'), pretty=True)
+        
     def save_config(self):
         """保存配置"""
         if self.work_dir:
-            config_path = os.path.join(self.work_dir, 'ai_config.json')
-            try:
-                with open(config_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.config, f, ensure_ascii=False, indent=2)
-            except Exception as e:
-                print(f"保存AI配置失败: {e}")
+            self.config_store().set(self.config)
                 
     def get_setting_content(self):
         """获取“设定”目录下的所有文本内容"""
-        if not self.work_dir:
-            return ""
+        all_content = []
+        for file_path in setting_files(self.work_dir):
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    all_content.append(f.read())
+            except Exception as e:
+                print(f"读取设定文件失败: {file_path}, {e}")
 
-        categories_path = os.path.join(self.work_dir, 'directory_categories.json')
-        if not os.path.exists(categories_path):
-            return ""
+        return "\n\n".join(all_content)
 
+    def get_retrieved_content(self, context, file_path=None):
+        """检索其他正文章节中与上文末尾相关的片段，不超过token预算"""
+        budget = int(self.config.get('retrieval_token_budget', 1500))
+        if self.retriever is None or budget <= 0:
+            return ""
         try:
-            with open(categories_path, 'r', encoding='utf-8') as f:
-                categories = json.load(f)
+            return self.retriever.retrieve(context, file_path, budget)
         except Exception as e:
-            print(f"加载目录分类失败: {e}")
+            print(f"检索前文失败: {e}")
             return ""
 
-        setting_dirs = [path for path, category in categories.items() if category == '设定']
-
-        all_content = []
-        for setting_dir in setting_dirs:
-            if os.path.isdir(setting_dir):
-                for filename in sorted(os.listdir(setting_dir)):
-                    file_path = os.path.join(setting_dir, filename)
-                    if os.path.isfile(file_path) and filename.endswith(('.txt', '.md')):
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                all_content.append(f.read())
-                        except Exception as e:
-                            print(f"读取设定文件失败: {file_path}, {e}")
-
-        return "\n\n".join(all_content)
-
-    def get_continue_prompt(self, context):
+    def get_continue_prompt(self, context, file_path=None):
         """获取续写提示词"""
         setting_content = self.get_setting_content()
-        return self.config['prompts']['continue'].format(context=context, setting=setting_content)
+        template = self.config['prompts']['continue']
+        retrieved = self.get_retrieved_content(context, file_path)
+        prompt = template.format(context=context, setting=setting_content, retrieved=retrieved or "无")
+        if retrieved and '{retrieved}' not in template:
+            # 自定义的提示词中没有占位符时放在最前面
+            prompt = f"前文中的相关片段：\n{retrieved}\n\n{prompt}"
+        return prompt
         
     def get_expand_prompt(self, context):
         """获取扩写提示词"""
@@ -108,101 +141,90 @@ class AIHandler:
         setting_content = self.get_setting_content()
         return self.config['prompts']['custom'].format(context=context, prompt=prompt, setting=setting_content)
         
-    def generate_stream(self, prompt):
-        """流式生成文本"""
-        if not self.config.get('api_key'):
-            raise ValueError("请先配置API Key")
-            
-        headers = {
-            'Authorization': f"Bearer {self.config['api_key']}",
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'model': self.config['model'],
-            'messages': [
-                {'role': 'user', 'content': prompt}
-            ],
-            'stream': True,
-            'temperature': 0.7,
-            'max_tokens': 1000
-        }
-        
-        url = f"{self.config['base_url']}/chat/completions"
+    def format_prompt(self, action, context, setting, prompt=None):
+        """用已读取的设定内容构建提示词，分段处理时设定只读取一次"""
+        return self.config['prompts'][action].format(context=context, prompt=prompt, setting=setting, retrieved="无")
         
-        try:
-            response = requests.post(url, headers=headers, json=data, stream=True)
-            response.raise_for_status()
-            
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        line = line[6:]
-                        if line == '[DONE]':
-                            break
-                            
-                        try:
-                            chunk_data = json.loads(line)
-                            if 'choices' in chunk_data and chunk_data['choices']:
-                                delta = chunk_data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API请求失败: {str(e)}")
+    def generate_stream(self, prompt, action='generate'):
+        """流式生成文本"""
+        return self.stream_completion('generate', [{'role': 'user', 'content': prompt}],
+                                      {'temperature': 0.7, 'max_tokens': 1000}, action)
             
-    def chat(self, messages):
+    def chat(self, messages, action='chat'):
         """聊天接口"""
-        if not self.config.get('api_key'):
-            raise ValueError("请先配置API Key")
-            
-        headers = {
-            'Authorization': f"Bearer {self.config['api_key']}",
-            'Content-Type': 'application/json'
-        }
+        return self.stream_completion('chat', messages, {'temperature': 0.7}, action)
         
-        data = {
-            'model': self.config['model'],
-            'messages': messages,
-            'stream': True,
-            'temperature': 0.7
-        }
+    def backend_for(self, action, capability=None):
+        """获取动作使用的生成后端（config['action_backends']中按动作配置，默认远程）
+
+        配置的后端不支持capability时改用远程后端。
+        """
+        name = self.config.get('action_backends', {}).get(action, 'openai')
+        if name not in BACKENDS or (capability and capability not in BACKENDS[name].capabilities):
+            name = 'openai'
+        backend = self.backends.get(name)
+        if backend is None:
+            backend = self.backends[name] = BACKENDS[name](self.config)
+        # 设置对话框保存后config会被整体替换
+        backend.config = self.config
+        return backend
         
-        url = f"{self.config['base_url']}/chat/completions"
+    def cancel(self):
+        """中止这个AIHandler上所有进行中的请求"""
+        for backend in self.backends.values():
+            backend.cancel()
         
+    def stream_completion(self, kind, messages, params, action):
+        """发送流式请求，逐块产生生成的文本
+
+        与正在进行的相同请求（后端、模型、参数和消息都相同）共用一个上游请求，
+        每个调用方都从头收到完整的文本，可以各自中止。
+        """
+        backend = self.backend_for(action, 'chat' if kind == 'chat' else None)
+        key = request_key({'backend': backend.identity(), 'kind': kind, 'messages': messages, 'params': params,
+                           'request_usage': self.config.get('request_usage', True)})
+        report = {}
+        return request_registry().stream(
+            key, lambda: self.stream_upstream(backend, kind, messages, params, action, report),
+            lambda: backend.cancel_request(report))
+        
+    def stream_upstream(self, backend, kind, messages, params, action, report):
+        """通过后端发送请求，逐块产生生成的文本，结束（或中止）后记录用量"""
+        pieces = []
+        stream = None
         try:
-            response = requests.post(url, headers=headers, json=data, stream=True)
-            response.raise_for_status()
+            if kind == 'generate':
+                stream = backend.generate(messages[0]['content'], params, report)
+            else:
+                stream = backend.chat(messages, params, report)
+            for chunk in stream:
+                pieces.append(chunk)
+                yield chunk
+        finally:
+            if stream is not None:
+                stream.close()
+            if report.get('model'):
+                self.record_usage(report['model'], action, messages, ''.join(pieces), report.get('usage'))
             
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        line = line[6:]
-                        if line == '[DONE]':
-                            break
-                            
-                        try:
-                            chunk_data = json.loads(line)
-                            if 'choices' in chunk_data and chunk_data['choices']:
-                                delta = chunk_data['choices'][0].get('delta', {})
-                                content = delta.get('content', '')
-                                if content:
-                                    yield content
-                        except json.JSONDecodeError:
-                            continue
-                            
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"API请求失败: {str(e)}")
+    def record_usage(self, model, action, messages, completion, usage):
+        """记录一次请求的用量，接口没有返回用量时按估算记录"""
+        if not self.work_dir:
+            return
+        try:
+            if usage:
+                self.usage_ledger().record(model, action, int(usage.get('prompt_tokens', 0)),
+                                           int(usage.get('completion_tokens', 0)))
+            else:
+                self.usage_ledger().record(model, action, count_message_tokens(messages),
+                                           count_tokens(completion), estimated=True)
+        except Exception as e:
+            print(f"记录用量失败: {e}")
 
 
 class AIWorker(QObject):
     """AI工作线程"""
     chunk_received = pyqtSignal(str)
+    prompt_built = pyqtSignal(int)  # 提示词的token数
     finished = pyqtSignal()
     error = pyqtSignal(str)
     
@@ -212,6 +234,7 @@ class AIWorker(QObject):
         self.action = action
         self.context = context
         self.custom_prompt = None
+        self.file_path = None  # 续写时检索前文，排除当前文件
         self._stop_requested = False
         
     def stop(self):
@@ -223,7 +246,7 @@ class AIWorker(QObject):
         try:
             # 根据动作类型构建提示词
             if self.action == 'continue':
-                prompt = self.ai_handler.get_continue_prompt(self.context)
+                prompt = self.ai_handler.get_continue_prompt(self.context, self.file_path)
             elif self.action == 'expand':
                 prompt = self.ai_handler.get_expand_prompt(self.context)
             elif self.action == 'summarize':
@@ -235,7 +258,8 @@ class AIWorker(QObject):
                 return
             print(prompt)    
             # 调用OpenAI API
-            for chunk in self.ai_handler.generate_stream(prompt):
+            self.prompt_built.emit(count_tokens(prompt))
+            for chunk in self.ai_handler.generate_stream(prompt, self.action):
                 if self._stop_requested:
                     break
                 self.chunk_received.emit(chunk)
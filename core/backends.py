@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import threading
+
+from core.endpoints import endpoint_pool, endpoint_key, configured_endpoints, StreamAttempt
+
+
+DEFAULT_LOCAL_URL = 'http://127.0.0.1:8080'
+
+BACKEND_NAMES = {
+    'openai': '远程（OpenAI接口）',
+    'local': '本地模型',
+}
+
+
+class GenerationBackend:
+    """生成后端接口
+
+    generate/chat 返回逐块产生文本的迭代器，report字典中写入实际使用的模型（'model'）
+    和接口返回的用量（'usage'），请求没有发出时不写入。关闭迭代器即中止该请求；
+    迭代器在其他线程中阻塞等待时用 cancel_request(report) 中止，
+    cancel() 中止这个后端上所有进行中的请求。
+    """
+    name = ''
+    # 'chat': 支持多轮对话（不支持时对话请求改用远程后端）, 'usage': 可返回实际用量（支持时才请求用量）,
+    # 'failover': 多端点切换, 'raw_completion': 原样续写提示词
+    capabilities = frozenset()
+
+    def __init__(self, config):
+        self.config = config
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def identity(self):
+        """后端的标识，相同标识的相同请求可以合并"""
+        return (self.name,)
+
+    def generate(self, prompt, params, report):
+        """根据单个提示词生成文本"""
+        return self.chat([{'role': 'user', 'content': prompt}], params, report)
+
+    def chat(self, messages, params, report):
+        """根据对话消息生成文本"""
+        raise NotImplementedError
+
+    def request_usage(self, data):
+        """后端支持并且设置中开启时，请求在最后一块数据中返回实际用量"""
+        if 'usage' in self.capabilities and self.config.get('request_usage', True):
+            data['stream_options'] = {'include_usage': True}
+
+    def cancel(self):
+        """中止所有进行中的请求"""
+        with self.lock:
+            attempts = list(self.active)
+        for attempt in attempts:
+            attempt.cancel()
+
+    def cancel_request(self, report):
+        """中止report对应的请求，不再发起新的尝试"""
+        report['cancelled'] = True
+        for attempt in list(report.get('attempts', ())):
+            attempt.cancel()
+
+    def run_attempts(self, endpoints, data, report, hedge_delay=0.0, pool=None):
+        """依次（或对冲地）向端点发送流式请求，产生第一个返回首字的端点的文本
+
+        收到首字前连接失败或返回5xx时换下一个端点；hedge_delay大于0时，首字超过
+        这个时间还没有到达就同时请求下一个端点，先返回首字的胜出，另一个被放弃。
+        pool不为None时把首字延迟和错误记入端点健康记录。
+        """
+        pending = list(endpoints)
+        events = queue.Queue()
+        attempts = report['attempts'] = []
+
+        def launch():
+            if report.get('cancelled'):
+                raise Exception("请求已取消")
+            attempt = StreamAttempt(pending.pop(0), data, events)
+            attempts.append(attempt)
+            with self.lock:
+                self.active.add(attempt)
+            attempt.start()
+            return time.monotonic() + hedge_delay if hedge_delay and pending else None
+
+        hedge_at = launch()
+        winner = None
+        try:
+            while True:
+                timeout = None if winner is not None or hedge_at is None else max(0, hedge_at - time.monotonic())
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    # 首字迟迟未到，同时请求下一个端点
+                    hedge_at = launch()
+                    continue
+                if winner is not None and attempt is not winner:
+                    continue
+
+                if kind == 'chunk':
+                    if winner is None:
+                        winner = attempt
+                        report['model'] = attempt.endpoint['model']
+                        if pool:
+                            pool.record_success(attempt.endpoint, attempt.first_token_at - attempt.started_at)
+                        for other in attempts:
+                            if other is not attempt and not other.cancelled:
+                                other.cancel()
+                                if pool:
+                                    pool.record_slow(other.endpoint, time.monotonic() - other.started_at)
+                    yield value
+                elif kind == 'usage':
+                    report['usage'] = value
+                elif kind == 'done':
+                    if winner is None:
+                        winner = attempt
+                        report['model'] = attempt.endpoint['model']
+                    break
+                elif kind == 'error':
+                    attempt.cancelled = True
+                    if pool and not value.cancelled:
+                        pool.record_failure(attempt.endpoint, value.retryable)
+                    if winner is attempt:
+                        raise Exception(f"API请求失败: {value}")
+                    if any(not other.cancelled for other in attempts):
+                        # 同时进行的另一个请求还可能成功
+                        continue
+                    if value.retryable and pending:
+                        print(f"{value}，改用 {pending[0]['name']}")
+                        hedge_at = launch()
+                        continue
+                    raise Exception(f"API请求失败: {value}")
+        finally:
+            with self.lock:
+                for attempt in attempts:
+                    self.active.discard(attempt)
+            for attempt in attempts:
+                if not attempt.cancelled:
+                    attempt.cancel()
+
+
+class OpenAIBackend(GenerationBackend):
+    """OpenAI /chat/completions 接口，支持多个端点的健康路由、失败切换和首字对冲"""
+    name = 'openai'
+    capabilities = frozenset({'chat', 'usage', 'failover'})
+
+    def identity(self):
+        return (self.name, tuple(endpoint_key(endpoint) for endpoint in configured_endpoints(self.config)))
+
+    def chat(self, messages, params, report):
+        pool = endpoint_pool()
+        endpoints = pool.candidates(self.config)
+        if not endpoints:
+            raise ValueError("请先配置API Key")
+
+        data = dict(params, model=self.config['model'], messages=messages, stream=True)
+        self.request_usage(data)
+        hedge_delay = max(0, int(self.config.get('hedge_delay', 0))) / 1000
+        return self.run_attempts(endpoints, data, report, hedge_delay, pool)
+
+
+class LocalBackend(GenerationBackend):
+    """本机运行的模型服务
+
+    'openai' 模式请求OpenAI兼容的 /v1/chat/completions（llama.cpp server、Ollama、LM Studio等都支持）；
+    'llamacpp' 模式下单个提示词的生成使用llama.cpp原生的 /completion 接口原样续写，对话仍使用兼容接口。
+    本地服务没有网络延迟，不做失败切换和对冲。
+    """
+    name = 'local'
+    capabilities = frozenset({'chat', 'usage', 'raw_completion'})
+
+    def local_config(self):
+        return self.config.get('local_backend', {})
+
+    def base_url(self):
+        return (self.local_config().get('base_url') or DEFAULT_LOCAL_URL).rstrip('/')
+
+    def model(self):
+        return self.local_config().get('model') or 'local'
+
+    def identity(self):
+        local = self.local_config()
+        return (self.name, self.base_url(), self.model(), local.get('api', 'openai'))
+
+    def endpoint(self, path):
+        return {
+            'name': '本地模型',
+            'base_url': self.base_url(),
+            'path': path,
+            'api_key': self.local_config().get('api_key') or 'local',
+            'model': self.model(),
+        }
+
+    def generate(self, prompt, params, report):
+        if self.local_config().get('api', 'openai') != 'llamacpp':
+            return super().generate(prompt, params, report)
+        data = {
+            'prompt': prompt,
+            'stream': True,
+            'temperature': params.get('temperature', 0.7),
+            'n_predict': params.get('max_tokens', -1),
+        }
+        return self.run_attempts([self.endpoint('/completion')], data, report)
+
+    def chat(self, messages, params, report):
+        data = dict(params, model=self.model(), messages=messages, stream=True)
+        self.request_usage(data)
+        return self.run_attempts([self.endpoint('/v1/chat/completions')], data, report)
+
+
+BACKENDS = {
+    OpenAIBackend.name: OpenAIBackend,
+    LocalBackend.name: LocalBackend,
+}
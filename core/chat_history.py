@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from core.tokens import estimate_tokens, estimate_message_tokens
+
+
+DEFAULT_TOKEN_BUDGET = 4000
+
+SUMMARY_PROMPT = (
+    "下面是一段写作助手与作者之间的对话。请把“已有摘要”和“新的对话”合并成一份新的摘要，"
+    "保留人物、设定、情节走向、作者提出的要求和已做出的决定，以及尚未解决的问题，"
+    "去掉寒暄和重复内容，不超过{limit}字，直接输出摘要。\n\n"
+    "## 已有摘要\n{summary}\n\n## 新的对话\n{dialogue}"
+)
+
+
+class SummaryWorker(QObject):
+    """在后台生成对话摘要"""
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, ai_handler, prompt):
+        super().__init__()
+        self.ai_handler = ai_handler
+        self.prompt = prompt
+
+    def run(self):
+        try:
+            summary = ''.join(self.ai_handler.chat([{'role': 'user', 'content': self.prompt}], 'summary'))
+            self.finished.emit(summary.strip())
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ChatHistoryManager(QObject):
+    """在token预算内管理对话历史
+
+    最近的对话原样保留，超出预算的早期对话在后台合并进滚动摘要，
+    发送给AI的消息为“摘要 + 最近的对话”。
+    """
+    changed = pyqtSignal()  # 摘要或占用的token数变化
+    summary_ready = pyqtSignal(str, int)  # 新摘要, 摘要覆盖的最后一条消息的序号
+
+    def __init__(self, ai_handler, parent=None):
+        super().__init__(parent)
+        self.ai_handler = ai_handler
+        self.turns = []  # 原样保留的消息
+        self.folding = []  # 等待合并进摘要的消息
+        self.summary = ""
+        self.summarized_count = 0  # 已合并进摘要的消息数
+        self.summary_thread = None
+        self.summary_worker = None
+        self.summary_batch = 0
+
+    def budget(self):
+        """对话历史的token预算"""
+        return int(self.ai_handler.config.get('chat_token_budget', DEFAULT_TOKEN_BUDGET))
+
+    def summary_message(self):
+        """把摘要作为系统消息放在对话之前"""
+        return {'role': 'system', 'content': f"此前对话的摘要：\n{self.summary}"}
+
+    def used_tokens(self):
+        """下一次请求中历史部分占用的token数"""
+        messages = self.pending_messages() + self.turns + ([self.summary_message()] if self.summary else [])
+        return estimate_message_tokens(messages)
+
+    def pending_messages(self):
+        """尚未合并进摘要的消息中预算还能容纳的最近部分，摘要完成前（或失败时）它们不会从请求中消失"""
+        remaining = self.budget() - estimate_message_tokens(
+            self.turns + ([self.summary_message()] if self.summary else []))
+        start = len(self.folding)
+        while start > 0 and estimate_message_tokens(self.folding[start - 1:start]) <= remaining:
+            start -= 1
+            remaining -= estimate_message_tokens(self.folding[start:start + 1])
+        # 与保留的对话一样以用户消息开头
+        while start < len(self.folding) and self.folding[start]['role'] != 'user':
+            start += 1
+        return self.folding[start:]
+
+    def add(self, role, content, seq=None):
+        """追加一条消息，超出预算时把最早的对话移出并安排摘要"""
+        self.turns.append({'role': role, 'content': content, 'seq': seq})
+        self.trim()
+
+    def restore(self, summary, summarized_count, messages):
+        """从对话记录恢复摘要和最近的消息"""
+        self.clear()
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.turns = [{'role': message['role'], 'content': message['content'], 'seq': message.get('seq')}
+                      for message in messages]
+        self.trim()
+
+    def trim(self):
+        """超出预算时把最早的对话移出并安排摘要"""
+        # 摘要本身也占用预算，最多给它四分之一
+        budget = self.budget() - min(estimate_tokens(self.summary), self.budget() // 4)
+        while len(self.turns) > 2 and estimate_message_tokens(self.turns) > budget:
+            self.folding.append(self.turns.pop(0))
+        # 保留的对话以用户消息开头
+        while len(self.turns) > 1 and self.turns[0]['role'] != 'user':
+            self.folding.append(self.turns.pop(0))
+
+        self.start_summary()
+        self.changed.emit()
+
+    def build_messages(self, context=""):
+        """构建发送给AI的消息，context附加到最后一条用户消息之前，不写入历史"""
+        messages = [self.summary_message()] if self.summary else []
+        messages.extend({'role': message['role'], 'content': message['content']}
+                        for message in self.pending_messages() + self.turns)
+        if context and messages and messages[-1]['role'] == 'user':
+            messages[-1]['content'] = f"{context}\n\n{messages[-1]['content']}"
+        return messages
+
+    def clear(self):
+        """清空历史和摘要，进行中的摘要结果会被丢弃"""
+        self.turns = []
+        self.folding = []
+        self.summary = ""
+        self.summarized_count = 0
+        self.summary_batch = 0
+        self.changed.emit()
+
+    def start_summary(self):
+        """在后台把等待中的对话合并进摘要"""
+        if self.summary_thread is not None or not self.folding:
+            return
+
+        self.summary_batch = len(self.folding)
+        dialogue = "\n".join(
+            f"{'作者' if message['role'] == 'user' else 'AI'}: {message['content']}"
+            for message in self.folding)
+        limit = max(200, self.budget() // 4)
+        prompt = SUMMARY_PROMPT.format(limit=limit, summary=self.summary or "（无）", dialogue=dialogue)
+
+        self.summary_thread = QThread()
+        self.summary_worker = SummaryWorker(self.ai_handler, prompt)
+        self.summary_worker.moveToThread(self.summary_thread)
+        self.summary_thread.started.connect(self.summary_worker.run)
+        self.summary_worker.finished.connect(self.on_summary_finished)
+        self.summary_worker.error.connect(self.on_summary_error)
+        self.summary_thread.start()
+
+    def stop_summary(self):
+        """结束摘要线程"""
+        if self.summary_thread:
+            self.summary_thread.quit()
+            self.summary_thread.wait()
+            self.summary_thread = None
+        self.summary_worker = None
+
+    def on_summary_finished(self, summary):
+        """摘要完成，移除已合并的消息，有新的等待消息时继续"""
+        self.stop_summary()
+        if summary and self.summary_batch:
+            self.summary = summary
+            self.summarized_count += self.summary_batch
+            upto = self.folding[self.summary_batch - 1].get('seq')
+            del self.folding[:self.summary_batch]
+            if upto is not None:
+                self.summary_ready.emit(summary, upto)
+        self.summary_batch = 0
+        self.changed.emit()
+        self.start_summary()
+
+    def on_summary_error(self, error_msg):
+        """摘要失败时保留等待的消息，下次添加消息时重试"""
+        self.stop_summary()
+        self.summary_batch = 0
+        self.changed.emit()
+        print(f"生成对话摘要失败: {error_msg}")
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+
+
+BLOCK_SIZE = 64 * 1024
+
+
+def read_lines_reverse(file_path, end=None):
+    """从文件末尾（或end位置）向前逐行读取，产生 (行起始位置, 行内容)"""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell() if end is None else min(end, f.tell())
+        remainder = b''
+        while position > 0:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size) + remainder
+            lines = block.split(b'\n')
+            # 第一段可能是不完整的行，留到读取前一块时拼接
+            remainder = lines.pop(0)
+            offset = position + len(remainder) + 1
+            starts = []
+            for line in lines:
+                starts.append((offset, line))
+                offset += len(line) + 1
+            for start, line in reversed(starts):
+                if line.strip():
+                    yield start, line
+        if remainder.strip():
+            yield 0, remainder
+
+
+class ChatTranscript:
+    """对话记录
+
+    每个对话是缓存目录中的一个只追加的JSONL文件，每行一条记录：
+    消息 {"seq", "role", "content", "time"}，摘要 {"type": "summary", "summary", "upto"}，
+    其中upto是摘要已覆盖的最后一条消息的序号。
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.conversation_id = None
+        self.next_seq = 0
+
+    def file_path(self, conversation_id=None):
+        return os.path.join(self.directory, (conversation_id or self.conversation_id) + '.jsonl')
+
+    def conversations(self):
+        """按时间排序的对话id列表"""
+        return sorted(name[:-6] for name in os.listdir(self.directory) if name.endswith('.jsonl'))
+
+    def open_latest(self):
+        """打开最近的对话，没有时新建"""
+        conversations = self.conversations()
+        if not conversations:
+            return self.new_conversation()
+        self.conversation_id = conversations[-1]
+        self.next_seq = 0
+        for _, record in self.records_reverse():
+            if 'seq' in record:
+                self.next_seq = record['seq'] + 1
+                break
+        return self.conversation_id
+
+    def new_conversation(self):
+        """新建对话（第一条消息写入时才创建文件）"""
+        self.conversation_id = time.strftime('%Y%m%d-%H%M%S')
+        self.next_seq = 0
+        return self.conversation_id
+
+    def append(self, record):
+        """追加一条记录"""
+        with open(self.file_path(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def append_message(self, role, content):
+        """追加一条消息，返回其序号"""
+        seq = self.next_seq
+        self.next_seq += 1
+        self.append({'seq': seq, 'role': role, 'content': content, 'time': int(time.time())})
+        return seq
+
+    def append_summary(self, summary, upto):
+        """追加一条摘要记录"""
+        self.append({'type': 'summary', 'summary': summary, 'upto': upto})
+
+    def records_reverse(self, end=None):
+        """从后向前读取记录，产生 (行起始位置, 记录)"""
+        file_path = self.file_path()
+        if not os.path.exists(file_path):
+            return
+        for start, line in read_lines_reverse(file_path, end):
+            try:
+                yield start, json.loads(line.decode('utf-8'))
+            except ValueError:
+                # 崩溃时可能留下不完整的最后一行
+                continue
+
+    def load_page(self, end=None, limit=50):
+        """读取end位置之前的最多limit条消息
+
+        返回 (按时间顺序的消息列表, 下一页的结束位置)，没有更早的消息时位置为None。
+        """
+        messages = []
+        start = None
+        for start, record in self.records_reverse(end):
+            if 'seq' in record:
+                messages.append(record)
+                if len(messages) >= limit:
+                    break
+        else:
+            start = None
+        messages.reverse()
+        return messages, start
+
+    def load_context(self, token_limit, estimate):
+        """从记录末尾重建发给模型的历史，不读取整个文件
+
+        返回 (摘要, 摘要覆盖的消息数, 摘要之后的消息)。向前读到最近一次摘要覆盖的位置为止；
+        没有摘要时最多读取token_limit个token的消息。
+        """
+        summary = None
+        upto = -1
+        messages = []
+        tokens = 0
+        for _, record in self.records_reverse():
+            if record.get('type') == 'summary':
+                if summary is None:
+                    summary = record['summary']
+                    upto = record['upto']
+                continue
+            if 'seq' not in record:
+                continue
+            if summary is not None and record['seq'] <= upto:
+                break
+            messages.append(record)
+            tokens += estimate(record['content'])
+            if tokens > token_limit:
+                break
+        messages.reverse()
+        return summary or "", upto + 1, messages
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.tokens import estimate_tokens, count_tokens
+
+
+DEFAULT_CHUNK_TOKENS = 3000  # 每段的token上限，超过时分段处理
+DEFAULT_CONCURRENCY = 4  # 同时处理的段数
+
+# 过长的段落在句末标点之后切开
+SENTENCE_END = re.compile(r'(?<=[。！？!?…」』”.])')
+
+
+def split_long_paragraph(paragraph, limit):
+    """把超过上限的段落按句子切开，单个句子仍然过长时按长度切开"""
+    pieces = []
+    current = ""
+    for sentence in SENTENCE_END.split(paragraph):
+        if not sentence:
+            continue
+        if current and estimate_tokens(current + sentence) > limit:
+            pieces.append(current)
+            current = ""
+        while estimate_tokens(sentence) > limit:
+            # 每个token至少对应一个字符，按limit个字符切开一定不超过上限
+            pieces.append(sentence[:limit])
+            sentence = sentence[limit:]
+        current += sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_chunks(text, limit=DEFAULT_CHUNK_TOKENS):
+    """在段落边界把文本分成不超过limit个token的若干段，返回段落文本列表"""
+    # QTextCursor.selectedText() 用U+2029分隔段落
+    paragraphs = text.replace('\u2029', '\n').split('\n')
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = estimate_tokens(paragraph) + 1
+        if tokens > limit:
+            pieces = split_long_paragraph(paragraph, limit)
+        else:
+            pieces = [paragraph]
+        for piece in pieces:
+            tokens = estimate_tokens(piece) + 1
+            if current and current_tokens + tokens > limit:
+                chunks.append('\n'.join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class ChunkedWorker(QObject):
+    """分段处理过长的选中文本
+
+    各段并发请求，结果按原文顺序输出：排在最前面的未完成段实时流式输出，
+    后面的段先缓存，轮到时再一次输出。缩写可以再把各段结果合并一次（reduce），
+    合并前发出restart，编辑器删除已插入的分段结果，改为输出合并后的结果。
+    信号与AIWorker相同，另有progress和restart。
+    """
+    chunk_received = pyqtSignal(str)
+    prompt_built = pyqtSignal(int)
+    progress = pyqtSignal(int, int)  # 已完成的段数, 总段数
+    restart = pyqtSignal()
+    finished = pyqtSignal()
+    error = pyqtSignal(str)
+
+    def __init__(self, ai_handler, action, context):
+        super().__init__()
+        self.ai_handler = ai_handler
+        self.action = action
+        self.context = context
+        self.custom_prompt = None
+        self._stop_requested = False
+        self.condition = threading.Condition()
+        self.outputs = []  # 每段已收到的文本块
+        self.done = []
+        self.failure = None
+
+    def stop(self):
+        """请求停止生成"""
+        with self.condition:
+            self._stop_requested = True
+            self.condition.notify_all()
+
+    def process(self, index, prompt):
+        """在线程池中处理一段"""
+        try:
+            if self._stop_requested or self.failure:
+                return
+            for chunk in self.ai_handler.generate_stream(prompt, self.action):
+                with self.condition:
+                    if self._stop_requested or self.failure:
+                        break
+                    self.outputs[index].append(chunk)
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.failure = self.failure or str(e)
+        finally:
+            with self.condition:
+                self.done[index] = True
+                self.condition.notify_all()
+
+    def emit_in_order(self, count):
+        """按顺序输出各段的结果，返回各段的完整文本；停止或出错时返回None"""
+        results = []
+        for index in range(count):
+            emitted = 0
+            while True:
+                with self.condition:
+                    while (emitted >= len(self.outputs[index]) and not self.done[index]
+                           and not self._stop_requested and not self.failure):
+                        self.condition.wait()
+                    if self._stop_requested or self.failure:
+                        return None
+                    pieces = self.outputs[index][emitted:]
+                    finished = self.done[index] and emitted + len(pieces) >= len(self.outputs[index])
+                for piece in pieces:
+                    self.chunk_received.emit(piece)
+                emitted += len(pieces)
+                if finished:
+                    break
+            results.append(''.join(self.outputs[index]))
+            self.progress.emit(index + 1, count)
+            if index + 1 < count:
+                self.chunk_received.emit('\n')
+        return results
+
+    def reduce_to_limit(self, results, setting, limit, workers):
+        """各段结果合在一起超过分段上限时，先分组合并，直到不超过上限；停止时返回None"""
+        handler = self.ai_handler
+        merged = '\n\n'.join(results)
+        while estimate_tokens(merged) > limit:
+            groups = split_chunks(merged, limit)
+            if len(groups) <= 1:
+                break
+            prompts = [handler.format_prompt('reduce', group, setting) for group in groups]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                reduced = list(executor.map(self.collect, prompts))
+            if self._stop_requested:
+                return None
+            shorter = '\n\n'.join(reduced)
+            if estimate_tokens(shorter) >= estimate_tokens(merged):
+                break  # 合并后没有变短，不再继续
+            merged = shorter
+        return merged
+
+    def collect(self, prompt):
+        """完整生成一段不直接输出的中间结果"""
+        pieces = []
+        for chunk in self.ai_handler.generate_stream(prompt, 'summarize'):
+            if self._stop_requested:
+                break
+            pieces.append(chunk)
+        return ''.join(pieces)
+
+    def run(self):
+        """执行分段生成"""
+        try:
+            handler = self.ai_handler
+            config = handler.config
+            chunks = split_chunks(self.context, int(config.get('chunk_token_limit', DEFAULT_CHUNK_TOKENS)))
+            setting = handler.get_setting_content()
+            prompts = [handler.format_prompt(self.action, chunk, setting, self.custom_prompt) for chunk in chunks]
+            self.prompt_built.emit(sum(count_tokens(prompt) for prompt in prompts))
+            self.outputs = [[] for _ in chunks]
+            self.done = [False] * len(chunks)
+            self.progress.emit(0, len(chunks))
+
+            workers = max(1, int(config.get('chunk_concurrency', DEFAULT_CONCURRENCY)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for index, prompt in enumerate(prompts):
+                    executor.submit(self.process, index, prompt)
+                results = self.emit_in_order(len(chunks))
+                if results is None:
+                    self.stop()
+
+            if self.failure:
+                self.error.emit(self.failure)
+                return
+            if results is None:
+                self.finished.emit()
+                return
+
+            # 缩写时把各段的结果再合并一次
+            if self.action == 'summarize' and len(results) > 1 and config.get('reduce_summaries', True):
+                limit = int(config.get('chunk_token_limit', DEFAULT_CHUNK_TOKENS))
+                merged = self.reduce_to_limit(results, setting, limit, workers)
+                if merged is None:
+                    self.finished.emit()
+                    return
+                prompt = handler.format_prompt('reduce', merged, setting)
+                self.prompt_built.emit(count_tokens(prompt))
+                restarted = False
+                for chunk in handler.generate_stream(prompt, 'summarize'):
+                    if self._stop_requested:
+                        break
+                    # 合并的结果开始返回后才替换各段的结果，合并失败时保留各段的结果
+                    if not restarted:
+                        self.restart.emit()
+                        restarted = True
+                    self.chunk_received.emit(chunk)
+
+            self.finished.emit()
+
+        except Exception as e:
+            self.error.emit(str(e))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.entities import AhoCorasick
+from core.file_index import workspace_cache_dir
+from core.state_store import get_store
+from core.text_stats import collect_text_files
+
+
+FUZZY_MIN_LENGTH = 3  # 两个字的名字只差一个字时大多是别的词，不检查
+POSITION_LIMIT = 50  # 每个章节中每个实体最多记录的位置数
+SNIPPET_CONTEXT = 12  # 疑似错别字前后保留的字数
+INLINE_SCAN_BYTES = 256 * 1024  # 待扫描的内容少于这个大小时直接在线程中扫描，不启动进程池
+
+
+def consistency_file(work_dir, root_path):
+    """工作区一致性检查缓存文件"""
+    cache_dir = workspace_cache_dir(work_dir, root_path) if root_path else os.path.join(work_dir, 'cache')
+    return os.path.join(cache_dir, 'consistency.json')
+
+
+def file_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def decode_text(data):
+    """与编辑器中的位置一致：统一换行符"""
+    return data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class EntityMatcher:
+    """在章节中查找实体名和只差一个字的疑似错别字"""
+    def __init__(self, names):
+        self.automaton = AhoCorasick(names) if names else None
+        # 只差一个字时，前两个字中至少有一个相同，按第一、第二个字索引候选名字
+        self.by_first = {}
+        self.by_second = {}
+        for name in names:
+            if len(name) >= FUZZY_MIN_LENGTH:
+                self.by_first.setdefault(name[0], []).append(name)
+                self.by_second.setdefault(name[1], []).append(name)
+
+    def scan(self, text):
+        """返回 {'counts': {名称: 次数}, 'positions': {名称: [位置]}, 'variants': {写法: [名称, [[位置, 上下文]]]}}"""
+        counts = {}
+        positions = {}
+        covered = bytearray(len(text) + 1)
+        if self.automaton is not None:
+            for start, end in self.automaton.find(text):
+                name = text[start:end]
+                counts[name] = counts.get(name, 0) + 1
+                found = positions.setdefault(name, [])
+                if len(found) < POSITION_LIMIT:
+                    found.append(start)
+                covered[start:end] = b'\x01' * (end - start)
+
+        variants = {}
+        by_first, by_second = self.by_first, self.by_second
+        for position in range(len(text) - 1):
+            first, second = text[position], text[position + 1]
+            candidates = by_first.get(first, [])
+            for name in by_second.get(second, ()):
+                if name[0] != first:
+                    candidates = candidates + [name]
+            for name in candidates:
+                end = position + len(name)
+                window = text[position:end]
+                if len(window) != len(name) or window == name or covered.find(1, position, end) != -1:
+                    continue
+                differences = [index for index, (a, b) in enumerate(zip(window, name)) if a != b]
+                if len(differences) != 1 or not window[differences[0]].isalnum():
+                    continue
+                entry = variants.setdefault(window, [name, []])
+                if len(entry[1]) < POSITION_LIMIT:
+                    snippet = text[max(0, position - SNIPPET_CONTEXT):end + SNIPPET_CONTEXT].replace('\n', ' ')
+                    entry[1].append([position, snippet])
+                break
+
+        return {'counts': counts, 'positions': positions, 'variants': variants}
+
+
+_matcher = None  # 子进程中的匹配器，进程启动时构建一次
+
+
+def init_worker(names):
+    global _matcher
+    _matcher = EntityMatcher(names)
+
+
+def scan_file(file_path):
+    """在子进程中扫描一个章节，返回 (路径, 内容哈希, 结果)"""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    return file_path, file_digest(data), _matcher.scan(decode_text(data))
+
+
+class ConsistencyWorker(QObject):
+    """扫描所有正文章节中的实体出场和疑似错别字
+
+    按文件内容哈希缓存每个章节的结果，只重新扫描内容变化的章节；实体列表变化时全部重新扫描。
+    需要扫描的内容较多时使用进程池并行扫描。
+    """
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, work_dir, root_path, directories, names, max_workers=None):
+        super().__init__()
+        self.work_dir = work_dir
+        self.root_path = root_path
+        self.directories = directories
+        self.names = sorted(names)
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        """执行扫描"""
+        try:
+            store = get_store(consistency_file(self.work_dir, self.root_path), default={})
+            data = copy.deepcopy(store.get() or {})
+            names_key = file_digest('\n'.join(self.names).encode('utf-8'))
+            cached = data.get('files', {}) if data.get('names') == names_key else {}
+
+            chapters = []
+            for directory in self.directories:
+                chapters.extend(collect_text_files(directory))
+
+            # 内容没有变化的章节使用缓存
+            files = {}
+            to_scan = []
+            scan_bytes = 0
+            for file_path in chapters:
+                try:
+                    with open(file_path, 'rb') as f:
+                        content = f.read()
+                except OSError as e:
+                    print(f"读取章节失败: {file_path}, {e}")
+                    continue
+                entry = cached.get(file_path)
+                if entry and entry['hash'] == file_digest(content):
+                    files[file_path] = entry
+                else:
+                    to_scan.append(file_path)
+                    scan_bytes += len(content)
+
+            total = len(to_scan)
+            self.progress.emit(0, total)
+            if scan_bytes <= INLINE_SCAN_BYTES:
+                init_worker(self.names)
+                for done, file_path in enumerate(to_scan, 1):
+                    if self.cancelled:
+                        return
+                    path, digest, result = scan_file(file_path)
+                    files[path] = dict(result, hash=digest)
+                    self.progress.emit(done, total)
+            else:
+                # 使用spawn启动子进程，不复制界面进程的线程和Qt状态
+                context = multiprocessing.get_context('spawn')
+                workers = min(self.max_workers, total)
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                         initializer=init_worker, initargs=(self.names,)) as executor:
+                    futures = [executor.submit(scan_file, file_path) for file_path in to_scan]
+                    for done, future in enumerate(as_completed(futures), 1):
+                        if self.cancelled:
+                            for pending in futures:
+                                pending.cancel()
+                            return
+                        try:
+                            path, digest, result = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            print(f"扫描章节失败: {e}")
+                            continue
+                        files[path] = dict(result, hash=digest)
+                        self.progress.emit(done, total)
+
+            # 只保留现有章节的缓存
+            store.set({'names': names_key, 'files': files})
+            self.finished.emit({
+                'names': self.names,
+                'chapters': [path for path in chapters if path in files],
+                'files': files,
+                'scanned': total,
+            })
+        except Exception as e:
+            self.error.emit(str(e))
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import hashlib
+import socket
+import threading
+from collections import deque
+
+
+HEALTH_WINDOW = 20  # 每个端点保留最近多少次请求的记录
+DEFAULT_TTFT = 1.0  # 秒，还没有记录的端点按这个首字延迟估计，新端点有机会被选中
+ERROR_PENALTY = 4.0  # 错误率对评分的放大系数
+MIN_COOLDOWN = 5.0  # 秒，连接失败或5xx后暂停使用端点的时间，连续失败时加倍
+MAX_COOLDOWN = 120.0
+CONNECT_TIMEOUT = 10  # 秒
+READ_TIMEOUT = 300
+
+RETRYABLE_STATUS = (408, 429)  # 以及所有5xx
+
+
+def configured_endpoints(config):
+    """配置中的端点列表：主端点（base_url/api_key/model）在前，备用端点（endpoints）在后"""
+    endpoints = [{
+        'name': '主端点',
+        'base_url': config.get('base_url', ''),
+        'api_key': config.get('api_key', ''),
+        'model': config.get('model', ''),
+        'weight': 1.0,
+        'enabled': True,
+    }]
+    for index, endpoint in enumerate(config.get('endpoints', [])):
+        endpoints.append({
+            'name': endpoint.get('name') or f"备用端点{index + 1}",
+            'base_url': endpoint.get('base_url') or config.get('base_url', ''),
+            'api_key': endpoint.get('api_key') or config.get('api_key', ''),
+            'model': endpoint.get('model') or config.get('model', ''),
+            'weight': float(endpoint.get('weight', 1.0)) or 1.0,
+            'enabled': endpoint.get('enabled', True),
+        })
+    return [endpoint for endpoint in endpoints if endpoint['enabled'] and endpoint['api_key'] and endpoint['base_url']]
+
+
+def endpoint_key(endpoint):
+    """端点的标识：地址、模型和API Key（哈希），只有Key不同的端点分别记录健康状况"""
+    key_digest = hashlib.sha256(endpoint['api_key'].encode('utf-8')).hexdigest()[:12]
+    return (endpoint['base_url'].rstrip('/'), endpoint['model'], key_digest)
+
+
+class EndpointHealth:
+    """一个端点最近的首字延迟和错误记录"""
+    def __init__(self):
+        self.samples = deque(maxlen=HEALTH_WINDOW)  # (首字延迟或None, 是否成功)
+        self.failures = 0  # 连续失败次数
+        self.down_until = 0.0
+
+    def ttft(self):
+        """最近成功请求的平均首字延迟"""
+        values = [ttft for ttft, _ in self.samples if ttft is not None]
+        return sum(values) / len(values) if values else DEFAULT_TTFT
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class EndpointPool:
+    """在多个端点之间分配请求
+
+    每个端点记录最近的首字延迟（TTFT）和错误率。按“健康度”路由时，选择
+    平均TTFT ×（1 + 错误率加权）÷ 权重 最小的端点；按“顺序”路由时按配置顺序。
+    连接失败或5xx的端点暂停使用一段时间，所有端点都在暂停中时仍按评分全部尝试。
+    """
+    def __init__(self):
+        self.health = {}
+        self.lock = threading.Lock()
+
+    def state(self, endpoint):
+        key = endpoint_key(endpoint)
+        health = self.health.get(key)
+        if health is None:
+            health = self.health[key] = EndpointHealth()
+        return health
+
+    def score(self, endpoint):
+        health = self.state(endpoint)
+        return health.ttft() * (1 + ERROR_PENALTY * health.error_rate()) / endpoint['weight']
+
+    def candidates(self, config):
+        """按尝试顺序排列的端点"""
+        endpoints = configured_endpoints(config)
+        now = time.monotonic()
+        with self.lock:
+            if config.get('routing', 'health') == 'health':
+                endpoints.sort(key=self.score)
+            # 暂停中的端点放到最后，仍可作为最后的选择
+            endpoints.sort(key=lambda endpoint: self.state(endpoint).down_until > now)
+        return endpoints
+
+    def record_success(self, endpoint, ttft):
+        """记录一次收到首字的请求"""
+        with self.lock:
+            health = self.state(endpoint)
+            health.samples.append((ttft, True))
+            health.failures = 0
+            health.down_until = 0.0
+
+    def record_slow(self, endpoint, elapsed):
+        """记录一次因为太慢被其他端点抢先的请求，elapsed是放弃时已等待的时间"""
+        with self.lock:
+            self.state(endpoint).samples.append((elapsed, True))
+
+    def record_failure(self, endpoint, retryable):
+        """记录一次失败的请求，连接失败或5xx时暂停使用端点"""
+        with self.lock:
+            health = self.state(endpoint)
+            health.samples.append((None, False))
+            if retryable:
+                health.failures += 1
+                cooldown = min(MAX_COOLDOWN, MIN_COOLDOWN * 2 ** (health.failures - 1))
+                health.down_until = time.monotonic() + cooldown
+
+    def describe(self, config):
+        """各端点的状态说明，用于设置界面"""
+        now = time.monotonic()
+        lines = []
+        with self.lock:
+            for endpoint in configured_endpoints(config):
+                health = self.state(endpoint)
+                line = (f"{endpoint['name']}: 首字 {health.ttft():.2f}s，"
+                        f"错误率 {health.error_rate():.0%}，最近 {len(health.samples)} 次")
+                if health.down_until > now:
+                    line += f"，暂停 {health.down_until - now:.0f}s"
+                lines.append(line)
+        return "\n".join(lines)
+
+
+_pool = EndpointPool()
+
+
+def endpoint_pool():
+    """程序中共享的端点池，所有AIHandler共用端点的健康记录"""
+    return _pool
+
+
+class EndpointError(Exception):
+    """请求端点失败，retryable表示可以换一个端点重试，cancelled表示请求被主动放弃"""
+    def __init__(self, message, retryable, cancelled=False):
+        super().__init__(message)
+        self.retryable = retryable
+        self.cancelled = cancelled
+
+
+class StreamAttempt(threading.Thread):
+    """在后台线程中向一个端点发送流式请求，把结果放入共享队列
+
+    队列中的事件为 (attempt, 类型, 值)，类型为 'chunk'、'usage'、'error'、'done'，
+    每个请求最后一定以 'done' 或 'error' 结束（被放弃时也是）。
+    端点的 'path' 默认为 /chat/completions；也支持llama.cpp原生 /completion 接口的返回格式。
+    """
+    def __init__(self, endpoint, data, events):
+        super().__init__(daemon=True)
+        self.endpoint = endpoint
+        self.data = dict(data, model=endpoint['model'])
+        self.events = events
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.response = None
+        self.cancelled = False
+
+    def cancel(self):
+        """放弃这次请求，关闭连接"""
+        self.cancelled = True
+        response = self.response
+        if response is not None:
+            # 读取线程阻塞在socket上时，直接close会等到读取返回；先关闭socket让读取立即结束
+            try:
+                connection = getattr(response.raw, 'connection', None)
+                sock = getattr(connection, 'sock', None)
+                if sock is None:
+                    # 服务端不保持连接时，连接对象已经交出socket，只有响应的文件对象持有它
+                    reader = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+                    sock = getattr(getattr(reader, 'raw', None), '_sock', None)
+                if sock is not None:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            threading.Thread(target=response.close, daemon=True).start()
+
+    def cancelled_error(self):
+        return EndpointError(f"{self.endpoint['name']} 请求已取消", False, cancelled=True)
+
+    def run(self):
+        # requests导入较慢，首次请求时才导入，不拖慢启动
+        import requests
+        headers = {
+            'Authorization': f"Bearer {self.endpoint['api_key']}",
+            'Content-Type': 'application/json'
+        }
+        url = self.endpoint['base_url'].rstrip('/') + self.endpoint.get('path', '/chat/completions')
+        try:
+            self.response = requests.post(url, headers=headers, json=self.data, stream=True,
+                                          timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            if self.cancelled:
+                self.response.close()
+                raise self.cancelled_error()
+            status = self.response.status_code
+            if status >= 400:
+                retryable = status >= 500 or status in RETRYABLE_STATUS
+                raise EndpointError(f"{self.endpoint['name']} 返回 {status}: {self.response.text[:200]}", retryable)
+
+            for line in self.response.iter_lines():
+                if self.cancelled:
+                    raise self.cancelled_error()
+                if line:
+                    line = line.decode('utf-8')
+                    if line.startswith('data: '):
+                        line = line[6:]
+                        if line == '[DONE]':
+                            break
+
+                        try:
+                            chunk_data = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if chunk_data.get('usage'):
+                            self.events.put((self, 'usage', chunk_data['usage']))
+                        if 'choices' in chunk_data and chunk_data['choices']:
+                            delta = chunk_data['choices'][0].get('delta', {})
+                            content = delta.get('content', '')
+                        else:
+                            # llama.cpp原生接口：{"content": ..., "stop": ...}
+                            content = chunk_data.get('content', '')
+                        if content:
+                            if self.first_token_at is None:
+                                self.first_token_at = time.monotonic()
+                            self.events.put((self, 'chunk', content))
+                        if chunk_data.get('stop') is True:
+                            break
+            self.events.put((self, 'done', None))
+
+        except EndpointError as e:
+            self.events.put((self, 'error', e))
+        except Exception as e:
+            if self.cancelled:
+                self.events.put((self, 'error', self.cancelled_error()))
+            elif isinstance(e, requests.exceptions.RequestException):
+                # 连接失败、超时都可以换端点重试
+                self.events.put((self, 'error', EndpointError(f"{self.endpoint['name']} 请求失败: {e}", True)))
+            else:
+                self.events.put((self, 'error', EndpointError(f"{self.endpoint['name']} 请求失败: {e}", False)))
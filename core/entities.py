@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.state_store import get_store
+
+
+MIN_NAME_LENGTH = 2
+MAX_NAME_LENGTH = 16
+DESCRIPTION_LENGTH = 120  # 悬停提示中描述的最大字数
+
+# “字段：值”形式中作为字段名的词，不作为实体；其中NAME_FIELDS的值是实体名，ALIAS_FIELDS的值是别名
+NAME_FIELDS = ('姓名', '名称', '名字', '全名', '本名')
+ALIAS_FIELDS = ('别名', '别称', '外号', '绰号', '称号', '化名', '又名')
+FIELD_LABELS = set(NAME_FIELDS + ALIAS_FIELDS + (
+    '年龄', '性别', '身份', '职业', '外貌', '外形', '性格', '简介', '介绍', '描述', '背景', '能力',
+    '境界', '等级', '修为', '位置', '地点', '所属', '势力', '阵营', '关系', '备注', '特点', '经历',
+    '作用', '来历', '种族', '籍贯', '出身', '武器', '功法', '技能', '状态', '类型', '说明',
+))
+
+HEADING = re.compile(r'^\s*(?:(#{1,6})\s*(.+?)\s*#*|【(.+?)】)\s*$')
+FIELD = re.compile(r'^\s*([-*+]\s+|\d+[.、)]\s*)?([^\s：:，,。]{1,16})\s*[：:]\s*(.*)$')
+SEPARATORS = re.compile(r'[、，,/；;|]')
+ASCII_WORD = re.compile(r'[A-Za-z0-9_]')
+
+
+def setting_files(work_dir):
+    """“设定”目录下的文本文件，按目录分类配置的顺序和文件名排序"""
+    if not work_dir:
+        return []
+    # 与文件树共享内存中的目录分类
+    categories = get_store(os.path.join(work_dir, 'directory_categories.json')).get() or {}
+    files = []
+    for directory, category in categories.items():
+        if category != '设定' or not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, filename)
+            if os.path.isfile(file_path) and filename.endswith(('.txt', '.md')):
+                files.append(file_path)
+    return files
+
+
+def valid_name(name):
+    return (MIN_NAME_LENGTH <= len(name) <= MAX_NAME_LENGTH
+            and name not in FIELD_LABELS and not name.isdigit())
+
+
+def extract_entities(text, source):
+    """从一个设定文件中提取实体，返回 {名称: (来源, 描述)}
+
+    标题（# 名称、【名称】）、“姓名：名称”和列表项“- 名称：描述”都作为实体，
+    “别名：甲、乙”把别名归到前一个实体；文件中没有找到实体时使用文件名。
+    """
+    entities = {}
+    current = None  # 最近的实体名，后续的描述和别名属于它
+    descriptions = {}
+    section = None  # (名称, 级别)，最近的标题后面紧跟更低一级的标题时，它只是分组，不是实体
+
+    def add(name, description=''):
+        name = name.strip().strip('*_`"“”「」')
+        if not valid_name(name):
+            return None
+        entities.setdefault(name, source)
+        if description and not descriptions.get(name):
+            descriptions[name] = description
+        return name
+
+    for line in text.splitlines():
+        heading = HEADING.match(line)
+        if heading:
+            level = len(heading.group(1)) if heading.group(1) else 7
+            if section and level > section[1] and section[0] not in descriptions:
+                entities.pop(section[0], None)
+            name = add(heading.group(2) or heading.group(3))
+            section = (name, level) if name else None
+            current = name or current
+            continue
+        if line.strip():
+            section = None
+        field = FIELD.match(line)
+        if field:
+            marker, label, value = field.group(1), field.group(2), field.group(3).strip()
+            if label in NAME_FIELDS:
+                current = add(value) or current
+                continue
+            if label in ALIAS_FIELDS:
+                for alias in SEPARATORS.split(value):
+                    alias = add(alias)
+                    if alias and current:
+                        descriptions.setdefault(alias, f"{current}的别名")
+                continue
+            if marker and label not in FIELD_LABELS:
+                current = add(label, value) or current
+                continue
+        line = line.strip()
+        if line and current and len(descriptions.get(current, '')) < DESCRIPTION_LENGTH:
+            descriptions[current] = (descriptions.get(current, '') + ' ' + line).strip()
+
+    if not entities:
+        add(os.path.splitext(os.path.basename(source))[0], text.strip())
+
+    return {name: (source, descriptions.get(name, '')[:DESCRIPTION_LENGTH]) for name in entities}
+
+
+class AhoCorasick:
+    """多模式串匹配自动机，一次扫描找出文本中所有实体名"""
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]  # 以该状态结尾的最长模式串长度
+        for word in words:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                state = next_state
+            self.output[state] = len(word)
+        self.build_failure_links()
+
+    def build_failure_links(self):
+        queue = list(self.goto[0].values())
+        # 每个状态额外记录后缀链上所有的模式串长度
+        self.lengths = [()] * len(self.goto)
+        for state in queue:
+            self.lengths[state] = (self.output[state],) if self.output[state] else ()
+        index = 0
+        while index < len(queue):
+            state = queue[index]
+            index += 1
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                own = (self.output[next_state],) if self.output[next_state] else ()
+                self.lengths[next_state] = own + self.lengths[self.fail[next_state]]
+
+    def iter_matches(self, text):
+        """产生所有匹配 (结束位置, 长度)，结束位置不含"""
+        goto, fail, lengths = self.goto, self.fail, self.lengths
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if lengths[state]:
+                for length in lengths[state]:
+                    yield position + 1, length
+
+    def find(self, text):
+        """不重叠的匹配 [(起始, 结束)]，重叠时取靠前且较长的"""
+        matches = sorted(((end - length, end) for end, length in self.iter_matches(text)),
+                         key=lambda match: (match[0], -match[1]))
+        result = []
+        last_end = 0
+        for start, end in matches:
+            if start < last_end:
+                continue
+            # 英文名需要完整的单词
+            if ASCII_WORD.match(text[start]) and start > 0 and ASCII_WORD.match(text[start - 1]):
+                continue
+            if ASCII_WORD.match(text[end - 1]) and end < len(text) and ASCII_WORD.match(text[end]):
+                continue
+            result.append((start, end))
+            last_end = end
+        return result
+
+
+class EntityDictionary(QObject):
+    """设定目录中的实体词典，设定文件变化时重新构建并发出changed"""
+    changed = pyqtSignal()
+
+    def __init__(self, work_dir, parent=None):
+        super().__init__(parent)
+        self.work_dir = work_dir
+        self.signature = None
+        self.entities = {}  # 名称 -> (来源文件, 描述)
+        self.automaton = None
+
+    def refresh(self):
+        """检查设定文件的修改时间，有变化时重新构建"""
+        files = setting_files(self.work_dir)
+        signature = []
+        for file_path in files:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+        signature = tuple(signature)
+        if signature == self.signature:
+            return
+        self.signature = signature
+
+        entities = {}
+        for file_path, _, _ in signature:
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            except Exception as e:
+                print(f"读取设定文件失败: {file_path}, {e}")
+                continue
+            for name, info in extract_entities(text, file_path).items():
+                entities.setdefault(name, info)
+        self.entities = entities
+        self.automaton = AhoCorasick(entities) if entities else None
+        self.changed.emit()
+
+    def find(self, text):
+        """文本中的实体 [(起始, 结束)]"""
+        if self.automaton is None:
+            return []
+        return self.automaton.find(text)
+
+    def describe(self, name):
+        """实体的悬停说明"""
+        info = self.entities.get(name)
+        if info is None:
+            return ''
+        source, description = info
+        return f"{name}（{os.path.basename(source)}）\n{description}".strip()
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import bisect
+import hashlib
+from PyQt5.QtCore import QObject, QThread, QFileSystemWatcher, pyqtSignal
+
+from core.state_store import get_store
+
+
+# 默认忽略的目录
+DEFAULT_IGNORED = ('.git', '.svn', '.hg', '__pycache__', '.idea', '.vscode',
+                   'node_modules', 'build', 'dist', 'temp')
+
+
+def workspace_cache_dir(work_dir, root_path):
+    """获取工作区的缓存目录，不同工作区按路径哈希区分"""
+    digest = hashlib.md5(os.path.abspath(root_path).encode('utf-8')).hexdigest()[:12]
+    cache_dir = os.path.join(work_dir, 'cache', digest)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def scan_directory(root_path, directory, ignored):
+    """递归扫描目录，返回 ({相对路径: mtime_ns}, [目录列表])"""
+    files = {}
+    dirs = []
+    for current, subdirs, names in os.walk(directory):
+        subdirs[:] = [name for name in subdirs if name not in ignored]
+        dirs.append(current)
+        for name in names:
+            file_path = os.path.join(current, name)
+            try:
+                mtime = os.stat(file_path).st_mtime_ns
+            except OSError:
+                continue
+            files[os.path.relpath(file_path, root_path)] = mtime
+    return files, dirs
+
+
+def scan_entries(root_path, directory, ignored):
+    """只扫描目录本身，返回 ({相对路径: mtime_ns}, [子目录列表])"""
+    files = {}
+    dirs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if entry.name not in ignored:
+                        dirs.append(os.path.join(directory, entry.name))
+                elif entry.is_file():
+                    files[os.path.relpath(entry.path, root_path)] = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+    return files, dirs
+
+
+class IndexScanner(QObject):
+    """工作区文件扫描线程"""
+    finished = pyqtSignal(str, dict, list)
+
+    def __init__(self, root_path, ignored):
+        super().__init__()
+        self.root_path = root_path
+        self.ignored = ignored
+
+    def run(self):
+        """扫描整个工作区"""
+        files, dirs = scan_directory(self.root_path, self.root_path, self.ignored)
+        self.finished.emit(self.root_path, files, dirs)
+
+
+class WorkspaceIndex(QObject):
+    """工作区文件索引
+
+    在后台线程中构建一次，之后通过文件系统监视增量更新，并持久化到缓存目录。
+    提供按文件名/路径前缀、子串和模糊（子序列）匹配的快速查询。
+    """
+    ready = pyqtSignal()
+    files_changed = pyqtSignal(list)  # 新增、删除或修改的文件绝对路径
+
+    def __init__(self, work_dir, parent=None, ignored=DEFAULT_IGNORED):
+        super().__init__(parent)
+        self.work_dir = work_dir
+        self.ignored = set(ignored)
+        self.root_path = None
+        self.files = {}  # 相对路径 -> mtime_ns
+        self.scans = []  # 进行中的 (线程, 扫描器)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+
+        # 查询用的结构，文件列表变化后延迟重建
+        self.dirty = True
+        self.sorted_paths = []  # [(小写相对路径, 相对路径)]
+        self.sorted_names = []  # [(小写文件名, 相对路径)]
+        self.blob = ""  # 小写相对路径以换行连接，用于子串和模糊匹配
+        self.line_starts = []
+        self.blob_paths = []
+        self.blob_chars = set()
+        self.char_lines = {}  # 字符 -> 包含该字符的行号集合
+        self.fuzzy_cache = ('', [])
+
+    def cache_file(self):
+        """索引缓存文件路径"""
+        return os.path.join(workspace_cache_dir(self.work_dir, self.root_path), 'file_index.json')
+
+    def set_root(self, root_path):
+        """切换工作区：先加载缓存，再在后台重新扫描"""
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+
+        self.root_path = root_path
+        self.files = {}
+        self.load_cache()
+        self.dirty = True
+
+        scan_thread = QThread()
+        scanner = IndexScanner(root_path, self.ignored)
+        scanner.moveToThread(scan_thread)
+        scan_thread.started.connect(scanner.run)
+        scanner.finished.connect(self.on_scan_finished)
+        self.scans.append((scan_thread, scanner))
+        scan_thread.start()
+
+    def shutdown(self):
+        """等待所有扫描线程结束"""
+        for scan_thread, _ in self.scans:
+            scan_thread.quit()
+            scan_thread.wait()
+        self.scans = []
+
+    def load_cache(self):
+        """加载持久化的索引"""
+        cached = get_store(self.cache_file(), {}).get()
+        if isinstance(cached, dict):
+            self.files = dict(cached.get('files', {}))
+
+    def save_cache(self):
+        """持久化索引，连续的文件变化只在后台写入一次"""
+        get_store(self.cache_file(), {}).set({'root': self.root_path, 'files': self.files})
+
+    def on_scan_finished(self, root_path, files, dirs):
+        """后台扫描完成"""
+        scanner = self.sender()
+        for scan in self.scans:
+            if scan[1] is scanner:
+                scan[0].quit()
+                scan[0].wait()
+                self.scans.remove(scan)
+                break
+
+        # 扫描期间已切换工作区
+        if root_path != self.root_path:
+            return
+
+        changed = [rel for rel in set(files) | set(self.files) if files.get(rel) != self.files.get(rel)]
+        self.files = files
+        self.dirty = True
+        self.save_cache()
+
+        if dirs:
+            self.watcher.addPaths(dirs)
+
+        self.ready.emit()
+        if changed:
+            self.files_changed.emit([self.absolute_path(rel) for rel in changed])
+
+    def on_directory_changed(self, directory):
+        """监视的目录发生变化时只重新扫描该目录本身，已监视的子目录由各自的通知更新"""
+        if not self.root_path:
+            return
+
+        prefix = os.path.relpath(directory, self.root_path)
+        prefix = '' if prefix == '.' else prefix + os.sep
+        old = {rel: mtime for rel, mtime in self.files.items() if rel.startswith(prefix)}
+
+        new = {}
+        if os.path.isdir(directory):
+            try:
+                new, subdirs = scan_entries(self.root_path, directory, self.ignored)
+            except OSError:
+                subdirs = []
+            watched = set(self.watcher.directories())
+            kept = set()
+            for subdir in subdirs:
+                if subdir in watched:
+                    kept.add(os.path.basename(subdir))
+                else:
+                    # 新出现的子目录（如移动进来的目录）需要递归扫描
+                    files, dirs = scan_directory(self.root_path, subdir, self.ignored)
+                    new.update(files)
+                    self.watcher.addPaths(dirs)
+            # 仍然存在的子目录中的文件保持不变，已删除的子目录中的文件随之移除
+            for rel, mtime in old.items():
+                parts = rel[len(prefix):].split(os.sep, 1)
+                if len(parts) == 2 and parts[0] in kept:
+                    new[rel] = mtime
+
+        changed = [rel for rel in set(old) | set(new) if old.get(rel) != new.get(rel)]
+        if not changed:
+            return
+
+        for rel in old:
+            if rel not in new:
+                del self.files[rel]
+        self.files.update(new)
+        self.dirty = True
+        self.save_cache()
+        self.files_changed.emit([self.absolute_path(rel) for rel in changed])
+
+    def rebuild(self):
+        """重建查询结构"""
+        paths = sorted(self.files)
+        self.sorted_paths = sorted((path.lower(), path) for path in paths)
+        self.sorted_names = sorted((os.path.basename(path).lower(), path) for path in paths)
+
+        self.blob_paths = [path for _, path in self.sorted_paths]
+        self.blob = '\n'.join(lower for lower, _ in self.sorted_paths)
+        self.line_starts = []
+        self.char_lines = {}
+        offset = 0
+        for line, (lower, _) in enumerate(self.sorted_paths):
+            self.line_starts.append(offset)
+            offset += len(lower) + 1
+            for c in set(lower):
+                self.char_lines.setdefault(c, set()).add(line)
+        self.blob_chars = set(self.char_lines)
+        self.fuzzy_cache = ('', [])
+        self.dirty = False
+
+    def absolute_path(self, rel):
+        """相对路径转为绝对路径，统一使用正斜杠（与文件树一致）"""
+        return os.path.join(self.root_path, rel).replace('\\', '/')
+
+    def all_files(self):
+        """获取所有文件的绝对路径"""
+        if not self.root_path:
+            return []
+        return [self.absolute_path(rel) for rel in sorted(self.files)]
+
+    def match(self, query, limit=50):
+        """按文件名前缀、路径前缀、子串、模糊匹配的顺序返回相对路径"""
+        if self.dirty:
+            self.rebuild()
+
+        query = query.lower()
+        if not query:
+            return self.blob_paths[:limit]
+
+        results = []
+        seen = set()
+
+        def add(path):
+            if path not in seen:
+                seen.add(path)
+                results.append(path)
+            return len(results) >= limit
+
+        # 文件名前缀和路径前缀
+        for entries in (self.sorted_names, self.sorted_paths):
+            index = bisect.bisect_left(entries, (query,))
+            while index < len(entries) and entries[index][0].startswith(query):
+                if add(entries[index][1]):
+                    return results
+                index += 1
+
+        # 子串匹配
+        position = self.blob.find(query)
+        while position != -1:
+            line = bisect.bisect_right(self.line_starts, position) - 1
+            if add(self.blob_paths[line]):
+                return results
+            next_line = line + 1
+            if next_line >= len(self.line_starts):
+                break
+            position = self.blob.find(query, self.line_starts[next_line])
+
+        # 模糊匹配：查询中的字符按顺序出现在同一路径中
+        for line in self.fuzzy_lines(query, limit):
+            if add(self.blob_paths[line]):
+                return results
+
+        return results
+
+    def fuzzy_lines(self, query, limit):
+        """返回最多limit个模糊匹配查询的行号
+
+        候选行先按字符倒排表求交集；输入是上一次查询的延续时，只在上一次剩余的候选中继续筛选。
+        候选按顺序逐个验证，凑够数量即停止，未验证的候选留给下一次查询。
+        """
+        if not set(query) <= self.blob_chars:
+            return []
+
+        cached_query, cached_lines = self.fuzzy_cache
+        if cached_query and query.startswith(cached_query):
+            candidates = cached_lines
+        else:
+            # 从最小的集合开始求交集
+            sets = sorted((self.char_lines[c] for c in set(query)), key=len)
+            candidates = sorted(sets[0].intersection(*sets[1:]))
+
+        # 否定字符类使每个字符只能匹配第一次出现的位置，回溯时立即失败（不使用3.11才支持的占有量词）
+        pattern = re.compile(''.join(f'[^{re.escape(c)}]*{re.escape(c)}' for c in query))
+        matched = []
+        checked = 0
+        for line in candidates:
+            checked += 1
+            if pattern.match(self.sorted_paths[line][0]):
+                matched.append(line)
+                if len(matched) >= limit:
+                    break
+
+        self.fuzzy_cache = (query, matched + candidates[checked:])
+        return matched
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import tempfile
+
+
+def atomic_write_text(file_path, text, encoding='utf-8', newline=None):
+    """原子写入文本文件：先写入同目录下的临时文件，再替换原文件
+
+    newline与open()相同，默认按平台转换换行符；原文件的权限保持不变。
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline=newline) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
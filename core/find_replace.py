@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.file_index import workspace_cache_dir
+from core.file_utils import atomic_write_text
+from core.text_stats import TEXT_EXTENSIONS
+
+
+SNIPPET_RADIUS = 30
+MAX_PREVIEW_MATCHES = 200  # 每个文件在预览中最多显示的匹配数
+
+
+def compile_pattern(query, use_regex=False, case_sensitive=False):
+    """编译查找模式，正则表达式无效时抛出re.error"""
+    flags = re.MULTILINE
+    if not case_sensitive:
+        flags |= re.IGNORECASE
+    return re.compile(query if use_regex else re.escape(query), flags)
+
+
+def expand_replacement(match, replacement, use_regex):
+    """计算单个匹配的替换文本，正则模式下支持\\1等分组引用"""
+    return match.expand(replacement) if use_regex else replacement
+
+
+def replace_text(text, pattern, replacement, use_regex):
+    """替换全部匹配，返回 (新文本, 替换次数)"""
+    return pattern.subn(lambda match: expand_replacement(match, replacement, use_regex), text)
+
+
+def replace_raw_text(raw, pattern, replacement, use_regex):
+    """在保留原换行符的文本上替换：按统一换行后的文本匹配，再把偏移映射回原文，返回 (新文本, 替换次数)"""
+    text = raw.replace('\r\n', '\n').replace('\r', '\n')
+    # 每个\r\n在统一换行后的位置，之后的偏移都比原文少1
+    crlf_positions = [match.start() - index for index, match in enumerate(re.finditer('\r\n', raw))]
+
+    def raw_offset(position):
+        return position + bisect_left(crlf_positions, position)
+
+    pieces = []
+    last = 0
+    count = 0
+    for match in pattern.finditer(text):
+        start, end = raw_offset(match.start()), raw_offset(match.end())
+        pieces.append(raw[last:start])
+        pieces.append(expand_replacement(match, replacement, use_regex))
+        last = end
+        count += 1
+    pieces.append(raw[last:])
+    return ''.join(pieces), count
+
+
+def find_matches(text, pattern):
+    """查找全部匹配，返回 (匹配总数, [(起始, 结束, 行号, 片段)])，片段最多MAX_PREVIEW_MATCHES个"""
+    matches = []
+    count = 0
+    line = 1
+    line_position = 0
+    for match in pattern.finditer(text):
+        if match.start() == match.end():
+            continue
+        count += 1
+        if len(matches) >= MAX_PREVIEW_MATCHES:
+            continue
+        # 行号在顺序扫描中增量计算
+        line += text.count('\n', line_position, match.start())
+        line_position = match.start()
+        start = max(0, match.start() - SNIPPET_RADIUS)
+        end = min(len(text), match.end() + SNIPPET_RADIUS)
+        snippet = text[start:end].replace('\n', ' ')
+        matches.append((match.start(), match.end(), line, snippet))
+    return count, matches
+
+
+def read_text(file_path):
+    """读取文本文件，换行统一为\\n，与编辑器中的偏移和行号一致"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def read_raw_text(file_path):
+    """读取文本文件并保留原换行符，用于替换后写回"""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+
+def collect_workspace_files(file_paths):
+    """筛选出可查找的文本文件"""
+    return [path for path in file_paths if path.endswith(TEXT_EXTENSIONS)]
+
+
+class FindWorker(QObject):
+    """工作区查找线程，用线程池并行扫描文件，每扫描完一个有匹配的文件就发出结果"""
+    file_matched = pyqtSignal(str, int, list)  # 文件路径, 匹配数, 预览匹配
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(int, int)  # 匹配文件数, 匹配总数
+    error = pyqtSignal(str)
+
+    def __init__(self, file_paths, pattern, open_texts=None, max_workers=None):
+        super().__init__()
+        self.file_paths = file_paths
+        self.pattern = pattern
+        self.open_texts = open_texts or {}  # 已打开文件使用编辑器中的内容
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) + 4)
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def scan_file(self, file_path):
+        if self.cancelled:
+            return file_path, 0, []
+        text = self.open_texts.get(file_path)
+        if text is None:
+            text = read_text(file_path)
+        return (file_path,) + find_matches(text, self.pattern)
+
+    def run(self):
+        """执行查找"""
+        try:
+            total = len(self.file_paths)
+            matched_files = 0
+            matched_count = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.scan_file, path) for path in self.file_paths]
+                for done, future in enumerate(as_completed(futures), 1):
+                    if self.cancelled:
+                        for pending in futures:
+                            pending.cancel()
+                        break
+                    try:
+                        file_path, count, matches = future.result()
+                    except Exception as e:
+                        print(f"查找文件失败: {e}")
+                        continue
+                    if count:
+                        matched_files += 1
+                        matched_count += count
+                        self.file_matched.emit(file_path, count, matches)
+                    if done % 20 == 0 or done == total:
+                        self.progress.emit(done, total)
+            self.finished.emit(matched_files, matched_count)
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ReplaceSnapshots:
+    """替换前的文件快照，保存在工作区缓存目录中，用于撤销整次替换"""
+    def __init__(self, work_dir, root_path, keep=10):
+        self.snapshot_dir = os.path.join(workspace_cache_dir(work_dir, root_path), 'replace_snapshots')
+        self.keep = keep
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    def snapshot_ids(self):
+        """按时间排序的快照列表"""
+        return sorted(name[:-5] for name in os.listdir(self.snapshot_dir) if name.endswith('.json'))
+
+    def snapshot_path(self, snapshot_id):
+        return os.path.join(self.snapshot_dir, snapshot_id + '.json')
+
+    def create(self, description):
+        """创建一个空快照，返回快照id"""
+        snapshot_id = time.strftime('%Y%m%d-%H%M%S') + f'-{time.time_ns() % 1000000:06d}'
+        self.save(snapshot_id, {'description': description, 'time': time.time(), 'files': {}})
+
+        # 只保留最近的若干个快照
+        for old_id in self.snapshot_ids()[:-self.keep]:
+            self.remove(old_id)
+        return snapshot_id
+
+    def load(self, snapshot_id):
+        with open(self.snapshot_path(snapshot_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, snapshot_id, snapshot):
+        atomic_write_text(self.snapshot_path(snapshot_id),
+                          json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')))
+
+    def add_files(self, snapshot_id, contents):
+        """把文件的原始内容 {路径: 文本} 加入快照，已存在的文件保留最早的内容"""
+        snapshot = self.load(snapshot_id)
+        for file_path, text in contents.items():
+            snapshot['files'].setdefault(file_path, text)
+        self.save(snapshot_id, snapshot)
+
+    def latest(self):
+        """最近一次快照的 (id, 内容)，没有时返回 (None, None)"""
+        ids = self.snapshot_ids()
+        if not ids:
+            return None, None
+        return ids[-1], self.load(ids[-1])
+
+    def remove(self, snapshot_id):
+        try:
+            os.remove(self.snapshot_path(snapshot_id))
+        except OSError:
+            pass
+
+
+class ReplaceWorker(QObject):
+    """替换未打开的文件：先写入快照，再逐个原子替换"""
+    finished = pyqtSignal(dict)  # {文件路径: 替换次数}
+    error = pyqtSignal(str)
+
+    def __init__(self, snapshots, snapshot_id, file_paths, pattern, replacement, use_regex):
+        super().__init__()
+        self.snapshots = snapshots
+        self.snapshot_id = snapshot_id
+        self.file_paths = file_paths
+        self.pattern = pattern
+        self.replacement = replacement
+        self.use_regex = use_regex
+
+    def prepare(self, file_path):
+        text = read_raw_text(file_path)
+        new_text, count = replace_raw_text(text, self.pattern, self.replacement, self.use_regex)
+        return file_path, text, new_text, count
+
+    def run(self):
+        """执行替换"""
+        try:
+            with ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4)) as executor:
+                prepared = [result for result in executor.map(self.prepare, self.file_paths) if result[3]]
+
+            # 所有原始内容写入快照后才开始修改文件
+            self.snapshots.add_files(self.snapshot_id, {path: text for path, text, _, _ in prepared})
+
+            results = {}
+            for file_path, _, new_text, count in prepared:
+                try:
+                    atomic_write_text(file_path, new_text, newline='')
+                    results[file_path] = count
+                except Exception as e:
+                    print(f"替换文件失败: {file_path}, {e}")
+            self.finished.emit(results)
+        except Exception as e:
+            self.error.emit(str(e))
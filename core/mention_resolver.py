@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import mmap
+import bisect
+import threading
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.search_index import normalize_text, extract_bigrams
+from core.tokens import estimate_tokens
+
+
+DEFAULT_MENTION_LIMIT = 2000  # 单个引用的token上限
+DEFAULT_TOTAL_LIMIT = 8000  # 一条消息中所有引用的token上限
+MMAP_THRESHOLD = 1024 * 1024  # 超过这个大小的文件用内存映射读取
+CACHE_CHAR_LIMIT = 16 * 1024 * 1024  # 内容缓存的总字符数上限
+MAX_GRAM_HITS = 5000  # 出现次数超过这个数的二元组太常见，不参与相关段落的打分
+HEAD_RATIO = 2 / 3  # 截取开头和结尾时开头所占的比例
+GAP_MARK = "\n……\n"
+
+
+def parse_mentions(message):
+    """提取消息中@引用的名称，按出现顺序去重"""
+    items = []
+    for part in message.split('@')[1:]:
+        item = part.split(' ')[0].strip()
+        if item and item not in items:
+            items.append(item)
+    return items
+
+
+def strip_mentions(message):
+    """去掉消息中的@引用，剩余部分用于挑选相关段落"""
+    parts = message.split('@')
+    return ' '.join([parts[0]] + [part.split(' ', 1)[1] if ' ' in part else '' for part in parts[1:]]).strip()
+
+
+def fits(text, limit):
+    """文本是否在token上限之内（每个token至少对应一个字符，最多对应四个）"""
+    if len(text) <= limit:
+        return True
+    return len(text) <= limit * 4 and estimate_tokens(text) <= limit
+
+
+def truncate(text, limit, from_end=False):
+    """截取不超过limit个token的开头（或结尾）"""
+    length = max(0, limit * 4)
+    while True:
+        text = text[len(text) - length:] if from_end else text[:length]
+        if fits(text, limit):
+            return text
+        length = min(len(text) - 1, int(len(text) * limit / max(1, estimate_tokens(text)) * 0.95))
+
+
+def head_tail(text, limit):
+    """保留开头和结尾，省略中间部分"""
+    head = truncate(text, int(limit * HEAD_RATIO))
+    tail = truncate(text[len(head):], limit - estimate_tokens(head), from_end=True)
+    return head + GAP_MARK + tail
+
+
+def select_passages(text, query, limit):
+    """挑选与问题相关的段落，按原文顺序拼接；没有相关段落时返回None
+
+    问题中的每个二元组在全文中查找，按命中的段落数计算权重（越少见权重越高），
+    段落的得分为其包含的不同二元组的权重之和。
+    """
+    grams = extract_bigrams(normalize_text(query))
+    if not grams:
+        return None
+
+    lowered = normalize_text(text)
+    starts = [0]
+    position = lowered.find('\n')
+    while position != -1:
+        starts.append(position + 1)
+        position = lowered.find('\n', position + 1)
+
+    scores = {}
+    for gram in grams:
+        paragraphs = set()
+        hits = 0
+        position = lowered.find(gram)
+        while position != -1 and hits <= MAX_GRAM_HITS:
+            paragraphs.add(bisect.bisect_right(starts, position) - 1)
+            hits += 1
+            position = lowered.find(gram, position + 1)
+        if not paragraphs or hits > MAX_GRAM_HITS:
+            continue
+        weight = math.log(1 + len(starts) / len(paragraphs))
+        for paragraph in paragraphs:
+            scores[paragraph] = scores.get(paragraph, 0) + weight
+    if not scores:
+        return None
+
+    chosen = []
+    remaining = limit
+    for paragraph in sorted(scores, key=lambda p: (-scores[p], p)):
+        end = starts[paragraph + 1] if paragraph + 1 < len(starts) else len(text)
+        passage = text[starts[paragraph]:end].strip()
+        if not passage:
+            continue
+        tokens = estimate_tokens(passage[:remaining * 4 + 1])
+        if tokens > remaining:
+            if chosen:
+                break
+            passage = truncate(passage, remaining)
+            tokens = estimate_tokens(passage)
+        chosen.append((paragraph, passage))
+        remaining -= tokens + 1
+        if remaining <= 0:
+            break
+
+    chosen.sort()
+    pieces = []
+    previous = None
+    for paragraph, passage in chosen:
+        if previous is not None:
+            pieces.append("\n" if paragraph == previous + 1 else GAP_MARK)
+        pieces.append(passage)
+        previous = paragraph
+    return ''.join(pieces)
+
+
+def read_mapped(file_path, start=0, end=None):
+    """通过内存映射读取文件的一段并解码，不把整个文件读入内存"""
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)[start:end]
+            try:
+                # 截取的边界可能落在多字节字符中间，忽略不完整的字符
+                return str(view, 'utf-8', 'ignore' if start or end is not None else 'replace')
+            finally:
+                view.release()
+
+
+class ContentCache:
+    """按修改时间失效的文件内容缓存，超过字符数上限时丢弃最久未用的文件"""
+    def __init__(self, char_limit=CACHE_CHAR_LIMIT):
+        self.char_limit = char_limit
+        self.entries = OrderedDict()  # 路径 -> (修改时间, 大小, 文本)
+        self.chars = 0
+        self.lock = threading.Lock()
+
+    def read(self, file_path):
+        """读取文件内容，文件未修改时直接返回缓存"""
+        stat = os.stat(file_path)
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if entry and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                self.entries.move_to_end(file_path)
+                return entry[2]
+
+        if stat.st_size >= MMAP_THRESHOLD:
+            text = read_mapped(file_path)
+        else:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                text = f.read()
+
+        with self.lock:
+            old = self.entries.pop(file_path, None)
+            if old:
+                self.chars -= len(old[2])
+            if len(text) <= self.char_limit:
+                self.entries[file_path] = (stat.st_mtime_ns, stat.st_size, text)
+                self.chars += len(text)
+                while self.chars > self.char_limit:
+                    _, (_, _, evicted) = self.entries.popitem(last=False)
+                    self.chars -= len(evicted)
+        return text
+
+
+class MentionResolver:
+    """把@引用解析为发给AI的上下文，限制每个引用和全部引用的token数
+
+    超出上限的内容优先保留与问题相关的段落，找不到相关段落时保留开头和结尾。
+    大文件在没有问题文本时只通过内存映射读取开头和结尾两段。
+    """
+    def __init__(self):
+        self.cache = ContentCache()
+
+    def excerpt(self, text, limit, query):
+        """把文本缩减到limit个token之内，返回 (内容, 截取说明)"""
+        if fits(text, limit):
+            return text, ""
+        passages = select_passages(text, query, limit) if query else None
+        if passages:
+            return passages, "内容过长，只保留与问题相关的段落"
+        return head_tail(text, limit), "内容过长，只保留开头和结尾"
+
+    def read_file(self, file_path, limit, query):
+        """读取文件并缩减到limit个token之内"""
+        size = os.path.getsize(file_path)
+        if not query and size >= MMAP_THRESHOLD:
+            # UTF-8每个字符最多4字节，每个token最多4个字符
+            head = read_mapped(file_path, 0, int(limit * HEAD_RATIO) * 16)
+            tail = read_mapped(file_path, max(0, size - limit * 16))
+            head = truncate(head, int(limit * HEAD_RATIO))
+            tail = truncate(tail, limit - estimate_tokens(head), from_end=True)
+            return head + GAP_MARK + tail, "内容过长，只保留开头和结尾"
+        return self.excerpt(self.cache.read(file_path), limit, query)
+
+    def resolve(self, sources, query, mention_limit=DEFAULT_MENTION_LIMIT, total_limit=DEFAULT_TOTAL_LIMIT):
+        """解析引用
+
+        sources为 [(标题, 文本, 文件路径)]，文本和文件路径二选一；
+        总上限在各个引用之间平均分配。
+        """
+        if not sources:
+            return ""
+        limit = max(1, min(mention_limit, total_limit // len(sources)))
+        context = ""
+        for title, text, file_path in sources:
+            try:
+                if file_path is not None:
+                    content, note = self.read_file(file_path, limit, query)
+                else:
+                    content, note = self.excerpt(text, limit, query)
+            except Exception as e:
+                print(f"读取文件失败: {e}")
+                continue
+            header = f"--- {title}（{note}） ---" if note else f"--- {title} ---"
+            context += f"{header}\n{content}\n\n"
+        return context
+
+
+class MentionWorker(QObject):
+    """在后台解析@引用"""
+    finished = pyqtSignal(str)
+    error = pyqtSignal(str)
+
+    def __init__(self, resolver, sources, query, mention_limit, total_limit):
+        super().__init__()
+        self.resolver = resolver
+        self.sources = sources
+        self.query = query
+        self.mention_limit = mention_limit
+        self.total_limit = total_limit
+
+    def run(self):
+        try:
+            self.finished.emit(self.resolver.resolve(
+                self.sources, self.query, self.mention_limit, self.total_limit))
+        except Exception as e:
+            self.error.emit(str(e))
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+import numpy as np
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from core.text_stats import collect_text_files
+
+
+SHINGLE_SIZE = 5  # 段落按5字的滑动窗口切分
+NUM_PERM = 64  # MinHash签名长度
+BAND_ROWS = 4  # LSH每段4行，共16段，相似度约0.5以上的段落大概率落入同一个桶
+MIN_PARAGRAPH = 30  # 少于30字的段落（对话、短句）不参与比较
+SIMILARITY_THRESHOLD = 0.6  # 估计的Jaccard相似度达到这个值视为近似重复
+NGRAM_SIZE = 6  # 检查常用语的n-gram长度
+OVERUSE_COUNT = 5  # 在正文中出现这么多次以上的n-gram视为常用语
+REPEAT_COUNT = 3  # 在新生成的文本中重复这么多次以上的n-gram也视为常用语
+CHUNK_SHINGLES = 1 << 16  # 每次计算签名的最大窗口数，限制临时矩阵的内存
+SNIPPET_LENGTH = 40
+
+_random = np.random.default_rng(20240601)  # 固定种子，签名在每次运行中一致
+# 每个排列为 a*x+b (mod 2^32)，a为奇数
+HASH_A = _random.integers(0, 2 ** 32, size=NUM_PERM, dtype=np.uint32) | np.uint32(1)
+HASH_B = _random.integers(0, 2 ** 32, size=NUM_PERM, dtype=np.uint32)
+BAND_MIX = _random.integers(1, 2 ** 63, size=BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+MIX_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+NON_WORD = re.compile(r'[\W_]')
+
+
+def code_points(text):
+    """文本的Unicode码位数组"""
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+
+
+def window_hashes(points, size):
+    """所有长度为size的窗口的64位哈希"""
+    if len(points) < size:
+        return np.zeros(0, dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(points, size)
+    powers = np.uint64(1000003) ** np.arange(size - 1, -1, -1, dtype=np.uint64)
+    hashes = windows @ powers
+    # 打散低位相近的哈希
+    hashes ^= hashes >> np.uint64(29)
+    hashes *= MIX_MULTIPLIER
+    hashes ^= hashes >> np.uint64(32)
+    return hashes
+
+
+def split_paragraphs(text):
+    """足够长的段落 [(起始位置, 段落文本)]，起始位置跳过行首缩进"""
+    paragraphs = []
+    position = 0
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if len(stripped) >= MIN_PARAGRAPH:
+            paragraphs.append((position + len(line) - len(line.lstrip()), stripped))
+        position += len(line) + 1
+    return paragraphs
+
+
+def minhash_signatures(paragraphs):
+    """一组段落的MinHash签名矩阵 (段落数, NUM_PERM)"""
+    signatures = np.empty((len(paragraphs), NUM_PERM), dtype=np.uint32)
+    index = 0
+    while index < len(paragraphs):
+        # 若干个段落的窗口哈希拼在一起，一次矩阵运算后按段落分组取最小值
+        hashes = []
+        starts = []
+        total = 0
+        end = index
+        while end < len(paragraphs) and (not hashes or total < CHUNK_SHINGLES):
+            shingles = window_hashes(code_points(paragraphs[end][1]), SHINGLE_SIZE)
+            starts.append(total)
+            hashes.append(shingles)
+            total += len(shingles)
+            end += 1
+        values = np.concatenate(hashes).astype(np.uint32)[:, None] * HASH_A + HASH_B
+        signatures[index:end] = np.minimum.reduceat(values, starts, axis=0)
+        index = end
+    return signatures
+
+
+def band_hashes(signatures):
+    """LSH各段的哈希 (段落数, 段数)"""
+    bands = signatures.reshape(len(signatures), NUM_PERM // BAND_ROWS, BAND_ROWS).astype(np.uint64)
+    return bands @ BAND_MIX
+
+
+def phrase_mask(text, size=NGRAM_SIZE):
+    """长度为size的窗口中不含标点和空白时为True"""
+    if len(text) < size:
+        return np.zeros(0, dtype=bool)
+    letters = np.ones(len(text), dtype=bool)
+    letters[[match.start() for match in NON_WORD.finditer(text)]] = False
+    return np.lib.stride_tricks.sliding_window_view(letters, size).all(axis=1)
+
+
+class FileEntry:
+    """一个章节的段落签名和n-gram哈希"""
+    def __init__(self, key, text):
+        self.key = key  # (mtime_ns, size)
+        paragraphs = split_paragraphs(text)
+        self.offsets = [offset for offset, _ in paragraphs]
+        self.lengths = [len(paragraph) for _, paragraph in paragraphs]
+        self.snippets = [paragraph[:SNIPPET_LENGTH] for _, paragraph in paragraphs]
+        self.signatures = minhash_signatures(paragraphs) if paragraphs else np.zeros((0, NUM_PERM), dtype=np.uint32)
+        grams = window_hashes(code_points(text), NGRAM_SIZE)
+        self.grams = grams[phrase_mask(text)] if len(grams) else grams
+
+
+class ParagraphIndex:
+    """正文段落的MinHash/LSH索引和n-gram频次，可在任意线程中读取"""
+    def __init__(self):
+        self.files = {}  # 路径 -> FileEntry
+        self.lock = threading.Lock()
+        self.merged = None  # 合并后的查询结构，由索引线程在每批更新后重建
+        self.dirty = True
+        self.rebuild()
+
+    def set_file(self, file_path, entry):
+        with self.lock:
+            if entry is None:
+                self.files.pop(file_path, None)
+            else:
+                self.files[file_path] = entry
+            self.dirty = True
+
+    def snapshot(self):
+        """最近一次重建的查询结构，查询线程中不做合并"""
+        with self.lock:
+            return self.merged
+
+    def rebuild(self):
+        """合并所有文件的签名、LSH桶和排好序的n-gram，文件没有变化时跳过"""
+        with self.lock:
+            if not self.dirty:
+                return self.merged
+            self.dirty = False
+            files = list(self.files.items())
+        rows = []  # (路径, 段落序号)
+        signatures = []
+        grams = []
+        for file_path, entry in files:
+            rows.extend((file_path, index) for index in range(len(entry.offsets)))
+            signatures.append(entry.signatures)
+            grams.append(entry.grams)
+        signatures = np.concatenate(signatures) if signatures else np.zeros((0, NUM_PERM), dtype=np.uint32)
+        bands = band_hashes(signatures)
+        order = np.argsort(bands, axis=0, kind='stable')
+        merged = {
+            'files': dict(files),
+            'rows': rows,
+            'signatures': signatures,
+            'band_order': order,
+            'band_sorted': np.take_along_axis(bands, order, axis=0),
+            'grams': np.sort(np.concatenate(grams)) if grams else np.zeros(0, dtype=np.uint64),
+        }
+        with self.lock:
+            self.merged = merged
+        return merged
+
+    def candidates(self, merged, signature_bands):
+        """与给定段落在任一LSH段中同桶的索引行"""
+        found = set()
+        for band, value in enumerate(signature_bands):
+            column = merged['band_sorted'][:, band]
+            left = np.searchsorted(column, value, side='left')
+            right = np.searchsorted(column, value, side='right')
+            found.update(merged['band_order'][left:right, band].tolist())
+        return found
+
+    def location(self, merged, row):
+        file_path, index = merged['rows'][row]
+        entry = merged['files'][file_path]
+        return file_path, entry.offsets[index], entry.lengths[index], entry.snippets[index]
+
+    def check(self, text):
+        """检查一段新生成的文本
+
+        返回 {'duplicates': [(段落位置, 段落长度, 文件, 位置, 长度, 相似度, 摘录)],
+              'phrases': [(位置, 长度, 常用语, 正文中出现次数)]}，
+        duplicates中文件为None表示与这段文本自身的另一段重复。
+        """
+        merged = self.snapshot()
+        paragraphs = split_paragraphs(text)
+        duplicates = []
+        if paragraphs:
+            signatures = minhash_signatures(paragraphs)
+            bands = band_hashes(signatures)
+            for index, (offset, paragraph) in enumerate(paragraphs):
+                best = None
+                rows = self.candidates(merged, bands[index]) if len(merged['rows']) else ()
+                for row in rows:
+                    similarity = float(np.mean(merged['signatures'][row] == signatures[index]))
+                    if similarity >= SIMILARITY_THRESHOLD and (best is None or similarity > best[0]):
+                        best = (similarity, row)
+                if best is not None:
+                    file_path, position, length, snippet = self.location(merged, best[1])
+                    duplicates.append((offset, len(paragraph), file_path, position, length, best[0], snippet))
+                    continue
+                # 新文本内部的重复段落
+                for other in range(index):
+                    similarity = float(np.mean(signatures[other] == signatures[index]))
+                    if similarity >= SIMILARITY_THRESHOLD:
+                        other_offset, other_paragraph = paragraphs[other]
+                        duplicates.append((offset, len(paragraph), None, other_offset, len(other_paragraph),
+                                           similarity, other_paragraph[:SNIPPET_LENGTH]))
+                        break
+
+        return {'duplicates': duplicates, 'phrases': self.overused_phrases(merged, text)}
+
+    def overused_phrases(self, merged, text):
+        """文本中在正文里反复出现或在文本自身中重复的短语，相邻的n-gram合并为一个短语"""
+        grams = window_hashes(code_points(text), NGRAM_SIZE)
+        if not len(grams):
+            return []
+        mask = phrase_mask(text)
+        corpus = merged['grams']
+        counts = np.searchsorted(corpus, grams, side='right') - np.searchsorted(corpus, grams, side='left')
+        _, inverse, own_counts = np.unique(grams, return_inverse=True, return_counts=True)
+        flagged = mask & ((counts >= OVERUSE_COUNT) | (own_counts[inverse] >= REPEAT_COUNT))
+
+        phrases = []
+        for position in np.flatnonzero(flagged).tolist():
+            end = position + NGRAM_SIZE
+            count = int(counts[position])
+            if phrases and position <= phrases[-1][0] + phrases[-1][1]:
+                start, _, _, previous = phrases[-1]
+                phrases[-1] = (start, end - start, text[start:end], max(previous, count))
+            else:
+                phrases.append((position, NGRAM_SIZE, text[position:end], count))
+        return phrases
+
+    def duplicate_pairs(self):
+        """正文中所有近似重复的段落对 [(相似度, 位置1, 位置2)]，位置为 (文件, 起始, 长度, 摘录)"""
+        merged = self.snapshot()
+        count = len(merged['rows'])
+        if not count:
+            return []
+        pairs = set()
+        order, sorted_bands = merged['band_order'], merged['band_sorted']
+        for band in range(sorted_bands.shape[1]):
+            column = sorted_bands[:, band]
+            # 同一个桶中相邻的行
+            boundaries = np.flatnonzero(np.diff(column)) + 1
+            for bucket in np.split(order[:, band], boundaries):
+                if 1 < len(bucket) <= 50:
+                    bucket = sorted(bucket.tolist())
+                    for i, first in enumerate(bucket):
+                        for second in bucket[i + 1:]:
+                            pairs.add((first, second))
+        result = []
+        signatures = merged['signatures']
+        for first, second in pairs:
+            similarity = float(np.mean(signatures[first] == signatures[second]))
+            if similarity >= SIMILARITY_THRESHOLD:
+                result.append((similarity, self.location(merged, first), self.location(merged, second)))
+        result.sort(key=lambda pair: -pair[0])
+        return result
+
+
+class ParagraphIndexer(QObject):
+    """在后台线程中构建和更新段落索引"""
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+    sync_requested = pyqtSignal(list)
+    update_requested = pyqtSignal(list)
+
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.directories = []
+        self.sync_requested.connect(self.sync)
+        self.update_requested.connect(self.update)
+
+    def sync(self, directories):
+        """与正文目录同步：删除不再属于正文的文件，重新索引有变化的文件"""
+        self.directories = directories
+        wanted = []
+        for directory in directories:
+            wanted.extend(collect_text_files(directory))
+        wanted_set = set(wanted)
+        for file_path in list(self.index.files):
+            if file_path not in wanted_set:
+                self.index.set_file(file_path, None)
+        self.update(wanted)
+
+    def in_directories(self, file_path):
+        return any(file_path.startswith(directory.rstrip('/') + '/') for directory in self.directories)
+
+    def update(self, file_paths):
+        """增量更新指定文件，修改时间和大小未变时跳过"""
+        total = len(file_paths)
+        for done, file_path in enumerate(file_paths, 1):
+            try:
+                self.index_file(file_path)
+            except Exception as e:
+                print(f"索引段落失败: {file_path}, {e}")
+            if done % 50 == 0 or done == total:
+                self.progress.emit(done, total)
+        self.index.rebuild()
+        self.idle.emit()
+
+    def index_file(self, file_path):
+        if not self.in_directories(file_path) or not os.path.isfile(file_path):
+            self.index.set_file(file_path, None)
+            return
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        entry = self.index.files.get(file_path)
+        if entry is not None and entry.key == key:
+            return
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        self.index.set_file(file_path, FileEntry(key, text))
+
+
+class RepetitionIndex(QObject):
+    """正文段落的重复检测
+
+    索引在后台线程中构建，文件保存后增量更新；查询在调用线程中进行。
+    """
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.index = ParagraphIndex()
+        self.ready = False
+        self.index_thread = QThread()
+        self.indexer = ParagraphIndexer(self.index)
+        self.indexer.moveToThread(self.index_thread)
+        self.indexer.progress.connect(self.progress)
+        self.indexer.idle.connect(self.on_idle)
+        self.index_thread.start()
+
+    def on_idle(self):
+        self.ready = True
+        self.idle.emit()
+
+    def set_directories(self, directories):
+        """设置正文目录，在后台同步索引"""
+        self.indexer.sync_requested.emit(sorted(directories))
+
+    def update_files(self, file_paths):
+        """文件保存或在外部修改后更新索引"""
+        self.indexer.update_requested.emit(list(file_paths))
+
+    def check(self, text):
+        """检查新生成的文本与正文的重复段落和常用语"""
+        return self.index.check(text)
+
+    def duplicate_pairs(self):
+        return self.index.duplicate_pairs()
+
+    def shutdown(self):
+        """结束索引线程"""
+        if self.index_thread:
+            self.index_thread.quit()
+            self.index_thread.wait()
+            self.index_thread = None
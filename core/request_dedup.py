@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import json
+import hashlib
+import threading
+
+
+def request_key(data):
+    """请求的标识：模型、参数和消息内容的哈希"""
+    content = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class SharedStream:
+    """一个上游流式请求，由后台线程读取，分发给所有订阅者
+
+    每个订阅者都从第一块开始收到完整的内容；所有订阅者都取消后才放弃上游请求。
+    """
+    def __init__(self, registry, key, upstream, cancel_upstream=None):
+        self.registry = registry
+        self.key = key
+        self.upstream = upstream
+        self.cancel_upstream = cancel_upstream  # 中止正在等待的上游请求，不必等到下一块到达
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cancelled = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """读取上游请求"""
+        try:
+            stream = self.upstream()
+            try:
+                for chunk in stream:
+                    with self.condition:
+                        if self.cancelled:
+                            break
+                        self.chunks.append(chunk)
+                        self.condition.notify_all()
+            finally:
+                stream.close()
+        except Exception as e:
+            with self.condition:
+                self.error = e
+        finally:
+            self.registry.remove(self)
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def subscribe(self):
+        """订阅请求，产生从头开始的全部文本块"""
+        position = 0
+        try:
+            while True:
+                with self.condition:
+                    while position >= len(self.chunks) and not self.done:
+                        self.condition.wait()
+                    chunks = self.chunks[position:]
+                    finished = self.done
+                    error = self.error
+                for chunk in chunks:
+                    yield chunk
+                position += len(chunks)
+                if finished and position >= len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self.unsubscribe()
+
+    def unsubscribe(self):
+        """一个订阅者结束，没有订阅者时放弃上游请求"""
+        with self.condition:
+            self.subscribers -= 1
+            if self.subscribers > 0 or self.done:
+                return
+            self.cancelled = True
+        # 取消后相同的新请求不再加入这个流
+        self.registry.remove(self)
+        if self.cancel_upstream is not None:
+            self.cancel_upstream()
+
+
+class RequestRegistry:
+    """进行中的请求登记表，相同的请求共用一个上游流"""
+    def __init__(self):
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def stream(self, key, upstream, cancel_upstream=None):
+        """产生请求的文本块；有相同的请求正在进行时加入它，否则调用upstream()发起新请求
+
+        所有订阅者都取消后调用cancel_upstream()中止上游请求。
+        """
+        with self.lock:
+            shared = self.streams.get(key)
+            if shared is not None:
+                with shared.condition:
+                    if shared.cancelled or shared.done:
+                        shared = None
+                    else:
+                        shared.subscribers += 1
+            if shared is None:
+                shared = self.streams[key] = SharedStream(self, key, upstream, cancel_upstream)
+                shared.subscribers = 1
+                shared.thread.start()
+        return shared.subscribe()
+
+    def remove(self, shared):
+        with self.lock:
+            if self.streams.get(shared.key) is shared:
+                del self.streams[shared.key]
+
+
+_registry = RequestRegistry()
+
+
+def request_registry():
+    """程序中共享的请求登记表"""
+    return _registry
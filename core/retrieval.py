@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import threading
+import numpy as np
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from core.file_index import workspace_cache_dir
+from core.file_utils import atomic_write_text
+from core.repetition import code_points, window_hashes, phrase_mask
+from core.text_stats import collect_text_files, text_file_order
+from core.tokens import count_tokens
+
+
+INDEX_VERSION = 1
+FEATURE_BITS = 18
+DIMENSION = 1 << FEATURE_BITS  # 字符二元组哈希到这么多维
+PASSAGE_CHARS = 200  # 相邻的短段落合并为约200字的片段
+QUERY_CHARS = 800  # 用上文末尾这么多字检索
+TOP_K = 8  # 检索的候选片段数
+MIN_SCORE = 0.08  # 余弦相似度低于这个值的片段不使用
+PASSAGE_OVERHEAD = 8  # 每个片段的章节标题等额外token
+ROW_DTYPE = np.dtype([('start', '<i8'), ('count', '<i4'), ('offset', '<i4'), ('length', '<i4')])
+ARRAYS = (('rows', ROW_DTYPE), ('features', np.dtype('<i4')), ('weights', np.dtype('<f4')))
+
+
+def split_passages(text):
+    """按行切分片段 [(起始位置, 结束位置)]，短段落与后面的段落合并"""
+    passages = []
+    start = None
+    last_end = 0
+    position = 0
+    for line in text.split('\n'):
+        end = position + len(line)
+        if line.strip():
+            if start is None:
+                start = position
+            last_end = end
+            if end - start >= PASSAGE_CHARS:
+                passages.append((start, end))
+                start = None
+        position = end + 1
+    if start is not None:
+        passages.append((start, last_end))
+    return passages
+
+
+def bigram_buckets(text):
+    """不含标点和空白的字符二元组的哈希桶 (位置, 桶号)"""
+    hashes = window_hashes(code_points(text), 2)
+    positions = np.flatnonzero(phrase_mask(text, 2))
+    return positions, (hashes[positions] & np.uint64(DIMENSION - 1)).astype(np.int64)
+
+
+def term_weights(counts):
+    return (1 + np.log(counts)).astype(np.float32)
+
+
+def text_vector(text):
+    """一段文本的稀疏词频向量 (特征, 权重)"""
+    _, buckets = bigram_buckets(text)
+    features, counts = np.unique(buckets, return_counts=True)
+    return features.astype(np.int32), term_weights(counts)
+
+
+def file_vectors(text):
+    """一个章节所有片段的稀疏词频向量，返回 (行, 特征, 权重)，没有特征的片段不保留"""
+    passages = split_passages(text)
+    if not passages:
+        return np.zeros(0, dtype=ROW_DTYPE), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    starts = np.array([start for start, _ in passages], dtype=np.int64)
+    ends = np.array([end for _, end in passages], dtype=np.int64)
+    positions, buckets = bigram_buckets(text)
+    # 整个章节一次计算，按位置归入片段
+    passage = np.searchsorted(starts, positions, side='right') - 1
+    inside = (passage >= 0) & (positions + 2 <= ends[np.maximum(passage, 0)])
+    keys, counts = np.unique(passage[inside] * DIMENSION + buckets[inside], return_counts=True)
+    per_passage = np.bincount(keys // DIMENSION, minlength=len(passages))
+
+    kept = np.flatnonzero(per_passage)
+    rows = np.zeros(len(kept), dtype=ROW_DTYPE)
+    rows['count'] = per_passage[kept]
+    rows['start'] = np.concatenate(([0], np.cumsum(rows['count'][:-1])))
+    rows['offset'] = starts[kept]
+    rows['length'] = ends[kept] - starts[kept]
+    return rows, (keys % DIMENSION).astype(np.int32), term_weights(counts)
+
+
+class PassageStore:
+    """片段的TF-IDF稀疏矩阵（CSR），以追加方式保存在磁盘上，查询时内存映射
+
+    每个数组保存为一个二进制文件，manifest记录各文件占用的行范围；
+    文件修改后旧的行只从manifest中删除，失效的行过多时重写所有文件。
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.merged = None  # 查询用的内存映射和IDF，索引变化时重建
+        self.version = 0
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def array_path(self, name, generation=None):
+        if generation is None:
+            generation = self.manifest['generation']
+        return os.path.join(self.directory, f"{name}-{generation}.bin")
+
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def load(self):
+        """读取manifest，截掉写入中断时多出的数据；版本不符或文件损坏时重建"""
+        try:
+            with open(self.manifest_path(), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        valid = bool(manifest) and manifest.get('version') == INDEX_VERSION and manifest.get('dimension') == DIMENSION
+        if valid:
+            self.manifest = manifest
+            sizes = {'rows': manifest['rows'], 'features': manifest['entries'], 'weights': manifest['entries']}
+            try:
+                for name, dtype in ARRAYS:
+                    expected = sizes[name] * dtype.itemsize
+                    path = self.array_path(name)
+                    if os.path.getsize(path) < expected:
+                        raise OSError(f"索引文件不完整: {path}")
+                    with open(path, 'r+b') as f:
+                        f.truncate(expected)
+            except OSError as e:
+                print(f"检索索引损坏，重建: {e}")
+                valid = False
+        if not valid:
+            generation = manifest.get('generation', 0) + 1 if isinstance(manifest, dict) else 1
+            self.manifest = self.empty_manifest(generation)
+            for name, _ in ARRAYS:
+                open(self.array_path(name), 'wb').close()
+            self.save()
+        self.remove_stale_files()
+
+    def empty_manifest(self, generation):
+        return {'version': INDEX_VERSION, 'dimension': DIMENSION, 'generation': generation,
+                'rows': 0, 'entries': 0, 'files': {}}
+
+    def remove_stale_files(self):
+        """删除其他代的数组文件（重写后仍被映射而没能删除的）"""
+        current = {os.path.basename(self.array_path(name)) for name, _ in ARRAYS}
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin') and name not in current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def save(self):
+        with self.lock:
+            text = json.dumps(self.manifest, ensure_ascii=False)
+        atomic_write_text(self.manifest_path(), text)
+
+    @property
+    def files(self):
+        return self.manifest['files']
+
+    def file_key(self, file_path):
+        with self.lock:
+            entry = self.manifest['files'].get(file_path)
+            return tuple(entry['key']) if entry else None
+
+    def set_file(self, file_path, key, vectors):
+        """替换一个文件的片段；先追加数据，再更新manifest，读取方始终看到完整的行"""
+        rows, features, weights = vectors
+        rows = rows.copy()
+        rows['start'] += self.manifest['entries']
+        for name, array in (('rows', rows), ('features', features), ('weights', weights)):
+            with open(self.array_path(name), 'ab') as f:
+                f.write(array.tobytes())
+        with self.lock:
+            first = self.manifest['rows']
+            self.manifest['rows'] += len(rows)
+            self.manifest['entries'] += len(features)
+            if len(rows):
+                self.manifest['files'][file_path] = {'key': list(key), 'rows': [first, first + len(rows)]}
+            else:
+                self.manifest['files'].pop(file_path, None)
+            self.changed()
+
+    def remove_file(self, file_path):
+        with self.lock:
+            if self.manifest['files'].pop(file_path, None) is not None:
+                self.changed()
+
+    def changed(self):
+        self.merged = None
+        self.version += 1
+
+    def dead_rows(self):
+        with self.lock:
+            live = sum(end - start for start, end in (entry['rows'] for entry in self.manifest['files'].values()))
+            return self.manifest['rows'] - live, live
+
+    def map_array(self, name, dtype, count, generation=None):
+        if not count:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.array_path(name, generation), dtype=dtype, mode='r', shape=(count,))
+
+    def compact(self):
+        """只保留有效的行，重写为新一代的数组文件"""
+        with self.lock:
+            manifest = json.loads(json.dumps(self.manifest))
+        old_generation = manifest['generation']
+        rows = self.map_array('rows', ROW_DTYPE, manifest['rows'], old_generation)
+        features = self.map_array('features', np.int32, manifest['entries'], old_generation)
+        weights = self.map_array('weights', np.float32, manifest['entries'], old_generation)
+
+        compacted = self.empty_manifest(old_generation + 1)
+        handles = {name: open(self.array_path(name, compacted['generation']), 'wb') for name, _ in ARRAYS}
+        try:
+            for file_path, entry in sorted(manifest['files'].items()):
+                first, last = entry['rows']
+                block = np.array(rows[first:last])
+                begin = int(block['start'][0])
+                end = int(block['start'][-1] + block['count'][-1])
+                block['start'] += compacted['entries'] - begin
+                handles['rows'].write(block.tobytes())
+                handles['features'].write(np.asarray(features[begin:end]).tobytes())
+                handles['weights'].write(np.asarray(weights[begin:end]).tobytes())
+                compacted['files'][file_path] = {'key': entry['key'],
+                                                 'rows': [compacted['rows'], compacted['rows'] + last - first]}
+                compacted['rows'] += last - first
+                compacted['entries'] += end - begin
+        finally:
+            for handle in handles.values():
+                handle.close()
+        del rows, features, weights
+
+        with self.lock:
+            self.manifest = compacted
+            self.changed()
+        self.save()
+        self.remove_stale_files()
+
+    def snapshot(self):
+        """映射当前的数组，计算IDF和每行的向量长度"""
+        with self.lock:
+            if self.merged is not None:
+                return self.merged
+            version = self.version
+            generation = self.manifest['generation']
+            count = self.manifest['rows']
+            entries = self.manifest['entries']
+            files = sorted((path, entry['rows']) for path, entry in self.manifest['files'].items())
+        rows = self.map_array('rows', ROW_DTYPE, count, generation)
+        features = self.map_array('features', np.int32, entries, generation)
+        weights = self.map_array('weights', np.float32, entries, generation)
+
+        # 失效的行不参与IDF，查询时得分置零
+        row_file = np.full(count, -1, dtype=np.int32)
+        for index, (_, (first, last)) in enumerate(files):
+            row_file[first:last] = index
+        live = row_file >= 0
+        document_frequency = np.bincount(features[np.repeat(live, rows['count'])], minlength=DIMENSION)
+        idf = (np.log((int(live.sum()) + 1) / (document_frequency + 1)) + 1).astype(np.float32)
+        starts = rows['start'] if count else np.zeros(0, dtype=np.int64)
+        norms = np.sqrt(np.add.reduceat((weights * idf[features]) ** 2, starts)) if count else np.zeros(0)
+
+        merged = {
+            'paths': [path for path, _ in files],
+            'rows': rows,
+            'features': features,
+            'weights': weights,
+            'row_file': row_file,
+            'live': live,
+            'idf': idf,
+            'norms': norms,
+        }
+        with self.lock:
+            if self.version == version:
+                self.merged = merged
+        return merged
+
+    def search(self, text, exclude_path=None, limit=TOP_K, allowed=None):
+        """与text最相似的片段 [(相似度, 文件, 位置, 长度)]，allowed(文件)为False的文件不参与"""
+        merged = self.snapshot()
+        if not merged['live'].any():
+            return []
+        features, weights = text_vector(text)
+        if not len(features):
+            return []
+        idf = merged['idf']
+        query = np.zeros(DIMENSION, dtype=np.float32)
+        query[features] = weights * idf[features]
+        query_norm = float(np.linalg.norm(query[features]))
+
+        # 所有片段的点积：按行分组求和
+        stored = merged['features']
+        products = query[stored] * idf[stored] * merged['weights']
+        scores = np.add.reduceat(products, merged['rows']['start']) / (merged['norms'] * query_norm)
+        scores[~merged['live']] = 0
+        if exclude_path in merged['paths']:
+            scores[merged['row_file'] == merged['paths'].index(exclude_path)] = 0
+        if allowed is not None:
+            # 末尾的False对应失效行的-1
+            mask = np.array([bool(allowed(path)) for path in merged['paths']] + [False])
+            scores[~mask[merged['row_file']]] = 0
+
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        rows = merged['rows']
+        return [(float(scores[row]), merged['paths'][merged['row_file'][row]],
+                 int(rows['offset'][row]), int(rows['length'][row]))
+                for row in top.tolist() if scores[row] >= MIN_SCORE]
+
+
+class PassageIndexer(QObject):
+    """在后台线程中构建和更新检索索引"""
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+    sync_requested = pyqtSignal(list)
+    update_requested = pyqtSignal(list)
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self.directories = []
+        self.sync_requested.connect(self.sync)
+        self.update_requested.connect(self.update)
+
+    def sync(self, directories):
+        """与正文目录同步：删除不再属于正文的文件，重新索引有变化的文件"""
+        self.directories = directories
+        wanted = []
+        for directory in directories:
+            wanted.extend(collect_text_files(directory))
+        wanted_set = set(wanted)
+        for file_path in list(self.store.files):
+            if file_path not in wanted_set:
+                self.store.remove_file(file_path)
+        self.update(wanted)
+
+    def in_directories(self, file_path):
+        return any(file_path.startswith(directory.rstrip('/') + '/') for directory in self.directories)
+
+    def update(self, file_paths):
+        """增量更新指定文件，修改时间和大小未变时跳过"""
+        total = len(file_paths)
+        for done, file_path in enumerate(file_paths, 1):
+            try:
+                self.index_file(file_path)
+            except Exception as e:
+                print(f"索引检索片段失败: {file_path}, {e}")
+            if done % 50 == 0 or done == total:
+                self.progress.emit(done, total)
+        try:
+            dead, live = self.store.dead_rows()
+            if dead > max(live, 1000):
+                self.store.compact()
+            else:
+                self.store.save()
+        except OSError as e:
+            print(f"保存检索索引失败: {e}")
+        self.idle.emit()
+
+    def index_file(self, file_path):
+        if not self.in_directories(file_path) or not os.path.isfile(file_path):
+            self.store.remove_file(file_path)
+            return
+        stat = os.stat(file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self.store.file_key(file_path) == key:
+            return
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        self.store.set_file(file_path, key, file_vectors(text))
+
+
+class PassageIndex(QObject):
+    """正文片段的相似度检索，为续写提供前文中相关的内容
+
+    索引保存在工作区缓存目录中，在后台线程中增量更新；查询在调用线程中进行。
+    """
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+
+    def __init__(self, work_dir, parent=None):
+        super().__init__(parent)
+        self.work_dir = work_dir
+        self.store = None
+        self.index_thread = None
+        self.indexer = None
+        self.directories = []
+
+    def set_root(self, root_path):
+        """切换工作区，打开对应的索引"""
+        self.shutdown()
+        self.store = PassageStore(os.path.join(workspace_cache_dir(self.work_dir, root_path), 'passages'))
+
+        self.index_thread = QThread()
+        self.indexer = PassageIndexer(self.store)
+        self.indexer.moveToThread(self.index_thread)
+        self.indexer.progress.connect(self.progress)
+        self.indexer.idle.connect(self.idle)
+        self.index_thread.start()
+
+    def shutdown(self):
+        """结束索引线程"""
+        if self.index_thread:
+            self.index_thread.quit()
+            self.index_thread.wait()
+            self.index_thread = None
+        self.indexer = None
+
+    def set_directories(self, directories):
+        """设置正文目录，在后台同步索引"""
+        self.directories = sorted(directories)
+        if self.indexer:
+            self.indexer.sync_requested.emit(self.directories)
+
+    def update_files(self, file_paths):
+        """文件保存或在外部修改后更新索引"""
+        if self.indexer:
+            self.indexer.update_requested.emit(list(file_paths))
+
+    def search(self, text, exclude_path=None, limit=TOP_K):
+        """检索相似片段；exclude_path是正文章节时只在它之前的章节中检索"""
+        store = self.store
+        if store is None:
+            return []
+        directories = self.directories
+        current = text_file_order(directories, exclude_path) if exclude_path else None
+        allowed = None
+        if current is not None:
+            def allowed(file_path):
+                order = text_file_order(directories, file_path)
+                return order is not None and order < current
+        return store.search(text, exclude_path, limit, allowed)
+
+    def retrieve(self, context, exclude_path=None, token_budget=1500, limit=TOP_K):
+        """检索与上文末尾最相关的片段，在token预算内按章节顺序拼接"""
+        store = self.store
+        if store is None:
+            return ""
+        chosen = []
+        used = 0
+        texts = {}
+        for _, file_path, offset, length in self.search(context[-QUERY_CHARS:], exclude_path, limit):
+            # 文件在索引之后又被修改时位置可能已经变化，跳过
+            if file_path not in texts:
+                try:
+                    stat = os.stat(file_path)
+                    if store.file_key(file_path) != (stat.st_mtime_ns, stat.st_size):
+                        texts[file_path] = None
+                    else:
+                        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                            texts[file_path] = f.read()
+                except OSError:
+                    texts[file_path] = None
+            if texts[file_path] is None:
+                continue
+            passage = texts[file_path][offset:offset + length].strip()
+            tokens = count_tokens(passage) + PASSAGE_OVERHEAD
+            if used + tokens > token_budget:
+                continue
+            chosen.append((file_path, offset, passage))
+            used += tokens
+        chosen.sort()
+        return "\n\n".join(f"【{os.path.splitext(os.path.basename(file_path))[0]}】\n{passage}"
+                           for file_path, _, passage in chosen)
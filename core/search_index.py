@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import sqlite3
+from array import array
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from core.file_index import workspace_cache_dir
+from core.text_stats import TEXT_EXTENSIONS
+
+
+INDEX_VERSION = 2
+SNIPPET_RADIUS = 30
+
+
+def normalize_text(text):
+    """转换为小写，保证每个字符位置与原文一一对应"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def extract_bigrams(text):
+    """提取字符二元组及其出现位置，跳过包含空白的二元组
+
+    后面是空白或文件末尾的字符记为“字符+空格”，单字查询也能找到它。
+    """
+    grams = {}
+    for i in range(len(text)):
+        if text[i].isspace():
+            continue
+        if i + 1 == len(text) or text[i + 1].isspace():
+            gram = text[i] + ' '
+        else:
+            gram = text[i:i + 2]
+        positions = grams.get(gram)
+        if positions is None:
+            grams[gram] = positions = array('I')
+        positions.append(i)
+    return grams
+
+
+def read_text(file_path):
+    """读取文本文件"""
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def open_database(db_path):
+    """打开索引数据库，版本不符时重建"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    row = conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+    if row is None or int(row[0]) != INDEX_VERSION:
+        conn.executescript("""
+            DROP TABLE IF EXISTS docs;
+            DROP TABLE IF EXISTS postings;
+            CREATE TABLE docs (id INTEGER PRIMARY KEY, path TEXT UNIQUE,
+                               mtime INTEGER, size INTEGER, length INTEGER);
+            CREATE TABLE postings (gram TEXT, doc INTEGER, positions BLOB,
+                                   PRIMARY KEY (gram, doc)) WITHOUT ROWID;
+            CREATE INDEX postings_doc ON postings (doc);
+        """)
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        conn.commit()
+    return conn
+
+
+class SearchIndexer(QObject):
+    """索引构建线程，负责所有写操作"""
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+    sync_requested = pyqtSignal(str, list)
+    update_requested = pyqtSignal(list)
+
+    def __init__(self, db_path):
+        super().__init__()
+        self.db_path = db_path
+        self.conn = None
+        self.sync_requested.connect(self.sync)
+        self.update_requested.connect(self.update)
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = open_database(self.db_path)
+        return self.conn
+
+    def sync(self, root_path, file_paths):
+        """与工作区文件列表同步：删除不存在的文件，重新索引有变化的文件"""
+        conn = self.connection()
+        wanted = {path for path in file_paths if path.endswith(TEXT_EXTENSIONS)}
+        for doc_id, path in conn.execute("SELECT id, path FROM docs").fetchall():
+            if path not in wanted:
+                self.remove_doc(doc_id)
+        conn.commit()
+        self.update(sorted(wanted))
+
+    def update(self, file_paths):
+        """增量更新指定文件"""
+        conn = self.connection()
+        total = len(file_paths)
+        for done, file_path in enumerate(file_paths, 1):
+            try:
+                self.index_file(file_path)
+            except Exception as e:
+                print(f"索引文件失败: {file_path}, {e}")
+            if done % 50 == 0 or done == total:
+                conn.commit()
+                self.progress.emit(done, total)
+        conn.commit()
+        self.idle.emit()
+
+    def remove_doc(self, doc_id):
+        conn = self.connection()
+        conn.execute("DELETE FROM postings WHERE doc=?", (doc_id,))
+        conn.execute("DELETE FROM docs WHERE id=?", (doc_id,))
+
+    def index_file(self, file_path):
+        """索引单个文件，修改时间和大小未变时跳过"""
+        conn = self.connection()
+        row = conn.execute("SELECT id, mtime, size FROM docs WHERE path=?", (file_path,)).fetchone()
+
+        if not os.path.isfile(file_path) or not file_path.endswith(TEXT_EXTENSIONS):
+            if row:
+                self.remove_doc(row[0])
+            return
+
+        stat = os.stat(file_path)
+        if row and row[1] == stat.st_mtime_ns and row[2] == stat.st_size:
+            return
+
+        text = normalize_text(read_text(file_path))
+        if row:
+            doc_id = row[0]
+            conn.execute("DELETE FROM postings WHERE doc=?", (doc_id,))
+            conn.execute("UPDATE docs SET mtime=?, size=?, length=? WHERE id=?",
+                         (stat.st_mtime_ns, stat.st_size, len(text), doc_id))
+        else:
+            doc_id = conn.execute("INSERT INTO docs (path, mtime, size, length) VALUES (?, ?, ?, ?)",
+                                  (file_path, stat.st_mtime_ns, stat.st_size, len(text))).lastrowid
+
+        conn.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                         ((gram, doc_id, positions.tobytes())
+                          for gram, positions in extract_bigrams(text).items()))
+
+
+class WorkspaceSearch(QObject):
+    """工作区全文搜索
+
+    基于字符二元组的倒排索引（含位置信息），保存在工作区缓存目录的SQLite数据库中。
+    写入在后台线程完成，查询在调用线程中使用独立的只读连接。
+    """
+    progress = pyqtSignal(int, int)
+    idle = pyqtSignal()
+
+    def __init__(self, work_dir, parent=None):
+        super().__init__(parent)
+        self.work_dir = work_dir
+        self.root_path = None
+        self.db_path = None
+        self.conn = None
+        self.index_thread = None
+        self.indexer = None
+
+    def set_root(self, root_path):
+        """切换工作区，打开对应的索引数据库"""
+        self.shutdown()
+        self.root_path = root_path
+        self.db_path = os.path.join(workspace_cache_dir(self.work_dir, root_path), 'search.db')
+        self.conn = open_database(self.db_path)
+
+        self.index_thread = QThread()
+        self.indexer = SearchIndexer(self.db_path)
+        self.indexer.moveToThread(self.index_thread)
+        self.indexer.progress.connect(self.progress)
+        self.indexer.idle.connect(self.idle)
+        self.index_thread.start()
+
+    def shutdown(self):
+        """结束索引线程"""
+        if self.index_thread:
+            self.index_thread.quit()
+            self.index_thread.wait()
+            self.index_thread = None
+        self.indexer = None
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def sync(self, file_paths):
+        """在后台与工作区文件列表同步"""
+        if self.indexer:
+            self.indexer.sync_requested.emit(self.root_path, list(file_paths))
+
+    def update_files(self, file_paths):
+        """在后台更新指定文件的索引"""
+        if self.indexer:
+            self.indexer.update_requested.emit(list(file_paths))
+
+    def fetch_postings(self, gram):
+        """获取二元组的倒排表 {文档id: 位置数组}；单字符查询匹配所有以该字符开头的二元组"""
+        if len(gram) == 2:
+            rows = self.conn.execute("SELECT doc, positions FROM postings WHERE gram=?", (gram,))
+        else:
+            rows = self.conn.execute("SELECT doc, positions FROM postings WHERE gram>=? AND gram<?",
+                                     (gram, gram + '\U0010ffff'))
+        postings = {}
+        for doc_id, blob in rows:
+            positions = array('I')
+            positions.frombytes(blob)
+            if doc_id in postings:
+                postings[doc_id].extend(positions)
+            else:
+                postings[doc_id] = positions
+        return postings
+
+    def search(self, query, limit=50):
+        """搜索并返回按相关度排序的结果
+
+        每个结果为 {'path', 'score', 'hits': [位置], 'snippets': [(位置, 行号, 片段)]}。
+        """
+        if not self.conn:
+            return []
+
+        query = normalize_text(query.strip())
+        if not query:
+            return []
+
+        # 查询拆分为二元组及其在查询中的偏移，前后都是空白的单字按前缀查找
+        terms = []
+        for i, char in enumerate(query):
+            if char.isspace():
+                continue
+            if i + 1 < len(query) and not query[i + 1].isspace():
+                terms.append((i, query[i:i + 2]))
+            elif i == 0 or query[i - 1].isspace():
+                terms.append((i, char))
+
+        postings = [(offset, self.fetch_postings(gram)) for offset, gram in terms]
+        postings.sort(key=lambda item: len(item[1]))
+        candidates = set(postings[0][1])
+        for _, posting in postings[1:]:
+            candidates &= posting.keys()
+        if not candidates:
+            return []
+
+        # 位置校验：所有二元组都出现在对应的偏移上
+        matches = {}
+        base_offset, base_posting = postings[0]
+        for doc_id in candidates:
+            position_sets = [(offset, set(posting[doc_id])) for offset, posting in postings[1:]]
+            hits = []
+            for position in base_posting[doc_id]:
+                start = position - base_offset
+                if all(start + offset in positions for offset, positions in position_sets):
+                    hits.append(start)
+            if hits:
+                matches[doc_id] = sorted(set(hits))
+        if not matches:
+            return []
+
+        placeholders = ','.join('?' * len(matches))
+        docs = {doc_id: (path, length) for doc_id, path, length in self.conn.execute(
+            f"SELECT id, path, length FROM docs WHERE id IN ({placeholders})", list(matches))}
+
+        # BM25排序
+        doc_count, avg_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+        idf = math.log(1 + (doc_count - len(matches) + 0.5) / (len(matches) + 0.5))
+
+        k1, b = 1.2, 0.75
+
+        def make_result(doc_id, hits):
+            path, length = docs[doc_id]
+            tf = len(hits)
+            score = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / (avg_length or 1)))
+            return {'id': doc_id, 'path': path, 'score': score, 'hits': hits}
+
+        results = sorted((make_result(doc_id, hits) for doc_id, hits in matches.items()),
+                         key=lambda result: -result['score'])
+        texts = {}
+        if any(char.isspace() for char in query):
+            # 二元组不含空白，查询中有空白时按排名依次与原文核对，凑够limit个为止
+            verified = []
+            for result in results:
+                try:
+                    text = texts[result['path']] = read_text(result['path'])
+                except Exception:
+                    continue
+                normalized = normalize_text(text)
+                hits = [start for start in result['hits'] if normalized.startswith(query, start)]
+                if hits:
+                    verified.append(make_result(result['id'], hits))
+                    if len(verified) >= limit:
+                        break
+            results = sorted(verified, key=lambda result: -result['score'])
+        results = results[:limit]
+
+        for result in results:
+            del result['id']
+            result['snippets'] = self.make_snippets(result['path'], result['hits'], len(query),
+                                                    text=texts.get(result['path']))
+        return results
+
+    def make_snippets(self, file_path, hits, length, max_snippets=5, text=None):
+        """读取文件生成命中处的上下文片段"""
+        if text is None:
+            try:
+                text = read_text(file_path)
+            except Exception:
+                return []
+
+        snippets = []
+        for position in hits[:max_snippets]:
+            start = max(0, position - SNIPPET_RADIUS)
+            end = min(len(text), position + length + SNIPPET_RADIUS)
+            snippet = text[start:end].replace('\n', ' ')
+            line = text.count('\n', 0, position) + 1
+            snippets.append((position, line, snippet))
+        return snippets
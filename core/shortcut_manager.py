@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
 from PyQt5.QtGui import QKeySequence
 
+from core.state_store import get_store
+
 
 class ShortcutManager:
     """快捷键管理器"""
     def __init__(self, work_dir):
         self.work_dir = work_dir
         self.config_file = os.path.join(work_dir, 'shortcuts.json')
+        self.store = get_store(self.config_file, pretty=True)
         self.shortcuts = self.load_shortcuts()
         
     def get_default_shortcuts(self):
@@ -28,30 +30,21 @@ class ShortcutManager:
             'ai_expand': 'Ctrl+E',
             'ai_summarize': 'Ctrl+K',
             'ai_custom': 'Ctrl+M',
-            'toggle_chat': 'Ctrl+Shift+C'
+            'toggle_chat': 'Ctrl+Shift+C',
+            'search_workspace': 'Ctrl+Shift+F',
+            'find_replace': 'Ctrl+Shift+H'
         }
         
     def load_shortcuts(self):
         """加载快捷键配置"""
         default_shortcuts = self.get_default_shortcuts()
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    loaded_shortcuts = json.load(f)
-                    # 合并配置
-                    default_shortcuts.update(loaded_shortcuts)
-            except Exception as e:
-                print(f"加载快捷键配置失败: {e}")
-                
+        # 合并配置
+        default_shortcuts.update(self.store.get() or {})
         return default_shortcuts
         
     def save_shortcuts(self):
         """保存快捷键配置"""
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.shortcuts, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存快捷键配置失败: {e}")
+        self.store.set(self.shortcuts)
             
     def get_shortcut(self, name):
         """获取快捷键"""
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
+
+from core.state_store import get_store
 
 
 class StateManager:
@@ -9,29 +10,21 @@ class StateManager:
     def __init__(self, work_dir):
         self.work_dir = work_dir
         self.state_file = os.path.join(work_dir, 'app_state.json')
+        self.store = get_store(self.state_file)
         
     def save_state(self, state):
-        """保存应用状态"""
-        try:
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(state, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存状态失败: {e}")
-            
+        """保存应用状态（先更新内存，稍后在后台写入）"""
+        self.store.set(state)
+        
     def load_state(self):
         """加载应用状态"""
-        if os.path.exists(self.state_file):
-            try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"加载状态失败: {e}")
-        return None
+        return self.store.get()
+        
+    def flush(self):
+        """立即写入应用状态"""
+        self.store.flush()
         
     def clear_state(self):
         """清除应用状态"""
-        if os.path.exists(self.state_file):
-            try:
-                os.remove(self.state_file)
-            except Exception as e:
-                print(f"清除状态失败: {e}")
+        self.store.set(None)
+        self.store.flush()
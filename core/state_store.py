@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import json
+import atexit
+import threading
+
+from core.file_utils import atomic_write_text
+
+
+SCHEMA_VERSION = 1
+FLUSH_DELAY = 1.0  # 秒，连续修改只写入一次
+
+
+class StateStore:
+    """JSON状态文件的内存副本
+
+    读取一次后常驻内存；修改时保存一份快照并延迟在后台线程中写入，
+    写入使用临时文件加重命名，崩溃时不会留下写了一半的文件。
+    文件内容带有版本号：{"schema_version": 1, "data": ...}，旧格式的文件读取时自动迁移。
+    """
+    def __init__(self, path, default=None, pretty=False, delay=FLUSH_DELAY):
+        self.path = path
+        self.pretty = pretty
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+        self.dirty = False
+        self.data = self.read(default)
+
+    def read(self, default):
+        """读取文件，不存在或损坏时返回默认值"""
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    content = json.load(f)
+                return self.migrate(content)
+            except Exception as e:
+                print(f"加载状态文件失败: {self.path}, {e}")
+        return copy.deepcopy(default)
+
+    def migrate(self, content):
+        """把旧版本的文件内容迁移为当前版本"""
+        if isinstance(content, dict) and set(content) == {'schema_version', 'data'}:
+            version = content['schema_version']
+            if version > SCHEMA_VERSION:
+                print(f"状态文件版本 {version} 高于当前支持的版本: {self.path}")
+            return content['data']
+        # 版本0：没有版本包装，文件内容即数据
+        return content
+
+    def get(self):
+        """获取当前数据（调用方不应修改返回的对象）"""
+        return self.data
+
+    def set(self, data):
+        """更新数据并安排延迟写入"""
+        snapshot = copy.deepcopy(data)
+        with self.lock:
+            self.data = snapshot
+            self.dirty = True
+            if self.timer is None:
+                self.timer = threading.Timer(self.delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """立即写入未保存的修改"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty:
+                return
+            self.dirty = False
+            content = {'schema_version': SCHEMA_VERSION, 'data': self.data}
+            try:
+                atomic_write_text(self.path, json.dumps(
+                    content, ensure_ascii=False,
+                    indent=2 if self.pretty else None,
+                    separators=None if self.pretty else (',', ':')))
+            except Exception as e:
+                self.dirty = True
+                print(f"保存状态文件失败: {self.path}, {e}")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path, default=None, pretty=False):
+    """获取文件对应的共享StateStore，同一文件在整个程序中只有一个实例"""
+    key = os.path.normcase(os.path.abspath(path))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = StateStore(path, default, pretty)
+        return store
+
+
+def flush_all():
+    """写入所有未保存的修改"""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from core.state_store import get_store
+
+
+# 中日韩文字每个字计为一个词，连续的字母数字计为一个词
+WORD_PATTERN = re.compile(
+    r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]"
+    r"|[A-Za-z0-9]+(?:['\u2019\-][A-Za-z0-9]+)*"
+)
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+# 基本多文种平面以外的字符（扩展B区汉字、表情符号）在Qt中占两个位置
+NON_BMP_PATTERN = re.compile('[\U00010000-\U0010ffff]')
+
+
+def count_text(text):
+    """统计文本的字符数（不含空白）、词数和段落数"""
+    chars = 0
+    paragraphs = 0
+    for line in text.splitlines():
+        stripped = ''.join(line.split())
+        if stripped:
+            chars += len(stripped)
+            paragraphs += 1
+    words = len(WORD_PATTERN.findall(text))
+    return chars, words, paragraphs
+
+
+def utf16_offset(text, position):
+    """Python字符串中的位置转为Qt文本中的位置（UTF-16编码单元数）"""
+    if NON_BMP_PATTERN.search(text, 0, position) is None:
+        return position
+    return position + len(NON_BMP_PATTERN.findall(text, 0, position))
+
+
+class DocumentCounter(QObject):
+    """根据文档变更增量维护字数统计，每次变更只重新统计受影响的文本块"""
+    changed = pyqtSignal()
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.document = document
+        self.block_stats = []  # 每个文本块的 (字符数, 词数, 段落数)
+        self.totals = [0, 0, 0]
+        self.reset()
+        document.contentsChange.connect(self.on_contents_change)
+
+    def reset(self):
+        """完整统计一次文档"""
+        self.block_stats = []
+        block = self.document.begin()
+        while block.isValid():
+            self.block_stats.append(count_text(block.text()))
+            block = block.next()
+        self.totals = [sum(column) for column in zip(*self.block_stats)] or [0, 0, 0]
+
+    def on_contents_change(self, position, removed, added):
+        """文档内容改变时更新受影响文本块的统计"""
+        document = self.document
+        end_position = min(position + added, document.characterCount() - 1)
+        first = document.findBlock(position).blockNumber()
+        last = document.findBlock(end_position).blockNumber()
+
+        # 变更前对应的文本块范围
+        old_last = last - (document.blockCount() - len(self.block_stats))
+        if first < 0 or old_last < first or old_last >= len(self.block_stats):
+            self.reset()
+            self.changed.emit()
+            return
+
+        new_stats = []
+        block = document.findBlockByNumber(first)
+        for _ in range(last - first + 1):
+            new_stats.append(count_text(block.text()))
+            block = block.next()
+
+        for stats in self.block_stats[first:old_last + 1]:
+            for i in range(3):
+                self.totals[i] -= stats[i]
+        for stats in new_stats:
+            for i in range(3):
+                self.totals[i] += stats[i]
+        self.block_stats[first:old_last + 1] = new_stats
+        self.changed.emit()
+
+
+class StatsCache:
+    """按修改时间缓存已关闭文件的字数统计，并记录每日总字数"""
+    def __init__(self, work_dir):
+        self.cache_file = os.path.join(work_dir, 'text_stats.json') if work_dir else None
+        self.files = {}  # path -> [mtime_ns, size, 字符数, 词数, 段落数]
+        self.daily = {}  # 日期 -> 当日正文总词数
+        self.load()
+
+    def load(self):
+        """加载缓存"""
+        if not self.cache_file:
+            return
+        data = get_store(self.cache_file, {}).get()
+        if isinstance(data, dict):
+            self.files = dict(data.get('files', {}))
+            self.daily = dict(data.get('daily', {}))
+
+    def save(self):
+        """保存缓存（紧凑格式，由共享的状态文件原子写入）"""
+        if not self.cache_file:
+            return
+        get_store(self.cache_file, {}).set({'files': self.files, 'daily': self.daily})
+
+    def get(self, file_path):
+        """获取文件统计，修改时间或大小变化时重新统计"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.files.pop(file_path, None)
+            return None
+
+        cached = self.files.get(file_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return tuple(cached[2:])
+
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                counts = count_text(f.read())
+        except Exception as e:
+            print(f"统计文件失败: {file_path}, {e}")
+            return None
+
+        self.files[file_path] = [stat.st_mtime_ns, stat.st_size] + list(counts)
+        return counts
+
+    def record_daily(self, total_words):
+        """记录当天的正文总词数"""
+        self.daily[time.strftime('%Y-%m-%d')] = total_words
+
+
+def collect_text_files(directory):
+    """递归收集目录下的文本文件，按路径排序"""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith(TEXT_EXTENSIONS):
+                files.append(os.path.join(root, name).replace('\\', '/'))
+    return files
+
+
+def text_file_order(directories, file_path):
+    """文件在依次对各目录调用collect_text_files的结果中的排序键，不在这些目录中时返回None"""
+    for index, directory in enumerate(directories):
+        prefix = directory.rstrip('/') + '/'
+        if file_path.startswith(prefix):
+            # 同一目录中文件排在子目录之前
+            parts = file_path[len(prefix):].split('/')
+            return index, [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+    return None
+
+
+def compute_project_stats(cache, directories, live_counts=None):
+    """统计各正文目录下每个章节的字数，已打开文件使用编辑器中的实时统计"""
+    live_counts = live_counts or {}
+    result = {'directories': [], 'daily': []}
+    total_words = 0
+
+    for directory in directories:
+        chapters = []
+        for file_path in collect_text_files(directory):
+            counts = live_counts.get(file_path) or cache.get(file_path)
+            if counts is None:
+                continue
+            chapters.append({
+                'path': file_path,
+                'chars': counts[0],
+                'words': counts[1],
+                'paragraphs': counts[2]
+            })
+        words = sum(chapter['words'] for chapter in chapters)
+        total_words += words
+        result['directories'].append({
+            'path': directory,
+            'chapters': chapters,
+            'chars': sum(chapter['chars'] for chapter in chapters),
+            'words': words,
+            'paragraphs': sum(chapter['paragraphs'] for chapter in chapters)
+        })
+
+    cache.record_daily(total_words)
+
+    # 每日写作量为相邻两次记录的总词数之差
+    previous = None
+    for day in sorted(cache.daily):
+        total = cache.daily[day]
+        written = total - previous if previous is not None else 0
+        result['daily'].append({'date': day, 'total': total, 'written': written})
+        previous = total
+
+    result['total_words'] = total_words
+    return result
+
+
+class StatsWorker(QObject):
+    """项目字数统计工作线程"""
+    finished = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, work_dir, directories, live_counts=None):
+        super().__init__()
+        self.work_dir = work_dir
+        self.directories = directories
+        self.live_counts = live_counts
+
+    def run(self):
+        """执行统计"""
+        try:
+            cache = StatsCache(self.work_dir)
+            result = compute_project_stats(cache, self.directories, self.live_counts)
+            cache.save()
+            self.finished.emit(result)
+        except Exception as e:
+            self.error.emit(str(e))
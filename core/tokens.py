@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+
+
+# 中日韩文字、全角标点大多单独编码为一个或多个token，按每字一个token估算
+CJK_PATTERN = re.compile(
+    r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]"
+)
+# 英文单词：常见单词是一个token，较长的单词约每8个字母一个token
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+# 数字按最多3位一组切分
+DIGIT_PATTERN = re.compile(r"[0-9]+")
+# 其余非空白字符（标点、符号、其他文字）每个约一个token
+SYMBOL_PATTERN = re.compile(
+    r"[^\sA-Za-z0-9　-〿぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]"
+)
+# 空格通常并入相邻的单词，连续的换行约一个token
+NEWLINE_PATTERN = re.compile(r"\n+")
+
+MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等额外开销
+EXACT_ENCODING = 'cl100k_base'
+
+
+def estimate_tokens(text):
+    """离线快速估算文本的token数，适用于中英文混排
+
+    中日韩字符每字约1个，英文单词每个约1个（长单词按8个字母1个），
+    数字每3位1个，其余符号每个1个。结果不超过字符数。
+    """
+    if not text:
+        return 0
+    tokens = len(CJK_PATTERN.findall(text))
+    tokens += sum((len(word) + 7) // 8 for word in WORD_PATTERN.findall(text))
+    tokens += sum((len(digits) + 2) // 3 for digits in DIGIT_PATTERN.findall(text))
+    tokens += len(SYMBOL_PATTERN.findall(text))
+    tokens += len(NEWLINE_PATTERN.findall(text))
+    return tokens
+
+
+def estimate_message_tokens(messages):
+    """估算一组对话消息的token数"""
+    return sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
+
+
+_exact_encode = None
+_exact_state = None  # None: 未加载, 'loading': 正在后台加载, 'ready': 加载完成（可能不可用）
+_exact_lock = threading.Lock()
+
+
+def set_tokenizer(encode):
+    """设置精确的分词函数（文本 -> token列表），为None时使用估算"""
+    global _exact_encode, _exact_state
+    with _exact_lock:
+        _exact_encode = encode
+        _exact_state = 'ready'
+
+
+def load_exact_tokenizer():
+    """加载tiktoken分词器，未安装或加载失败时使用估算"""
+    global _exact_encode, _exact_state
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(EXACT_ENCODING)
+        # 文本中出现的特殊标记按普通文本处理
+        encode = lambda text: encoding.encode(text, disallowed_special=())
+    except Exception:
+        encode = None
+    with _exact_lock:
+        if _exact_state != 'ready':
+            _exact_encode = encode
+            _exact_state = 'ready'
+
+
+def exact_tokenizer():
+    """获取精确的分词函数，不可用或尚未加载完成时返回None
+
+    tiktoken首次加载编码表可能需要联网下载，放在后台线程中进行，加载完成前使用估算。
+    """
+    global _exact_state
+    with _exact_lock:
+        if _exact_state is None:
+            _exact_state = 'loading'
+            threading.Thread(target=load_exact_tokenizer, daemon=True).start()
+        return _exact_encode
+
+
+def count_tokens(text):
+    """计算文本的token数，有精确分词器时使用分词器，否则估算"""
+    if not text:
+        return 0
+    encode = exact_tokenizer()
+    if encode is not None:
+        try:
+            return len(encode(text))
+        except Exception:
+            pass
+    return estimate_tokens(text)
+
+
+def count_message_tokens(messages):
+    """计算一组对话消息的token数"""
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages)
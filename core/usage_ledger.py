@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import time
+import threading
+
+from core.file_index import workspace_cache_dir
+from core.state_store import get_store
+
+
+ACTION_NAMES = {
+    'continue': '续写',
+    'expand': '扩写',
+    'summarize': '缩写',
+    'custom': '自定义',
+    'chat': '聊天',
+    'summary': '对话摘要',
+}
+
+_lock = threading.Lock()
+
+
+def usage_file(work_dir, root_path):
+    """工作区用量记录文件，没有打开工作区时记在公共缓存目录"""
+    cache_dir = workspace_cache_dir(work_dir, root_path) if root_path else os.path.join(work_dir, 'cache')
+    return os.path.join(cache_dir, 'usage.json')
+
+
+class UsageLedger:
+    """工作区的token用量记录
+
+    按 日期 -> 模型 -> 操作 汇总为 [请求数, 输入token, 输出token, 其中按估算记录的请求数]，
+    接口返回了用量时记录实际值，否则记录估算值。
+    """
+    def __init__(self, work_dir, root_path):
+        self.store = get_store(usage_file(work_dir, root_path), default={})
+
+    def record(self, model, action, prompt_tokens, completion_tokens, estimated=False):
+        """记录一次请求的用量（可在任意线程中调用）"""
+        day = time.strftime('%Y-%m-%d')
+        with _lock:
+            data = copy.deepcopy(self.store.get() or {})
+            entry = data.setdefault(day, {}).setdefault(model, {}).setdefault(action, [0, 0, 0, 0])
+            entry[0] += 1
+            entry[1] += prompt_tokens
+            entry[2] += completion_tokens
+            entry[3] += 1 if estimated else 0
+            self.store.set(data)
+
+    def rows(self):
+        """按日期倒序列出 (日期, 模型, 操作, 请求数, 输入token, 输出token, 估算的请求数)"""
+        data = self.store.get() or {}
+        rows = []
+        for day in sorted(data, reverse=True):
+            for model in sorted(data[day]):
+                for action, entry in sorted(data[day][model].items()):
+                    rows.append((day, model, action, *entry))
+        return rows
+
+    def totals(self, day=None):
+        """汇总某一天（默认全部）的 (请求数, 输入token, 输出token)"""
+        requests = prompt = completion = 0
+        for row in self.rows():
+            if day is None or row[0] == day:
+                requests += row[3]
+                prompt += row[4]
+                completion += row[5]
+        return requests, prompt, completion
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
+START_TIME = time.perf_counter()
+
 import sys
 import os
 from PyQt5.QtWidgets import QApplication
-from PyQt5.QtCore import Qt, QSettings
-from ui.main_window import MainWindow
+from PyQt5.QtCore import Qt, QSettings, QTimer
 
 # 获取工作目录
 if getattr(sys, 'frozen', False):
@@ -13,30 +15,55 @@ if getattr(sys, 'frozen', False):
 else:
     work_dir = os.getcwd().replace('\\', '/')
 
+
+class StartupTimer:
+    """记录启动各阶段的耗时"""
+    def __init__(self):
+        self.last = START_TIME
+
+    def phase(self, name):
+        now = time.perf_counter()
+        print(f"启动阶段 {name}: {(now - self.last) * 1000:.1f} ms（累计 {(now - START_TIME) * 1000:.1f} ms）")
+        self.last = now
+
+
 def main():
+    timer = StartupTimer()
+
     # 启用高DPI支持
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
-    
+
     app = QApplication(sys.argv)
     app.setApplicationName("Novel AI Composer")
     app.setOrganizationName("NovelAI")
-    
-    # 设置应用样式
+    timer.phase("创建QApplication")
+
+    # 设置应用样式（只在这里读取和应用一次）
+    from ui.styles import apply_theme
     settings = QSettings("NovelAI", "NovelAIComposer")
-    theme = settings.value("theme", "dark")
-    if theme == "light":
-        from ui.styles import get_vscode_light_style
-        app.setStyleSheet(get_vscode_light_style())
-    else:
-        from ui.styles import get_vscode_dark_style
-        app.setStyleSheet(get_vscode_dark_style())
-    
-    # 创建主窗口
+    apply_theme(app, settings.value("theme", "dark"))
+    timer.phase("加载主题")
+
+    # 创建主窗口（窗口位置和布局在显示前恢复）
+    from ui.main_window import MainWindow
+    timer.phase("导入界面模块")
     window = MainWindow(work_dir)
+    timer.phase("创建主窗口")
     window.show()
-    
+    timer.phase("显示主窗口")
+
+    # 首次绘制之后再恢复工作区和打开的文件
+    def restore_session():
+        timer.phase("进入事件循环")
+        window.restore_session()
+        timer.phase("恢复会话")
+    QTimer.singleShot(0, restore_session)
+
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
+    # 一致性检查使用进程池，打包后的程序需要在子进程中跳过主程序
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
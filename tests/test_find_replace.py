@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.find_replace import compile_pattern, find_matches, read_text, replace_raw_text
+
+
+class FindReplaceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'chapter.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_matches_use_editor_offsets(self):
+        with open(self.file_path, 'w', encoding='utf-8', newline='') as f:
+            f.write('第一行\r\n第二行\r\n目标')
+        count, matches = find_matches(read_text(self.file_path), compile_pattern('目标'))
+        self.assertEqual(count, 1)
+        self.assertEqual(matches[0][:3], (8, 10, 3))
+
+    def test_replace_keeps_line_endings(self):
+        raw = '甲\r\n乙\r\n丙\r丁\n'
+        pattern = compile_pattern(r'^(.)$', use_regex=True)
+        self.assertEqual(replace_raw_text(raw, pattern, r'<\1>', True),
+                         ('<甲>\r\n<乙>\r\n<丙>\r<丁>\n', 4))
+        self.assertEqual(replace_raw_text(raw, compile_pattern('乙\n丙'), '-', False),
+                         ('甲\r\n-\r丁\n', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
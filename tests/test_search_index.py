@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from core.search_index import SearchIndexer, WorkspaceSearch, open_database
+
+
+class WorkspaceSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, 'search.db')
+        self.file_path = os.path.join(self.directory, 'chapter.txt')
+
+    def tearDown(self):
+        self.search.conn.close()
+        self.indexer.conn.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def index(self, text):
+        with open(self.file_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self.indexer = SearchIndexer(self.db_path)
+        self.indexer.update([self.file_path])
+        self.search = WorkspaceSearch(self.directory)
+        self.search.conn = open_database(self.db_path)
+
+    def hits(self, query):
+        results = self.search.search(query)
+        return results[0]['hits'] if results else []
+
+    def test_single_character_before_whitespace_or_end(self):
+        self.index("他吃了饭。她也吃了饭，然后走了 \n来了")
+        self.assertEqual(self.hits("了"), [2, 8, 14, 18])
+
+    def test_query_of_single_characters_matches_contiguously(self):
+        self.index("hello world, go w")
+        self.assertEqual(self.hits("o w"), [4, 14])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QTextCursor
+
+from ui.text_editor import TextEditor
+
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+class UndoHistoryTest(unittest.TestCase):
+    def type_at_end(self, editor, text):
+        cursor = editor.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+
+    def type_at(self, editor, position, text):
+        cursor = editor.textCursor()
+        cursor.setPosition(position)
+        cursor.insertText(text)
+
+    def test_restore_with_characters_outside_bmp(self):
+        editor = TextEditor()
+        editor.setPlainText('😀😀开头')
+        self.type_at_end(editor, 'AAA')
+        self.type_at(editor, 2, 'BB')  # UTF-16位置2在第一个表情之后
+        expected = editor.toPlainText()
+        self.assertEqual(expected, '😀BB😀开头AAA')
+
+        history = editor.capture_undo_history(50)
+        editor.setPlainText(expected)
+        editor.restore_undo_history(history)
+
+        self.assertEqual(editor.toPlainText(), expected)
+        self.assertFalse(editor.document().isModified())
+        # 逐步撤销回到最初的文本，每一步都不含被截断的代理对
+        while editor.document().isUndoAvailable():
+            editor.document().undo()
+            text = editor.toPlainText()
+            text.encode('utf-8')
+        self.assertEqual(editor.toPlainText(), '😀😀开头')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import html
+import itertools
+from PyQt5.QtWidgets import (QListView, QStyledItemDelegate, QStyle,
+                             QAbstractItemView, QApplication)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRectF, QTimer
+from PyQt5.QtGui import QTextDocument, QAbstractTextDocumentLayout, QKeySequence
+
+
+MESSAGE_MARGIN = 6
+RELAYOUT_DELAY = 100  # 毫秒，流式输出时消息高度变化最多每隔这么久重新布局一次
+
+_message_keys = itertools.count()
+
+
+def format_message_html(sender, message):
+    """把一条消息转为HTML，消息内容按纯文本显示"""
+    return f"<b>{sender}:</b> " + html.escape(message).replace('\n', '<br>')
+
+
+class ChatMessageModel(QAbstractListModel):
+    """聊天消息列表，每条消息为 {'key', 'sender', 'text'}，key在文本变化时更新"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.messages = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{message['sender']}: {message['text']}"
+        if role == Qt.UserRole:
+            return message
+        return None
+
+    def make_message(self, sender, text):
+        return {'key': next(_message_keys), 'sender': sender, 'text': text}
+
+    def set_messages(self, messages):
+        """替换全部消息，messages为 [(发送者, 文本)]"""
+        self.beginResetModel()
+        self.messages = [self.make_message(sender, text) for sender, text in messages]
+        self.endResetModel()
+
+    def append_message(self, sender, text):
+        """在末尾添加一条消息，返回行号"""
+        row = len(self.messages)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.messages.append(self.make_message(sender, text))
+        self.endInsertRows()
+        return row
+
+    def prepend_messages(self, messages):
+        """在开头插入更早的消息"""
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self.messages[:0] = [self.make_message(sender, text) for sender, text in messages]
+        self.endInsertRows()
+
+    def append_text(self, row, text):
+        """向一条消息追加文本（流式输出），只通知这一行变化"""
+        message = self.messages[row]
+        message['text'] += text
+        message['key'] = next(_message_keys)
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages = []
+        self.endResetModel()
+
+
+class ChatMessageDelegate(QStyledItemDelegate):
+    """绘制聊天消息
+
+    每条消息排版后的QTextDocument按 (消息key, 宽度) 缓存，滚动和重绘时不重新排版；
+    文档缓存有上限，消息高度单独缓存，重新布局时不需要为屏幕外的消息重新排版。
+    流式输出只使正在更新的那条消息的缓存失效。
+    """
+    def __init__(self, parent=None, cache_size=500):
+        super().__init__(parent)
+        self.documents = {}  # 消息key -> (宽度, 文档)
+        self.heights = {}  # 消息key -> (宽度, 高度)
+        self.cache_size = cache_size
+
+    def document(self, message, width, font):
+        """获取消息排版后的文档"""
+        cached = self.documents.get(message['key'])
+        if cached and cached[0] == width:
+            return cached[1]
+
+        document = QTextDocument()
+        document.setDefaultFont(font)
+        document.setDocumentMargin(0)
+        document.setHtml(format_message_html(message['sender'], message['text']))
+        document.setTextWidth(max(width, 1))
+
+        # 缓存超出上限时丢弃最早加入的一半
+        if len(self.documents) >= self.cache_size:
+            for key in list(self.documents)[:self.cache_size // 2]:
+                del self.documents[key]
+        self.documents[message['key']] = (width, document)
+        self.heights[message['key']] = (width, int(document.size().height()))
+        return document
+
+    def height(self, message, width, font):
+        """消息排版后的高度"""
+        cached = self.heights.get(message['key'])
+        if cached and cached[0] == width:
+            return cached[1]
+        self.document(message, width, font)
+        return self.heights[message['key']][1]
+
+    def forget(self, key):
+        """丢弃一条消息的缓存"""
+        self.documents.pop(key, None)
+        self.heights.pop(key, None)
+
+    def clear_cache(self):
+        self.documents = {}
+        self.heights = {}
+
+    def content_width(self):
+        """消息按视图宽度排版"""
+        return self.parent().viewport().width() - 2 * MESSAGE_MARGIN
+
+    def sizeHint(self, option, index):
+        width = self.content_width()
+        height = self.height(index.data(Qt.UserRole), width, option.font)
+        return QSize(width + 2 * MESSAGE_MARGIN, height + 2 * MESSAGE_MARGIN)
+
+    def paint(self, painter, option, index):
+        document = self.document(index.data(Qt.UserRole), self.content_width(), option.font)
+
+        painter.save()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        painter.translate(option.rect.left() + MESSAGE_MARGIN, option.rect.top() + MESSAGE_MARGIN)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette = option.palette
+        clip = QRectF(0, 0, option.rect.width(), option.rect.height())
+        context.clip = clip
+        painter.setClipRect(clip)
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+
+class ChatView(QListView):
+    """聊天消息列表视图，只排版和绘制可见的消息"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.message_model = ChatMessageModel(self)
+        self.message_delegate = ChatMessageDelegate(self)
+        self.setModel(self.message_model)
+        self.setItemDelegate(self.message_delegate)
+
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.Adjust)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setWordWrap(True)
+
+        # 正在流式更新的消息的行号和高度，高度变化时才重新布局
+        self.streaming_row = None
+        self.streaming_height = None
+        self.relayout_timer = QTimer(self)
+        self.relayout_timer.setSingleShot(True)
+        self.relayout_timer.setInterval(RELAYOUT_DELAY)
+        self.relayout_timer.timeout.connect(self.relayout_streaming)
+
+    def is_at_bottom(self):
+        scroll_bar = self.verticalScrollBar()
+        return scroll_bar.value() >= scroll_bar.maximum() - 4
+
+    def set_messages(self, messages):
+        """显示一组消息并滚动到底部"""
+        self.relayout_timer.stop()
+        self.streaming_row = None
+        self.message_delegate.clear_cache()
+        self.message_model.set_messages(messages)
+        self.scrollToBottom()
+
+    def append_message(self, sender, text):
+        """添加一条消息，原本在底部时保持在底部"""
+        at_bottom = self.is_at_bottom()
+        row = self.message_model.append_message(sender, text)
+        if at_bottom:
+            self.scrollToBottom()
+        return row
+
+    def prepend_messages(self, messages):
+        """在开头插入更早的消息，保持当前可见内容不动"""
+        scroll_bar = self.verticalScrollBar()
+        old_maximum = scroll_bar.maximum()
+        old_value = scroll_bar.value()
+        self.message_model.prepend_messages(messages)
+        if self.streaming_row is not None:
+            self.streaming_row += len(messages)
+        self.doItemsLayout()
+        scroll_bar.setValue(old_value + scroll_bar.maximum() - old_maximum)
+
+    def start_streaming(self, sender):
+        """在末尾添加一条空消息，之后用append_streaming流式追加文本"""
+        self.streaming_row = self.append_message(sender, "")
+        self.streaming_height = None
+
+    def append_streaming(self, text):
+        """向正在流式输出的消息追加文本，只重新排版这一条消息"""
+        row = self.streaming_row
+        old_key = self.message_model.messages[row]['key']
+        self.message_model.append_text(row, text)
+        self.message_delegate.forget(old_key)
+
+        # 重新布局所有行的开销与消息数成正比，高度变化合并到定时器中处理
+        height = self.sizeHintForIndex(self.message_model.index(row)).height()
+        if height != self.streaming_height:
+            self.streaming_height = height
+            if not self.relayout_timer.isActive():
+                self.relayout_timer.start()
+
+    def finish_streaming(self):
+        """流式输出结束，立即完成最后一次布局"""
+        if self.relayout_timer.isActive():
+            self.relayout_timer.stop()
+            self.relayout_streaming()
+        self.streaming_row = None
+
+    def relayout_streaming(self):
+        """正在流式输出的消息高度变化后重新布局，原本在底部时保持在底部"""
+        if self.streaming_row is None:
+            return
+        at_bottom = self.is_at_bottom()
+        self.doItemsLayout()
+        if at_bottom:
+            self.scrollToBottom()
+
+    def dataChanged(self, top_left, bottom_right, roles=[]):
+        """消息文本变化只重绘对应的行
+
+        QListView默认会重新布局所有行；高度变化由append_text单独处理。
+        """
+        for row in range(top_left.row(), bottom_right.row() + 1):
+            self.viewport().update(self.visualRect(self.message_model.index(row)))
+
+    def clear(self):
+        self.relayout_timer.stop()
+        self.streaming_row = None
+        self.message_delegate.clear_cache()
+        self.message_model.clear()
+
+    def resizeEvent(self, event):
+        """宽度变化后旧宽度的排版缓存失效"""
+        if event.size().width() != event.oldSize().width():
+            self.message_delegate.clear_cache()
+        super().resizeEvent(event)
+
+    def keyPressEvent(self, event):
+        """复制选中的消息"""
+        if event.matches(QKeySequence.Copy):
+            rows = sorted(index.row() for index in self.selectedIndexes())
+            QApplication.clipboard().setText("\n\n".join(
+                self.message_model.index(row).data(Qt.DisplayRole) for row in rows))
+            return
+        super().keyPressEvent(event)
@@ -2,12 +2,20 @@
 
 import os
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTextEdit,
-                             QPushButton, QCompleter, QListWidget,
-                             QListWidgetItem, QStyledItemDelegate, QApplication)
-from PyQt5.QtCore import Qt, pyqtSignal, QStringListModel
+                             QPushButton, QCompleter, QListWidget, QLabel,
+                             QListWidgetItem, QStyledItemDelegate, QApplication,
+                             QMessageBox)
+from PyQt5.QtCore import Qt, pyqtSignal, QStringListModel, QThread
 from PyQt5.QtGui import QStandardItemModel, QStandardItem, QTextCursor
 
 from core.ai_handler import AIHandler
+from core.chat_history import ChatHistoryManager
+from core.chat_transcript import ChatTranscript
+from core.file_index import workspace_cache_dir
+from core.mention_resolver import (MentionResolver, MentionWorker, parse_mentions, strip_mentions,
+                                   DEFAULT_MENTION_LIMIT, DEFAULT_TOTAL_LIMIT)
+from core.tokens import estimate_tokens, count_tokens
+from .chat_view import ChatView
 
 
 class ChatInput(QTextEdit):
@@ -35,19 +43,48 @@ class ChatWidget(QWidget):
         super().__init__(parent)
         self.parent_window = parent
         self.ai_handler = AIHandler(parent.work_dir if parent else None)
-        self.history = []
+        self.history_manager = ChatHistoryManager(self.ai_handler, self)
+        self.history_manager.changed.connect(self.update_context_label)
+        self.history_manager.summary_ready.connect(self.on_summary_ready)
         self.is_ai_streaming = False
+        self.mention_resolver = MentionResolver()
+        self.mention_thread = None
+        self.mention_worker = None
+        self.transcript = None
+        self.page_end = None  # 更早一页消息的结束位置，没有更早的消息时为None
         
         self.init_ui()
+        self.update_context_label()
+        
+        # 对话记录按工作区保存
+        if parent:
+            parent.file_tree.root_changed.connect(self.open_workspace)
+            self.open_workspace(parent.file_tree.root_path)
         
     def init_ui(self):
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         
-        # 聊天记录显示
-        self.chat_history = QTextEdit()
-        self.chat_history.setReadOnly(True)
-        layout.addWidget(self.chat_history)
+        # 上下文占用和摘要
+        context_layout = QHBoxLayout()
+        self.context_label = QLabel()
+        self.context_label.setStyleSheet("color: #888;")
+        context_layout.addWidget(self.context_label)
+        context_layout.addStretch()
+        self.summary_button = QPushButton("查看摘要")
+        self.summary_button.setFlat(True)
+        self.summary_button.clicked.connect(self.show_summary)
+        context_layout.addWidget(self.summary_button)
+        new_chat_button = QPushButton("新对话")
+        new_chat_button.setFlat(True)
+        new_chat_button.clicked.connect(self.new_conversation)
+        context_layout.addWidget(new_chat_button)
+        layout.addLayout(context_layout)
+        
+        # 聊天记录显示，滚动到顶部时加载更早的消息
+        self.chat_view = ChatView()
+        self.chat_view.verticalScrollBar().valueChanged.connect(self.on_history_scrolled)
+        layout.addWidget(self.chat_view)
         
         # 输入框和发送按钮
         input_layout = QHBoxLayout()
@@ -71,6 +108,8 @@ class ChatWidget(QWidget):
         self.completer = QCompleter(self)
         self.completer_model = QStringListModel()
         self.completer.setModel(self.completer_model)
+        # 候选项已由工作区索引排序过滤，补全器不再二次过滤
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.completer.setWidget(self.input_box)
         self.completer.activated.connect(self.insert_completion)
         
@@ -78,6 +117,7 @@ class ChatWidget(QWidget):
         
     def on_text_changed(self):
         """输入框文本改变时的处理"""
+        self.update_context_label()
         cursor = self.input_box.textCursor()
         text_until_cursor = self.input_box.toPlainText()[:cursor.position()]
 
@@ -120,78 +160,88 @@ class ChatWidget(QWidget):
         
         # 添加特殊指令
         special_commands = ["选中内容", "正在编辑"]
-        items.extend(special_commands)
-        
-        # 添加文件列表
-        if self.parent_window and self.parent_window.file_tree.root_path:
-            root_path = self.parent_window.file_tree.root_path
-            for root, _, files in os.walk(root_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, root_path)
-                    items.append(relative_path)
+        items.extend(command for command in special_commands if prefix in command)
+        
+        # 添加文件列表（由工作区索引提供）
+        if self.parent_window and self.parent_window.file_index.root_path:
+            items.extend(self.parent_window.file_index.match(prefix))
                     
         self.completer_model.setStringList(items)
         
     def send_message(self):
         """发送消息"""
         message = self.input_box.toPlainText().strip()
-        if not message:
+        if not message or self.is_ai_streaming or self.mention_thread is not None:
             return
             
         # 将用户消息添加到历史记录
         self.add_message("You", message)
-        QApplication.processEvents()
-        self.history.append({"role": "user", "content": message})
+        self.history_manager.add("user", message, self.transcript.append_message("user", message))
         self.input_box.clear()
         
-        # 处理@符号
-        context = self.process_at_mentions(message)
+        # 在后台读取@引用的内容，完成后再调用AI
+        sources = self.mention_sources(message)
+        if not sources:
+            self.on_mentions_resolved("")
+            return
+        config = self.ai_handler.config
+        self.mention_thread = QThread()
+        self.mention_worker = MentionWorker(
+            self.mention_resolver, sources, strip_mentions(message),
+            int(config.get('mention_token_limit', DEFAULT_MENTION_LIMIT)),
+            int(config.get('mention_total_limit', DEFAULT_TOTAL_LIMIT)))
+        self.mention_worker.moveToThread(self.mention_thread)
+        self.mention_thread.started.connect(self.mention_worker.run)
+        self.mention_worker.finished.connect(self.on_mentions_resolved)
+        self.mention_worker.error.connect(self.on_mentions_error)
+        self.mention_thread.start()
         
-        # 准备发送给AI的消息
-        ai_messages = self.history.copy()
-        if context:
-            ai_messages[-1]["content"] = f"{context}\n\n{message}"
-            
-        # 调用AI
-        self.call_ai(ai_messages)
-        
-    def process_at_mentions(self, message):
-        """处理@符号"""
-        context = ""
-        if '@' in message:
-            parts = message.split('@')
-            for part in parts[1:]:
-                item = part.split(' ')[0]
-                
-                if item == "选中内容":
-                    editor = self.parent_window.editor_tabs.currentWidget()
-                    if editor and editor.textCursor().hasSelection():
-                        context += f"--- 选中内容 ---\n{editor.textCursor().selectedText()}\n\n"
-                        
-                elif item == "正在编辑":
-                    editor = self.parent_window.editor_tabs.currentWidget()
-                    if editor:
-                        context += f"--- 正在编辑的文件: {os.path.basename(editor.file_path)} ---\n{editor.toPlainText()}\n\n"
-                        
-                else:
-                    # 尝试作为文件路径处理
-                    if self.parent_window and self.parent_window.file_tree.root_path:
-                        file_path = os.path.join(self.parent_window.file_tree.root_path, item)
-                        if os.path.exists(file_path):
-                            try:
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    context += f"--- 文件内容: {item} ---\n{f.read()}\n\n"
-                            except Exception as e:
-                                print(f"读取文件失败: {e}")
-                                
-        return context
+    def mention_sources(self, message):
+        """收集@引用的内容来源，编辑器中的文本在这里读取，文件交给后台线程读取"""
+        sources = []
+        if not self.parent_window:
+            return sources
+        for item in parse_mentions(message):
+            if item == "选中内容":
+                editor = self.parent_window.editor_tabs.currentWidget()
+                if editor and editor.textCursor().hasSelection():
+                    sources.append(("选中内容", editor.textCursor().selectedText(), None))
+                    
+            elif item == "正在编辑":
+                editor = self.parent_window.editor_tabs.currentWidget()
+                if editor:
+                    sources.append((f"正在编辑的文件: {os.path.basename(editor.file_path)}", editor.toPlainText(), None))
+                    
+            elif self.parent_window.file_tree.root_path:
+                # 尝试作为文件路径处理
+                file_path = os.path.join(self.parent_window.file_tree.root_path, item)
+                if os.path.isfile(file_path):
+                    sources.append((f"文件内容: {item}", None, file_path))
+        return sources
+        
+    def stop_mention_thread(self):
+        """结束解析引用的线程"""
+        if self.mention_thread:
+            self.mention_thread.quit()
+            self.mention_thread.wait()
+            self.mention_thread = None
+        self.mention_worker = None
+        
+    def on_mentions_resolved(self, context):
+        """引用解析完成，调用AI"""
+        self.stop_mention_thread()
+        # 准备发送给AI的消息（摘要 + 预算内的最近对话，引用的内容只用于本次请求）
+        self.call_ai(self.history_manager.build_messages(context))
+        
+    def on_mentions_error(self, error_msg):
+        """解析引用失败时不带引用内容继续"""
+        print(f"读取引用内容失败: {error_msg}")
+        self.on_mentions_resolved("")
         
     def call_ai(self, messages):
         """调用AI"""
         try:
-            self.chat_history.moveCursor(QTextCursor.End)
-            self.chat_history.insertHtml("<br><b>AI:</b> ")
+            self.chat_view.start_streaming("AI")
             self.is_ai_streaming = True
             response_text = ""
             for chunk in self.ai_handler.chat(messages):
@@ -199,20 +249,97 @@ class ChatWidget(QWidget):
                 self.update_ai_message(chunk)
                 QApplication.processEvents()
                 
-            self.history.append({"role": "assistant", "content": response_text})
-            self.chat_history.append("")
+            self.history_manager.add("assistant", response_text,
+                                     self.transcript.append_message("assistant", response_text))
             
         except Exception as e:
             self.add_message("AI", f"错误: {str(e)}")
         finally:
+            self.chat_view.finish_streaming()
             self.is_ai_streaming = False
             
+    def update_context_label(self):
+        """显示对话历史占用的token数和摘要状态"""
+        manager = self.history_manager
+        text = f"上下文 {manager.used_tokens()}/{manager.budget()} tokens"
+        # 预览输入框中的消息大小，引用按上限计算
+        message = self.input_box.toPlainText().strip()
+        if message:
+            text += f"，本条约 {count_tokens(message)} tokens"
+            mentions = len(parse_mentions(message))
+            if mentions:
+                config = self.ai_handler.config
+                limit = min(int(config.get('mention_token_limit', DEFAULT_MENTION_LIMIT)) * mentions,
+                            int(config.get('mention_total_limit', DEFAULT_TOTAL_LIMIT)))
+                text += f"（另有{mentions}处引用，最多 {limit} tokens）"
+        if manager.summarized_count:
+            text += f"，已摘要 {manager.summarized_count} 条消息"
+        if manager.summary_thread is not None:
+            text += "，正在生成摘要..."
+        self.context_label.setText(text)
+        self.context_label.setToolTip(manager.summary)
+        self.summary_button.setVisible(bool(manager.summary))
+        
+    def show_summary(self):
+        """显示早期对话的摘要"""
+        QMessageBox.information(self, "对话摘要", self.history_manager.summary)
+        
+    def shutdown(self):
+        """等待后台摘要和引用解析结束"""
+        self.stop_mention_thread()
+        self.ai_handler.cancel()
+        self.history_manager.stop_summary()
+        
+    def open_workspace(self, root_path):
+        """打开工作区最近的对话"""
+        if self.is_ai_streaming or self.mention_thread is not None:
+            return
+        work_dir = self.parent_window.work_dir
+        self.ai_handler.set_workspace(root_path)
+        cache_dir = workspace_cache_dir(work_dir, root_path) if root_path else os.path.join(work_dir, 'cache')
+        self.transcript = ChatTranscript(os.path.join(cache_dir, 'chats'))
+        self.transcript.open_latest()
+        self.load_conversation()
+        
+    def load_conversation(self):
+        """显示对话的最后一页，并从记录末尾重建发给模型的历史"""
+        messages, self.page_end = self.transcript.load_page()
+        self.chat_view.set_messages(self.view_messages(messages))
+        
+        summary, summarized_count, recent = self.transcript.load_context(
+            self.history_manager.budget() * 2, estimate_tokens)
+        self.history_manager.restore(summary, summarized_count, recent)
+        
+    def on_history_scrolled(self, value):
+        """滚动到顶部时在前面插入更早的一页消息，保持当前可见内容不动"""
+        if value != 0 or self.page_end is None:
+            return
+        messages, self.page_end = self.transcript.load_page(self.page_end)
+        if not messages:
+            return
+        self.chat_view.prepend_messages(self.view_messages(messages))
+        
+    def view_messages(self, messages):
+        """把记录中的消息转为显示用的 (发送者, 文本)"""
+        return [("You" if message['role'] == 'user' else "AI", message['content']) for message in messages]
+        
+    def new_conversation(self):
+        """开始新的对话，之前的对话保留在记录中"""
+        if self.is_ai_streaming or self.mention_thread is not None:
+            return
+        self.transcript.new_conversation()
+        self.page_end = None
+        self.chat_view.clear()
+        self.history_manager.clear()
+        
+    def on_summary_ready(self, summary, upto):
+        """把新的摘要写入对话记录，重新打开对话时不必再次生成"""
+        self.transcript.append_summary(summary, upto)
+        
     def add_message(self, sender, message):
         """添加消息到聊天记录"""
-        self.chat_history.append(f"<b>{sender}:</b> {message}")
+        self.chat_view.append_message(sender, message)
         
     def update_ai_message(self, message):
-        """更新AI消息"""
-        self.chat_history.moveCursor(QTextCursor.End)
-        self.chat_history.insertPlainText(message)
-        self.chat_history.ensureCursorVisible()
+        """向正在输出的AI消息追加文本"""
+        self.chat_view.append_streaming(message)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import os
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTabWidget,
+                             QTableView, QTreeWidget, QTreeWidgetItem, QLabel,
+                             QPushButton, QHeaderView)
+from PyQt5.QtCore import Qt, QThread, QAbstractTableModel, QModelIndex
+
+from core.consistency import ConsistencyWorker
+
+
+class OccurrenceModel(QAbstractTableModel):
+    """章节 × 实体的出场次数表，实体按总出场次数排序"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.chapters = []
+        self.names = []
+        self.files = {}
+        self.totals = {}
+
+    def set_result(self, result):
+        self.beginResetModel()
+        self.chapters = result['chapters']
+        self.files = result['files']
+        self.totals = {}
+        for entry in self.files.values():
+            for name, count in entry['counts'].items():
+                self.totals[name] = self.totals.get(name, 0) + count
+        self.names = sorted(result['names'], key=lambda name: (-self.totals.get(name, 0), name))
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.chapters)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        chapter = self.chapters[index.row()]
+        name = self.names[index.column()]
+        count = self.files[chapter]['counts'].get(name, 0)
+        if role == Qt.DisplayRole:
+            return str(count) if count else ""
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if role == Qt.ToolTipRole:
+            return f"{name} 在 {os.path.basename(chapter)} 中出现 {count} 次"
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            name = self.names[section]
+            if role == Qt.DisplayRole:
+                return name
+            if role == Qt.ToolTipRole:
+                return f"{name}：共 {self.totals.get(name, 0)} 次"
+        else:
+            if role == Qt.DisplayRole:
+                return os.path.splitext(os.path.basename(self.chapters[section]))[0]
+            if role == Qt.ToolTipRole:
+                return self.chapters[section]
+        return None
+
+    def location(self, index):
+        """单元格对应的 (章节, 第一次出现的位置, 名称)"""
+        chapter = self.chapters[index.row()]
+        name = self.names[index.column()]
+        positions = self.files[chapter]['positions'].get(name)
+        return chapter, positions[0] if positions else None, name
+
+
+class ConsistencyDialog(QDialog):
+    """一致性检查：各章节的实体出场情况、疑似写错的名字和重复的段落"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_window = parent
+        self.scan_thread = None
+        self.scan_worker = None
+
+        self.setWindowTitle("一致性检查")
+        self.resize(800, 550)
+
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.tab_widget = QTabWidget()
+
+        # 章节 × 实体出场表，双击跳转到第一次出现的位置
+        self.occurrence_model = OccurrenceModel(self)
+        self.occurrence_view = QTableView()
+        self.occurrence_view.setModel(self.occurrence_model)
+        self.occurrence_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.occurrence_view.doubleClicked.connect(self.on_occurrence_double_clicked)
+        self.tab_widget.addTab(self.occurrence_view, "出场")
+
+        # 疑似错别字：写法 -> 章节 -> 位置
+        self.variant_tree = QTreeWidget()
+        self.variant_tree.setHeaderLabels(["写法", "次数", "上下文"])
+        self.variant_tree.header().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.variant_tree.itemDoubleClicked.connect(self.on_variant_double_clicked)
+        self.tab_widget.addTab(self.variant_tree, "疑似错别字")
+        
+        # 正文中近似重复的段落对
+        self.duplicate_tree = QTreeWidget()
+        self.duplicate_tree.setHeaderLabels(["相似度", "章节", "段落"])
+        self.duplicate_tree.header().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.duplicate_tree.itemDoubleClicked.connect(self.on_variant_double_clicked)
+        self.tab_widget.addTab(self.duplicate_tree, "重复段落")
+
+        layout.addWidget(self.tab_widget)
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+
+        self.scan_button = QPushButton("扫描")
+        self.scan_button.clicked.connect(self.start_scan)
+        button_layout.addWidget(self.scan_button)
+
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.close)
+        button_layout.addWidget(close_button)
+
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def get_text_directories(self):
+        """获取标记为“正文”的目录"""
+        categories = self.parent_window.file_tree.directory_categories
+        return sorted(path for path, category in categories.items() if category == '正文')
+
+    def start_scan(self):
+        """在后台扫描所有正文章节"""
+        if self.scan_thread is not None:
+            return
+
+        directories = self.get_text_directories()
+        if not directories:
+            self.summary_label.setText("没有标记为“正文”的目录")
+            return
+        dictionary = self.parent_window.editor_components.entity_dictionary
+        dictionary.refresh()
+        if not dictionary.entities:
+            self.summary_label.setText("“设定”目录中没有找到人物、地点等名称")
+            return
+
+        # 先保存打开的文件，扫描的是磁盘上的内容
+        self.parent_window.editor_tabs.save_all_files()
+
+        self.summary_label.setText("扫描中...")
+        self.scan_button.setEnabled(False)
+
+        self.scan_thread = QThread()
+        self.scan_worker = ConsistencyWorker(self.parent_window.work_dir, self.parent_window.file_tree.root_path,
+                                             directories, list(dictionary.entities))
+        self.scan_worker.moveToThread(self.scan_thread)
+
+        self.scan_thread.started.connect(self.scan_worker.run)
+        self.scan_worker.progress.connect(self.on_scan_progress)
+        self.scan_worker.finished.connect(self.on_scan_finished)
+        self.scan_worker.error.connect(self.on_scan_error)
+
+        self.scan_thread.start()
+
+    def stop_scan(self):
+        """结束扫描线程"""
+        if self.scan_worker:
+            self.scan_worker.cancel()
+        if self.scan_thread:
+            self.scan_thread.quit()
+            self.scan_thread.wait()
+            self.scan_thread = None
+        self.scan_worker = None
+        self.scan_button.setEnabled(True)
+
+    def on_scan_progress(self, done, total):
+        if total:
+            self.summary_label.setText(f"扫描中... {done}/{total} 个章节有变化")
+
+    def on_scan_finished(self, result):
+        """扫描完成"""
+        self.stop_scan()
+        self.occurrence_model.set_result(result)
+
+        self.variant_tree.clear()
+        variants = {}  # 写法 -> [名称, {章节: [[位置, 上下文]]}]
+        for chapter in result['chapters']:
+            for variant, (name, occurrences) in result['files'][chapter]['variants'].items():
+                entry = variants.setdefault(variant, [name, {}])
+                entry[1][chapter] = occurrences
+        # 出现次数少的写法更可能是写错的
+        for variant, (name, chapters) in sorted(variants.items(),
+                                                key=lambda item: sum(len(o) for o in item[1][1].values())):
+            count = sum(len(occurrences) for occurrences in chapters.values())
+            variant_item = QTreeWidgetItem([f"{variant} → {name}", str(count), ""])
+            for chapter, occurrences in chapters.items():
+                chapter_item = QTreeWidgetItem([os.path.basename(chapter), str(len(occurrences)), ""])
+                chapter_item.setToolTip(0, chapter)
+                chapter_item.setData(0, Qt.UserRole, (chapter, occurrences[0][0], len(variant)))
+                for position, snippet in occurrences:
+                    item = QTreeWidgetItem(["", "", snippet])
+                    item.setData(0, Qt.UserRole, (chapter, position, len(variant)))
+                    chapter_item.addChild(item)
+                variant_item.addChild(chapter_item)
+            self.variant_tree.addTopLevelItem(variant_item)
+
+        duplicates = self.show_duplicates()
+        self.summary_label.setText(
+            f"{len(result['chapters'])} 个章节，{len(result['names'])} 个名称，"
+            f"{len(variants)} 种疑似写错的写法，{duplicates} 对相似段落"
+            f"（本次扫描了 {result['scanned']} 个有变化的章节）")
+
+    def show_duplicates(self):
+        """列出段落索引中近似重复的段落对，返回对数"""
+        self.duplicate_tree.clear()
+        pairs = self.parent_window.repetition_index.duplicate_pairs()
+        for similarity, first, second in pairs:
+            pair_item = QTreeWidgetItem([f"{similarity:.0%}", "", first[3]])
+            for file_path, position, length, snippet in (first, second):
+                item = QTreeWidgetItem(["", os.path.basename(file_path), snippet])
+                item.setToolTip(1, file_path)
+                item.setData(0, Qt.UserRole, (file_path, position, length))
+                pair_item.addChild(item)
+            pair_item.setData(0, Qt.UserRole, (first[0], first[1], first[2]))
+            self.duplicate_tree.addTopLevelItem(pair_item)
+        return len(pairs)
+
+    def on_scan_error(self, error_msg):
+        """扫描出错"""
+        self.stop_scan()
+        self.summary_label.setText(f"扫描失败: {error_msg}")
+
+    def on_occurrence_double_clicked(self, index):
+        """双击单元格跳转到该名称在章节中第一次出现的位置"""
+        chapter, position, name = self.occurrence_model.location(index)
+        if position is None:
+            self.parent_window.open_file(chapter)
+        else:
+            self.parent_window.editor_tabs.goto_position(chapter, position, len(name))
+
+    def on_variant_double_clicked(self, item, column):
+        """双击跳转到疑似写错的位置或重复的段落"""
+        location = item.data(0, Qt.UserRole)
+        if location:
+            chapter, position, length = location
+            self.parent_window.editor_tabs.goto_position(chapter, position, length)
+
+    def closeEvent(self, event):
+        """关闭时结束扫描"""
+        self.stop_scan()
+        super().closeEvent(event)
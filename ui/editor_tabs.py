@@ -1,20 +1,42 @@
 # -*- coding: utf-8 -*-
 
 import os
-from PyQt5.QtWidgets import (QTabWidget, QMessageBox, QWidget, QVBoxLayout)
-from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtGui import QIcon
+from PyQt5.QtWidgets import (QTabWidget, QMessageBox, QWidget, QVBoxLayout,
+                             QToolTip)
+from PyQt5.QtCore import Qt, pyqtSignal, QEvent
+from PyQt5.QtGui import QIcon, QTextCursor
 
 from .text_editor import TextEditor
+from core.file_utils import atomic_write_text
+from core.text_stats import utf16_offset
+
+
+class LazyTab(QWidget):
+    """延迟加载的标签页占位，只保存路径和视图位置，首次激活时才读取文件"""
+    def __init__(self, file_path, view_state=None, undo_history=None, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.view_state = view_state or {}
+        self.undo_history = undo_history  # 休眠时保存的压缩撤销历史
+
+    def estimate_memory(self):
+        """估算占用的内存（字节）"""
+        if not self.undo_history:
+            return 0
+        return (len(self.undo_history['base'])
+                + sum(len(text) * 2 + 64 for _, _, text in self.undo_history['edits']))
 
 
 class EditorTabs(QTabWidget):
     tab_closed = pyqtSignal(int)
+    file_saved = pyqtSignal(str)
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_window = parent
         self.editors = {}  # file_path -> editor
+        self.lazy_tabs = {}  # file_path -> LazyTab
+        self.recent_files = []  # 最近激活的文件，最近的在末尾
         
         # 设置标签页属性
         self.setTabsClosable(True)
@@ -24,6 +46,7 @@ class EditorTabs(QTabWidget):
         # 连接信号
         self.tabCloseRequested.connect(self.close_tab)
         self.currentChanged.connect(self.on_tab_changed)
+        self.tabBar().installEventFilter(self)
         
         # 创建空白页面
         self.show_welcome_page()
@@ -46,18 +69,34 @@ class EditorTabs(QTabWidget):
     def open_file(self, file_path):
         """打开文件"""
         # 检查文件是否已经打开
-        if file_path in self.editors:
+        if file_path in self.editors or file_path in self.lazy_tabs:
             # 切换到已打开的标签
-            for i in range(self.count()):
-                if self.widget(i) == self.editors[file_path]:
-                    self.setCurrentIndex(i)
-                    return
+            widget = self.editors.get(file_path) or self.lazy_tabs.get(file_path)
+            index = self.indexOf(widget)
+            if index != -1:
+                self.setCurrentIndex(index)
+                return
                     
         # 移除欢迎页面
+        self.remove_welcome_page()
+            
+        # 创建新的编辑器
+        editor = self.create_editor(file_path)
+        if editor is None:
+            return
+            
+        # 添加到标签页
+        file_name = os.path.basename(file_path)
+        index = self.addTab(editor, file_name)
+        self.setCurrentIndex(index)
+        
+    def remove_welcome_page(self):
+        """移除欢迎页面"""
         if self.count() == 1 and isinstance(self.widget(0), QWidget) and self.tabText(0) == "欢迎":
             self.removeTab(0)
             
-        # 创建新的编辑器
+    def create_editor(self, file_path):
+        """创建编辑器并读取文件内容，失败时返回None"""
         editor = TextEditor(self.parent_window)
         editor.file_path = file_path
         
@@ -68,19 +107,134 @@ class EditorTabs(QTabWidget):
             editor.setPlainText(content)
             editor.document().setModified(False)
         except Exception as e:
+            self.dispose_editor(editor)
             QMessageBox.critical(self, "错误", f"无法打开文件: {str(e)}")
-            return
+            return None
             
-        # 添加到标签页
-        file_name = os.path.basename(file_path)
-        index = self.addTab(editor, file_name)
-        self.setCurrentIndex(index)
-        
         # 保存编辑器引用
         self.editors[file_path] = editor
         
         # 连接修改信号
         editor.textChanged.connect(lambda: self.on_text_changed(editor))
+        editor.counter.changed.connect(lambda: self.on_stats_changed(editor))
+        return editor
+        
+    def add_lazy_tab(self, file_path, view_state=None):
+        """添加延迟加载的标签页，文件内容在首次激活时读取"""
+        if file_path in self.editors or file_path in self.lazy_tabs:
+            return
+            
+        self.remove_welcome_page()
+        
+        placeholder = LazyTab(file_path, view_state, parent=self)
+        self.lazy_tabs[file_path] = placeholder
+        
+        # 添加占位页时不触发加载
+        self.blockSignals(True)
+        self.addTab(placeholder, os.path.basename(file_path))
+        self.blockSignals(False)
+        
+    def load_lazy_tab(self, index):
+        """将占位标签页替换为真正的编辑器"""
+        placeholder = self.widget(index)
+        if not isinstance(placeholder, LazyTab):
+            return placeholder
+            
+        file_path = placeholder.file_path
+        del self.lazy_tabs[file_path]
+        
+        editor = self.create_editor(file_path)
+        
+        self.blockSignals(True)
+        self.removeTab(index)
+        if editor is not None:
+            self.insertTab(index, editor, os.path.basename(file_path))
+            self.setCurrentIndex(index)
+        self.blockSignals(False)
+        placeholder.deleteLater()
+        
+        if editor is None:
+            if self.count() == 0:
+                self.show_welcome_page()
+            return None
+            
+        editor.restore_undo_history(placeholder.undo_history)
+        editor.restore_view_state(placeholder.view_state)
+        return editor
+        
+    def hibernate_editor(self, editor):
+        """释放未修改编辑器的文档，替换为占位页，激活时重新加载"""
+        index = self.indexOf(editor)
+        if index == -1 or index == self.currentIndex():
+            return False
+        # 生成中或预览还没有应用时不释放，否则生成的内容会丢失
+        if editor.document().isModified() or editor.ai_thread is not None or editor.ai_target_cursor is not None:
+            return False
+            
+        undo_history = None
+        if self.parent_window and self.parent_window.settings.value("hibernate_keep_undo", True, type=bool):
+            undo_history = editor.capture_undo_history(
+                self.parent_window.settings.value("hibernate_undo_steps", 50, type=int))
+                
+        placeholder = LazyTab(editor.file_path, editor.get_view_state(), undo_history, parent=self)
+        title = self.tabText(index)
+        
+        self.blockSignals(True)
+        self.removeTab(index)
+        self.insertTab(index, placeholder, title)
+        self.blockSignals(False)
+        
+        del self.editors[editor.file_path]
+        self.lazy_tabs[editor.file_path] = placeholder
+        self.dispose_editor(editor)
+        return True
+        
+    def dispose_editor(self, editor):
+        """销毁编辑器，先解除窗口级共享组件的附着"""
+        editor.components.detach(editor)
+        editor.deleteLater()
+        
+    def enforce_memory_budget(self):
+        """按最近最少使用顺序休眠编辑器，直到标签数和内存都在预算内"""
+        if not self.parent_window:
+            return
+            
+        settings = self.parent_window.settings
+        max_live_tabs = settings.value("max_live_tabs", 10, type=int)
+        memory_budget = settings.value("tab_memory_budget", 256, type=int) * 1024 * 1024
+        
+        live_count = len(self.editors)
+        total_memory = sum(editor.estimate_memory() for editor in self.editors.values())
+        
+        # 从最久未使用的开始
+        for file_path in list(self.recent_files):
+            if live_count <= max_live_tabs and total_memory <= memory_budget:
+                break
+            editor = self.editors.get(file_path)
+            if editor is None:
+                continue
+            memory = editor.estimate_memory()
+            if self.hibernate_editor(editor):
+                live_count -= 1
+                total_memory -= memory
+                
+    def touch_recent(self, file_path):
+        """将文件标记为最近使用"""
+        if file_path in self.recent_files:
+            self.recent_files.remove(file_path)
+        self.recent_files.append(file_path)
+        
+    def eventFilter(self, obj, event):
+        """标签栏悬停时显示每个标签页的内存占用"""
+        if obj is self.tabBar() and event.type() == QEvent.ToolTip:
+            index = self.tabBar().tabAt(event.pos())
+            widget = self.widget(index) if index != -1 else None
+            if isinstance(widget, (TextEditor, LazyTab)):
+                state = "已休眠" if isinstance(widget, LazyTab) else "已加载"
+                kb = widget.estimate_memory() / 1024
+                QToolTip.showText(event.globalPos(), f"{widget.file_path}\n{state}，内存约 {kb:.0f} KB", self.tabBar())
+                return True
+        return super().eventFilter(obj, event)
         
     def close_tab(self, index):
         """关闭标签页"""
@@ -109,7 +263,16 @@ class EditorTabs(QTabWidget):
             if widget.file_path in self.editors:
                 del self.editors[widget.file_path]
                 
+        # 占位页没有内容，直接移除
+        if isinstance(widget, LazyTab):
+            self.lazy_tabs.pop(widget.file_path, None)
+            
+        if isinstance(widget, (TextEditor, LazyTab)) and widget.file_path in self.recent_files:
+            self.recent_files.remove(widget.file_path)
+                
         self.removeTab(index)
+        if isinstance(widget, TextEditor):
+            self.dispose_editor(widget)
         self.tab_closed.emit(index)
         
         # 如果没有标签页了，显示欢迎页面
@@ -119,8 +282,7 @@ class EditorTabs(QTabWidget):
     def save_file(self, editor):
         """保存文件"""
         try:
-            with open(editor.file_path, 'w', encoding='utf-8') as f:
-                f.write(editor.toPlainText())
+            atomic_write_text(editor.file_path, editor.toPlainText())
             editor.document().setModified(False)
             
             # 更新标签页标题
@@ -128,6 +290,7 @@ class EditorTabs(QTabWidget):
             if index != -1:
                 self.setTabText(index, os.path.basename(editor.file_path))
                 
+            self.file_saved.emit(editor.file_path)
             return True
         except Exception as e:
             QMessageBox.critical(self, "错误", f"保存文件失败: {str(e)}")
@@ -158,11 +321,29 @@ class EditorTabs(QTabWidget):
             else:
                 self.setTabText(index, file_name)
                 
+    def on_stats_changed(self, editor):
+        """当前编辑器字数变化时更新状态栏"""
+        if editor is self.currentWidget() and self.parent_window:
+            self.parent_window.status_bar.update_text_stats(editor.counter.totals)
+            
+    def get_live_counts(self):
+        """获取已打开文件的实时字数统计"""
+        return {file_path: tuple(editor.counter.totals) for file_path, editor in self.editors.items()}
+                
     def on_tab_changed(self, index):
         """标签页切换时的处理"""
         widget = self.widget(index)
+        if isinstance(widget, LazyTab):
+            widget = self.load_lazy_tab(index)
         if isinstance(widget, TextEditor):
             widget.setFocus()
+            self.touch_recent(widget.file_path)
+            self.enforce_memory_budget()
+            
+        # 更新状态栏字数（状态栏在编辑器之后创建）
+        if self.parent_window and hasattr(self.parent_window, 'status_bar'):
+            totals = widget.counter.totals if isinstance(widget, TextEditor) else None
+            self.parent_window.status_bar.update_text_stats(totals)
             
     def current_editor_action(self, action):
         """当前编辑器执行动作"""
@@ -179,21 +360,58 @@ class EditorTabs(QTabWidget):
             elif action == 'paste':
                 current_widget.paste()
                 
+    def goto_position(self, file_path, position, length=0):
+        """打开文件并选中指定位置的文本"""
+        self.open_file(file_path)
+        editor = self.editors.get(file_path)
+        if editor is None:
+            return
+            
+        # 索引中的位置按Python字符计，转为编辑器中的UTF-16位置
+        text = editor.toPlainText()
+        start = utf16_offset(text, position)
+        stop = utf16_offset(text, position + length)
+        end = editor.document().characterCount() - 1
+        cursor = editor.textCursor()
+        cursor.setPosition(min(start, end))
+        cursor.setPosition(min(stop, end), QTextCursor.KeepAnchor)
+        editor.setTextCursor(cursor)
+        editor.centerCursor()
+        editor.setFocus()
+        
     def get_open_files(self):
-        """获取所有打开的文件路径"""
-        return list(self.editors.keys())
+        """获取所有打开的文件路径（按标签页顺序）"""
+        files = []
+        for i in range(self.count()):
+            widget = self.widget(i)
+            if isinstance(widget, (TextEditor, LazyTab)):
+                files.append(widget.file_path)
+        return files
+        
+    def get_view_states(self):
+        """获取所有打开文件的光标和滚动位置"""
+        states = {}
+        for file_path, editor in self.editors.items():
+            states[file_path] = editor.get_view_state()
+        for file_path, placeholder in self.lazy_tabs.items():
+            states[file_path] = placeholder.view_state
+        return states
         
     def get_active_file(self):
         """获取当前活动的文件路径"""
         current_widget = self.currentWidget()
-        if isinstance(current_widget, TextEditor):
+        if isinstance(current_widget, (TextEditor, LazyTab)):
             return current_widget.file_path
         return None
         
     def set_active_file(self, file_path):
         """设置活动文件"""
-        if file_path in self.editors:
-            editor = self.editors[file_path]
-            index = self.indexOf(editor)
+        widget = self.editors.get(file_path) or self.lazy_tabs.get(file_path)
+        if widget is not None:
+            index = self.indexOf(widget)
             if index != -1:
                 self.setCurrentIndex(index)
+                
+        # 当前标签页可能仍是占位页（setCurrentIndex未触发切换时）
+        if isinstance(self.currentWidget(), LazyTab):
+            self.on_tab_changed(self.currentIndex())
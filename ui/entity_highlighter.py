@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import time
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor
+
+from core.text_stats import utf16_offset
+
+
+FRAME_BUDGET = 0.01  # 秒，一次事件处理中高亮的最长时间，超出的块留到空闲时处理
+BATCH_BUDGET = 0.008  # 秒，空闲时每批高亮的时间
+
+
+class EntityHighlighter(QSyntaxHighlighter):
+    """高亮正文中出现的设定实体名
+
+    输入时Qt只重新高亮被修改的块；打开大文件、粘贴大段文本或实体词典变化时，
+    先高亮可见的块，其余的块在空闲时分批处理，不阻塞输入。
+    """
+    def __init__(self, editor, dictionary):
+        super().__init__(editor.document())
+        self.editor = editor
+        self.dictionary = dictionary
+        self.format = QTextCharFormat()
+        self.format.setForeground(QColor('#4ec9b0'))
+        self.format.setUnderlineStyle(QTextCharFormat.DotLine)
+
+        self.frame_start = None  # 本次事件处理中开始高亮的时间
+        self.in_batch = False
+        self.pending = None  # 等待高亮的第一个块号
+        self.batch_timer = QTimer(self)
+        self.batch_timer.setInterval(0)
+        self.batch_timer.timeout.connect(self.highlight_batch)
+
+        dictionary.changed.connect(self.rehighlight_lazily)
+        editor.updateRequest.connect(self.on_update_request)
+
+    def highlightBlock(self, text):
+        if self.dictionary.automaton is None:
+            return
+        if not self.in_batch:
+            now = time.monotonic()
+            if self.frame_start is None:
+                self.frame_start = now
+                QTimer.singleShot(0, self.end_frame)
+            elif now - self.frame_start > FRAME_BUDGET:
+                # 一次要高亮的块太多（打开文件、粘贴），剩下的留到空闲时
+                self.defer(self.currentBlock().blockNumber())
+                return
+        for start, end in self.find_utf16(text):
+            self.setFormat(start, end - start, self.format)
+
+    def end_frame(self):
+        self.frame_start = None
+
+    def defer(self, block_number):
+        """从block_number开始的块留到空闲时高亮"""
+        if self.pending is None or block_number < self.pending:
+            self.pending = block_number
+        if not self.batch_timer.isActive():
+            self.batch_timer.start()
+
+    def rehighlight_lazily(self):
+        """实体词典变化后重新高亮：可见的块立即处理，其余的块空闲时处理"""
+        self.defer(0)
+        self.highlight_visible()
+
+    def begin_batch(self):
+        # 只改变格式不改变文本，不让编辑器把它当作文本修改（字数统计、续写计时器等）
+        self.in_batch = True
+        self.document().blockSignals(True)
+
+    def end_batch(self):
+        self.document().blockSignals(False)
+        self.in_batch = False
+
+    def highlight_visible(self):
+        """立即高亮可见区域中还在等待的块"""
+        if self.pending is None:
+            return
+        editor = self.editor
+        height = editor.viewport().height()
+        offset = editor.contentOffset()
+        block = editor.firstVisibleBlock()
+        self.begin_batch()
+        try:
+            while block.isValid():
+                if editor.blockBoundingGeometry(block).translated(offset).top() > height:
+                    break
+                if block.blockNumber() >= self.pending:
+                    self.rehighlightBlock(block)
+                block = block.next()
+        finally:
+            self.end_batch()
+
+    def highlight_batch(self):
+        """空闲时分批高亮等待中的块"""
+        document = self.document()
+        if self.pending is None or document is None:
+            self.batch_timer.stop()
+            return
+        deadline = time.monotonic() + BATCH_BUDGET
+        block = document.findBlockByNumber(self.pending)
+        self.begin_batch()
+        try:
+            while block.isValid() and time.monotonic() < deadline:
+                self.rehighlightBlock(block)
+                block = block.next()
+        finally:
+            self.end_batch()
+        if block.isValid():
+            self.pending = block.blockNumber()
+        else:
+            self.pending = None
+            self.batch_timer.stop()
+
+    def on_update_request(self, rect, dy):
+        """滚动到还没有高亮的位置时优先处理可见的块"""
+        if dy and self.pending is not None:
+            self.highlight_visible()
+
+    def find_utf16(self, text):
+        """文本中的实体名，位置转为Qt使用的UTF-16位置"""
+        return [(utf16_offset(text, start), utf16_offset(text, end)) for start, end in self.dictionary.find(text)]
+
+    def entity_at(self, block, offset):
+        """块中offset位置（UTF-16位置，与positionInBlock一致）上的实体名"""
+        text = block.text()
+        for start, end in self.dictionary.find(text):
+            if utf16_offset(text, start) <= offset < utf16_offset(text, end):
+                return text[start:end]
+        return None
@@ -1,16 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
 from PyQt5.QtWidgets import (QTreeView, QFileSystemModel, QMenu, QAction,
                              QInputDialog, QMessageBox, QStyledItemDelegate,
                              QStyleOptionViewItem)
 from PyQt5.QtCore import Qt, pyqtSignal, QModelIndex
-from PyQt5.QtGui import QFont, QColor, QPalette, QPainter
+from PyQt5.QtGui import QFont, QColor, QPalette, QPainter, QBrush
 from PyQt5.QtWidgets import QFileSystemModel
 from PyQt5.QtCore import Qt
 import os
 
+from core.text_stats import TEXT_EXTENSIONS
+from core.state_store import get_store
+
 class CustomFileSystemModel(QFileSystemModel):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -38,61 +40,77 @@ class CustomFileSystemModel(QFileSystemModel):
         return super().headerData(section, orientation, role)
     
 class DirectoryDelegate(QStyledItemDelegate):
-    """自定义委托，用于显示目录类别"""
+    """自定义委托，用于显示目录类别
+
+    绘制时不访问文件系统：是否为目录取自模型缓存的文件信息，类别取自预先计算的查找表，
+    字体和画刷只创建一次。
+    """
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.category_colors = {
-            '正文': QColor(100, 200, 100),
-            '设定': QColor(100, 150, 200),
-            '草稿': QColor(200, 150, 100)
+        self.category_brushes = {
+            '正文': QBrush(QColor(100, 200, 100)),
+            '设定': QBrush(QColor(100, 150, 200)),
+            '草稿': QBrush(QColor(200, 150, 100))
         }
+        self.default_brush = QBrush(QColor(150, 150, 150))
+        self.label_font = QFont()
+        self.label_font.setPointSize(8)
+        self.category_lookup = None  # 路径 -> 类别，类别变更时重建
+        
+    def invalidate_categories(self):
+        """目录类别变更后使查找表失效"""
+        self.category_lookup = None
         
     def paint(self, painter, option, index):
         super().paint(painter, option, index)
         
-        # 获取文件路径
+        if self.category_lookup is None:
+            self.category_lookup = dict(self.parent().directory_categories)
+        if not self.category_lookup or index.column() != 0:
+            return
+            
+        # 先查类别，只有带标记的行才需要判断是否为目录
         model = index.model()
-        file_path = model.filePath(index)
-        
-        # 检查是否是目录并且有类别标记
-        if os.path.isdir(file_path):
-            category = self.parent().get_directory_category(file_path)
-            if category:
-                # 绘制类别标签
-                painter.save()
-                
-                # 计算标签位置
-                rect = option.rect
-                label_rect = rect.adjusted(rect.width() - 60, 2, -5, -rect.height() + 18)
-                
-                # 绘制背景
-                painter.setPen(Qt.NoPen)
-                painter.setBrush(self.category_colors.get(category, QColor(150, 150, 150)))
-                painter.drawRoundedRect(label_rect, 3, 3)
-                
-                # 绘制文字
-                painter.setPen(Qt.white)
-                font = QFont()
-                font.setPointSize(8)
-                painter.setFont(font)
-                painter.drawText(label_rect, Qt.AlignCenter, category)
-                
-                painter.restore()
+        category = self.category_lookup.get(model.filePath(index))
+        if category and model.isDir(index):
+            # 绘制类别标签
+            painter.save()
+            
+            # 计算标签位置
+            rect = option.rect
+            label_rect = rect.adjusted(rect.width() - 60, 2, -5, -rect.height() + 18)
+            
+            # 绘制背景
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.category_brushes.get(category, self.default_brush))
+            painter.drawRoundedRect(label_rect, 3, 3)
+            
+            # 绘制文字
+            painter.setPen(Qt.white)
+            painter.setFont(self.label_font)
+            painter.drawText(label_rect, Qt.AlignCenter, category)
+            
+            painter.restore()
 
 
 class FileTreeWidget(QTreeView):
     file_opened = pyqtSignal(str)
+    root_changed = pyqtSignal(str)
+    categories_changed = pyqtSignal()
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_window = parent
         self.root_path = None
         self.directory_categories = {}
+        self.expanded_paths = set()
         
-        # 设置文件系统模型
+        # 设置文件系统模型：选择工作区之前不设置根路径，也不挂到视图上，
+        # 避免从文件系统根目录开始监视和加载
         self.model = CustomFileSystemModel()
-        self.model.setRootPath("")
-        self.setModel(self.model)
+        self.model.setOption(QFileSystemModel.DontUseCustomDirectoryIcons)
+        self.model.setNameFilters(['*' + ext for ext in TEXT_EXTENSIONS])
+        self.model.setNameFilterDisables(False)
         
         # 设置自定义委托
         self.delegate = DirectoryDelegate(self)
@@ -102,15 +120,12 @@ class FileTreeWidget(QTreeView):
         self.setHeaderHidden(False)
         self.setAnimated(True)
         self.setIndentation(20)
-        self.setSortingEnabled(True)
-        
-        # 隐藏不需要的列
-        self.hideColumn(1)  # Size
-        self.hideColumn(2)  # Type
-        self.hideColumn(3)  # Date Modified
+        self.setUniformRowHeights(True)
         
         # 连接信号
         self.doubleClicked.connect(self.on_double_click)
+        self.expanded.connect(lambda index: self.expanded_paths.add(self.model.filePath(index)))
+        self.collapsed.connect(lambda index: self.expanded_paths.discard(self.model.filePath(index)))
         
         # 加载目录类别配置
         self.load_directory_categories()
@@ -129,15 +144,58 @@ class FileTreeWidget(QTreeView):
         ...  # 你原来的菜单构建逻辑
         menu.exec_(global_pos)
 
+    def attach_model(self):
+        """首次设置工作区时把模型挂到视图上"""
+        if QTreeView.model(self) is self.model:
+            return
+        self.setModel(self.model)
+        self.setSortingEnabled(True)
+        
+        # 隐藏不需要的列
+        self.hideColumn(1)  # Size
+        self.hideColumn(2)  # Type
+        self.hideColumn(3)  # Date Modified
+        
     def set_root_path(self, path):
         """设置根路径"""
+        self.attach_model()
         self.root_path = path
+        self.expanded_paths = set()
         index = self.model.setRootPath(path)
         self.setRootIndex(index)
         # 不要再用 setHeaderData（对 QFileSystemModel 无效）
         if isinstance(self.model, CustomFileSystemModel):
             self.model.setRootTitle(os.path.basename(path) or path)
+        self.root_changed.emit(path)
         
+    def get_tree_state(self):
+        """获取展开的目录（相对于工作区）和排序方式"""
+        if not self.root_path:
+            return None
+        header = self.header()
+        # 模型中的路径都使用/分隔；加上/避免把同名前缀的相邻目录当作子目录
+        prefix = self.root_path.rstrip('/') + '/'
+        expanded = sorted(os.path.relpath(path, self.root_path) for path in self.expanded_paths
+                          if path.startswith(prefix))
+        return {
+            'expanded': expanded,
+            'sort': [header.sortIndicatorSection(), int(header.sortIndicatorOrder())]
+        }
+        
+    def restore_tree_state(self, state):
+        """恢复展开的目录和排序方式，目录内容由模型按需加载"""
+        if not state or not self.root_path:
+            return
+        sort = state.get('sort')
+        if sort:
+            self.sortByColumn(sort[0], Qt.SortOrder(sort[1]))
+            
+        # 按层级从浅到深展开，父目录先展开
+        for rel in sorted(state.get('expanded', []), key=lambda rel: rel.count(os.sep)):
+            index = self.model.index(os.path.join(self.root_path, rel))
+            if index.isValid():
+                self.expand(index)
+                
     def on_double_click(self, index):
         """双击事件处理"""
         file_path = self.model.filePath(index)
@@ -225,6 +283,9 @@ class FileTreeWidget(QTreeView):
         """新建文件"""
         name, ok = QInputDialog.getText(self, "新建文件", "文件名:")
         if ok and name:
+            # 文件树只显示文本文件，未指定扩展名时默认为.txt
+            if not os.path.splitext(name)[1]:
+                name += '.txt'
             file_path = os.path.join(directory, name)
             try:
                 with open(file_path, 'w', encoding='utf-8') as f:
@@ -276,34 +337,31 @@ class FileTreeWidget(QTreeView):
     def set_directory_category(self, path, category):
         """设置目录类别"""
         self.directory_categories[path] = category
+        self.delegate.invalidate_categories()
         self.save_directory_categories()
         self.viewport().update()
+        self.categories_changed.emit()
         
     def clear_directory_category(self, path):
         """清除目录类别"""
         if path in self.directory_categories:
             del self.directory_categories[path]
+            self.delegate.invalidate_categories()
             self.save_directory_categories()
             self.viewport().update()
+            self.categories_changed.emit()
             
+    def categories_store(self):
+        """目录类别配置的共享存储"""
+        return get_store(os.path.join(self.parent_window.work_dir, 'directory_categories.json'))
+        
     def save_directory_categories(self):
-        """保存目录类别配置"""
+        """保存目录类别配置（先更新内存，稍后在后台写入）"""
         if self.parent_window:
-            config_path = os.path.join(self.parent_window.work_dir, 'directory_categories.json')
-            try:
-                with open(config_path, 'w', encoding='utf-8') as f:
-                    json.dump(self.directory_categories, f, ensure_ascii=False, indent=2)
-            except Exception as e:
-                print(f"保存目录类别配置失败: {e}")
+            self.categories_store().set(self.directory_categories)
                 
     def load_directory_categories(self):
         """加载目录类别配置"""
         if self.parent_window:
-            config_path = os.path.join(self.parent_window.work_dir, 'directory_categories.json')
-            if os.path.exists(config_path):
-                try:
-                    with open(config_path, 'r', encoding='utf-8') as f:
-                        self.directory_categories = json.load(f)
-                except Exception as e:
-                    print(f"加载目录类别配置失败: {e}")
-                    self.directory_categories = {}
+            self.directory_categories = dict(self.categories_store().get() or {})
+            self.delegate.invalidate_categories()
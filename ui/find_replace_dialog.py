@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QFormLayout,
+                             QLineEdit, QCheckBox, QLabel, QPushButton,
+                             QTreeWidget, QTreeWidgetItem, QMessageBox)
+from PyQt5.QtCore import Qt, QThread
+
+from core.find_replace import (compile_pattern, expand_replacement, collect_workspace_files,
+                               FindWorker, ReplaceWorker, ReplaceSnapshots)
+from core.file_utils import atomic_write_text
+from .text_editor import diff_range
+
+
+class FindReplaceDialog(QDialog):
+    """工作区查找替换对话框"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_window = parent
+        self.find_thread = None
+        self.find_worker = None
+        self.replace_thread = None
+        self.replace_worker = None
+        self.pending_editors = {}  # 等待后台替换完成后再替换的已打开文件
+        self.replace_args = None
+        self.snapshot_id = None
+
+        self.setWindowTitle("在工作区中查找替换")
+        self.resize(700, 550)
+
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        form_layout = QFormLayout()
+        self.find_edit = QLineEdit()
+        self.find_edit.returnPressed.connect(self.start_find)
+        form_layout.addRow("查找:", self.find_edit)
+        self.replace_edit = QLineEdit()
+        form_layout.addRow("替换为:", self.replace_edit)
+        layout.addLayout(form_layout)
+
+        option_layout = QHBoxLayout()
+        self.regex_check = QCheckBox("正则表达式")
+        option_layout.addWidget(self.regex_check)
+        self.case_check = QCheckBox("区分大小写")
+        option_layout.addWidget(self.case_check)
+        option_layout.addStretch()
+        layout.addLayout(option_layout)
+
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        # 匹配预览，文件项可勾选以决定是否替换
+        self.result_tree = QTreeWidget()
+        self.result_tree.setHeaderHidden(True)
+        self.result_tree.itemDoubleClicked.connect(self.on_item_double_clicked)
+        layout.addWidget(self.result_tree)
+
+        # 按钮布局
+        button_layout = QHBoxLayout()
+        self.undo_button = QPushButton("撤销上次替换")
+        self.undo_button.clicked.connect(self.undo_last_replace)
+        button_layout.addWidget(self.undo_button)
+        button_layout.addStretch()
+
+        self.find_button = QPushButton("查找")
+        self.find_button.clicked.connect(self.start_find)
+        button_layout.addWidget(self.find_button)
+
+        self.replace_button = QPushButton("全部替换")
+        self.replace_button.clicked.connect(self.replace_all)
+        self.replace_button.setEnabled(False)
+        button_layout.addWidget(self.replace_button)
+
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(close_button)
+
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def get_pattern(self):
+        """编译查找模式，无效时提示并返回None"""
+        query = self.find_edit.text()
+        if not query:
+            return None
+        try:
+            return compile_pattern(query, self.regex_check.isChecked(), self.case_check.isChecked())
+        except re.error as e:
+            QMessageBox.warning(self, "错误", f"正则表达式无效: {str(e)}")
+            return None
+
+    def get_snapshots(self):
+        root_path = self.parent_window.file_tree.root_path
+        return ReplaceSnapshots(self.parent_window.work_dir, root_path) if root_path else None
+
+    def get_open_texts(self):
+        """获取已打开文件在编辑器中的当前内容"""
+        return {path: editor.toPlainText() for path, editor in self.parent_window.editor_tabs.editors.items()}
+
+    def start_find(self):
+        """在后台线程中查找"""
+        pattern = self.get_pattern()
+        if pattern is None:
+            return
+
+        self.stop_find()
+        self.result_tree.clear()
+        self.replace_button.setEnabled(False)
+        self.status_label.setText("查找中...")
+
+        files = collect_workspace_files(self.parent_window.file_index.all_files())
+        self.find_thread = QThread()
+        self.find_worker = FindWorker(files, pattern, self.get_open_texts())
+        self.find_worker.moveToThread(self.find_thread)
+
+        self.find_thread.started.connect(self.find_worker.run)
+        self.find_worker.file_matched.connect(self.on_file_matched)
+        self.find_worker.progress.connect(self.on_find_progress)
+        self.find_worker.finished.connect(self.on_find_finished)
+        self.find_worker.error.connect(self.on_find_error)
+
+        self.find_thread.start()
+
+    def stop_find(self):
+        """结束查找线程"""
+        if self.find_worker:
+            self.find_worker.cancel()
+        if self.find_thread:
+            self.find_thread.quit()
+            self.find_thread.wait()
+            self.find_thread = None
+        self.find_worker = None
+
+    def on_file_matched(self, file_path, count, matches):
+        """查找到一个文件的匹配时立即加入预览"""
+        if self.sender() is not self.find_worker:
+            return
+
+        root_path = self.parent_window.file_tree.root_path or ''
+        file_item = QTreeWidgetItem([f"{os.path.relpath(file_path, root_path)} ({count})"])
+        file_item.setData(0, Qt.UserRole, (file_path, matches[0][0], matches[0][1] - matches[0][0]))
+        file_item.setFlags(file_item.flags() | Qt.ItemIsUserCheckable)
+        file_item.setCheckState(0, Qt.Checked)
+        for start, end, line, snippet in matches:
+            match_item = QTreeWidgetItem([f"{line}: {snippet}"])
+            match_item.setData(0, Qt.UserRole, (file_path, start, end - start))
+            file_item.addChild(match_item)
+        self.result_tree.addTopLevelItem(file_item)
+
+    def on_find_progress(self, done, total):
+        if self.sender() is self.find_worker:
+            self.status_label.setText(f"查找中... {done}/{total}")
+
+    def on_find_finished(self, matched_files, matched_count):
+        """查找完成"""
+        if self.sender() is not self.find_worker:
+            return
+        self.stop_find()
+        self.status_label.setText(f"{matched_files} 个文件中共 {matched_count} 处匹配")
+        self.replace_button.setEnabled(matched_files > 0)
+
+    def on_find_error(self, error_msg):
+        self.stop_find()
+        self.status_label.setText(f"查找失败: {error_msg}")
+
+    def on_item_double_clicked(self, item, column):
+        """双击跳转到匹配位置"""
+        data = item.data(0, Qt.UserRole)
+        if data:
+            file_path, position, length = data
+            self.parent_window.editor_tabs.goto_position(file_path, position, length)
+
+    def checked_files(self):
+        """预览中勾选的文件"""
+        files = []
+        for i in range(self.result_tree.topLevelItemCount()):
+            item = self.result_tree.topLevelItem(i)
+            if item.checkState(0) == Qt.Checked:
+                files.append(item.data(0, Qt.UserRole)[0])
+        return files
+
+    def replace_all(self):
+        """替换勾选文件中的全部匹配
+
+        未打开的文件在后台线程中原子替换；已打开的文件在编辑器中直接修改后保存，
+        编辑器中的撤销也可用。所有文件修改前的内容都写入快照。
+        """
+        pattern = self.get_pattern()
+        files = self.checked_files()
+        snapshots = self.get_snapshots()
+        if pattern is None or not files or snapshots is None or self.replace_thread:
+            return
+
+        replacement = self.replace_edit.text()
+        use_regex = self.regex_check.isChecked()
+        if use_regex:
+            try:
+                pattern.sub(replacement, '')
+            except re.error as e:
+                QMessageBox.warning(self, "错误", f"替换文本无效: {str(e)}")
+                return
+
+        editors = self.parent_window.editor_tabs.editors
+        self.pending_editors = {path: editors[path] for path in files if path in editors}
+        closed_files = [path for path in files if path not in editors]
+        self.replace_args = (pattern, replacement, use_regex)
+        self.snapshot_id = snapshots.create(f"{self.find_edit.text()} -> {replacement}")
+
+        self.replace_button.setEnabled(False)
+        self.find_button.setEnabled(False)
+        self.status_label.setText("替换中...")
+
+        self.replace_thread = QThread()
+        self.replace_worker = ReplaceWorker(snapshots, self.snapshot_id, closed_files,
+                                            pattern, replacement, use_regex)
+        self.replace_worker.moveToThread(self.replace_thread)
+
+        self.replace_thread.started.connect(self.replace_worker.run)
+        self.replace_worker.finished.connect(self.on_replace_finished)
+        self.replace_worker.error.connect(self.on_replace_error)
+
+        self.replace_thread.start()
+
+    def stop_replace(self):
+        """结束替换线程"""
+        if self.replace_thread:
+            self.replace_thread.quit()
+            self.replace_thread.wait()
+            self.replace_thread = None
+        self.replace_worker = None
+        self.find_button.setEnabled(True)
+
+    def on_replace_finished(self, results):
+        """后台替换完成后替换已打开的文件"""
+        self.stop_replace()
+        pattern, replacement, use_regex = self.replace_args
+        snapshots = self.get_snapshots()
+        tabs = self.parent_window.editor_tabs
+
+        originals = {path: editor.toPlainText() for path, editor in self.pending_editors.items()}
+        snapshots.add_files(self.snapshot_id, originals)
+        for file_path, editor in self.pending_editors.items():
+            text = originals[file_path]
+            edits = [(match.start(), match.end(), expand_replacement(match, replacement, use_regex))
+                     for match in pattern.finditer(text) if match.start() != match.end()]
+            if edits:
+                editor.apply_edits(edits)
+                tabs.save_file(editor)
+                results[file_path] = len(edits)
+        self.pending_editors = {}
+
+        if results:
+            self.parent_window.workspace_search.update_files(list(results))
+        else:
+            snapshots.remove(self.snapshot_id)
+
+        self.result_tree.clear()
+        self.status_label.setText(f"已在 {len(results)} 个文件中替换 {sum(results.values())} 处")
+
+    def on_replace_error(self, error_msg):
+        self.stop_replace()
+        self.pending_editors = {}
+        self.status_label.setText(f"替换失败: {error_msg}")
+
+    def undo_last_replace(self):
+        """从快照恢复最近一次替换涉及的全部文件"""
+        snapshots = self.get_snapshots()
+        if snapshots is None or self.replace_thread:
+            return
+        snapshot_id, snapshot = snapshots.latest()
+        if snapshot is None:
+            QMessageBox.information(self, "提示", "没有可以撤销的替换")
+            return
+
+        reply = QMessageBox.question(
+            self, "确认",
+            f"撤销替换“{snapshot['description']}”？\n将恢复 {len(snapshot['files'])} 个文件。",
+            QMessageBox.Yes | QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+
+        tabs = self.parent_window.editor_tabs
+        failed = []
+        for file_path, text in snapshot['files'].items():
+            try:
+                editor = tabs.editors.get(file_path)
+                if editor is not None:
+                    # 已打开的文件在编辑器中恢复，保留撤销记录
+                    start, end, new_text = diff_range(editor.toPlainText(), text)
+                    editor.apply_edits([(start, end, new_text)])
+                    tabs.save_file(editor)
+                else:
+                    atomic_write_text(file_path, text, newline='')
+            except Exception as e:
+                failed.append(f"{file_path}: {e}")
+
+        snapshots.remove(snapshot_id)
+        self.parent_window.workspace_search.update_files(list(snapshot['files']))
+        self.result_tree.clear()
+        if failed:
+            QMessageBox.warning(self, "错误", "部分文件恢复失败:\n" + "\n".join(failed))
+        else:
+            self.status_label.setText(f"已恢复 {len(snapshot['files'])} 个文件")
+
+    def done(self, result):
+        """关闭前结束查找线程，替换进行中时不关闭"""
+        if self.replace_thread:
+            return
+        self.stop_find()
+        super().done(result)
@@ -4,18 +4,23 @@ import os
 import json
 from PyQt5.QtWidgets import (QMainWindow, QSplitter, QVBoxLayout, QWidget,
                              QMenuBar, QMenu, QAction, QFileDialog, QTabWidget,
-                             QMessageBox, QDockWidget, QToolBar)
-from PyQt5.QtCore import Qt, QSettings
+                             QMessageBox, QDockWidget, QToolBar, QApplication)
+from PyQt5.QtCore import Qt, QSettings, QTimer
 from PyQt5.QtGui import QIcon
 
 from .file_tree import FileTreeWidget
 from .editor_tabs import EditorTabs
-from .settings_dialog import SettingsDialog
-from .styles import get_vscode_dark_style, get_vscode_light_style
-from .chat_widget import ChatWidget
+from .text_editor import EditorComponents
+from .styles import apply_theme
 from .status_bar import StatusBar
+from .search_panel import SearchPanel
 from core.state_manager import StateManager
+from core.state_store import flush_all
 from core.shortcut_manager import ShortcutManager
+from core.file_index import WorkspaceIndex
+from core.search_index import WorkspaceSearch
+from core.repetition import RepetitionIndex
+from core.retrieval import PassageIndex
 
 
 class MainWindow(QMainWindow):
@@ -25,18 +30,30 @@ class MainWindow(QMainWindow):
         self.state_manager = StateManager(work_dir)
         self.settings = QSettings("NovelAI", "NovelAIComposer")
         self.shortcut_manager = ShortcutManager(work_dir)
+        self.file_index = WorkspaceIndex(work_dir, self)
+        self.workspace_search = WorkspaceSearch(work_dir, self)
+        self.repetition_index = RepetitionIndex(self)
+        self.passage_index = PassageIndex(work_dir, self)
+        self.find_replace_dialog = None
+        self.consistency_dialog = None
+        self.chat_widget = None
+        self.saved_state = {}
+        self.session_restored = False
         
         self.init_ui()
         self.load_state()
         
+        # 定期保存会话检查点，程序崩溃后也能恢复打开的文件和工作区
+        self.checkpoint_timer = QTimer(self)
+        self.checkpoint_timer.setInterval(30000)
+        self.checkpoint_timer.timeout.connect(self.save_checkpoint)
+        self.checkpoint_timer.start()
+        
     def init_ui(self):
         self.setWindowTitle("Novel AI Composer")
         self.setWindowIcon(QIcon("logo.ico"))
         self.setGeometry(100, 100, 1200, 800)
         
-        # 应用主题
-        self.apply_theme()
-        
         # 创建菜单栏
         self.create_menu_bar()
         
@@ -50,17 +67,26 @@ class MainWindow(QMainWindow):
         # 目录树
         self.file_tree = FileTreeWidget(self)
         self.main_splitter.addWidget(self.file_tree)
+        
+        # 搜索面板（默认隐藏）
+        self.search_panel = SearchPanel(self)
+        self.search_panel.hide()
+        self.main_splitter.addWidget(self.search_panel)
 
-        # 编辑器
+        # 编辑器（浮动菜单、计时器、AIHandler等由所有编辑器共享）
+        self.editor_components = EditorComponents(self)
         self.editor_tabs = EditorTabs(self)
         self.main_splitter.addWidget(self.editor_tabs)
         
-        # 对话框
-        self.chat_widget = ChatWidget(self)
-        self.main_splitter.addWidget(self.chat_widget)
+        # 对话框容器，聊天窗口在首次显示时才创建
+        self.chat_container = QWidget()
+        chat_layout = QVBoxLayout()
+        chat_layout.setContentsMargins(0, 0, 0, 0)
+        self.chat_container.setLayout(chat_layout)
+        self.main_splitter.addWidget(self.chat_container)
 
         # 设置初始分割比例
-        self.main_splitter.setSizes([200, 600, 400])
+        self.main_splitter.setSizes([200, 250, 600, 400])
 
         # 创建左侧导航栏
         self.create_nav_bar()
@@ -78,6 +104,26 @@ class MainWindow(QMainWindow):
         
         # 连接信号
         self.file_tree.file_opened.connect(self.open_file)
+        self.file_tree.root_changed.connect(self.file_index.set_root)
+        self.file_tree.root_changed.connect(self.workspace_search.set_root)
+        self.file_tree.root_changed.connect(self.editor_components.ai_handler.set_workspace)
+        self.file_tree.root_changed.connect(self.passage_index.set_root)
+        self.editor_components.ai_handler.retriever = self.passage_index
+        self.file_index.ready.connect(lambda: self.workspace_search.sync(self.file_index.all_files()))
+        self.file_index.files_changed.connect(self.workspace_search.update_files)
+        self.editor_tabs.file_saved.connect(lambda path: self.workspace_search.update_files([path]))
+        # 设定文件或目录类别变化时更新实体高亮
+        entity_dictionary = self.editor_components.entity_dictionary
+        self.file_tree.categories_changed.connect(entity_dictionary.refresh)
+        self.editor_tabs.file_saved.connect(lambda path: entity_dictionary.refresh())
+        self.file_index.files_changed.connect(lambda paths: entity_dictionary.refresh())
+        # 正文段落索引，用于检查AI生成内容的重复和为续写检索前文
+        self.file_tree.root_changed.connect(lambda path: self.sync_text_indexes())
+        self.file_tree.categories_changed.connect(self.sync_text_indexes)
+        for index in (self.repetition_index, self.passage_index):
+            self.editor_tabs.file_saved.connect(lambda path, index=index: index.update_files([path]))
+            self.file_index.files_changed.connect(index.update_files)
+        self.workspace_search.progress.connect(self.search_panel.on_index_progress)
         self.editor_tabs.tab_closed.connect(self.on_tab_closed)
 
     def create_nav_bar(self):
@@ -92,6 +138,13 @@ class MainWindow(QMainWindow):
         self.toggle_file_tree_action.setChecked(True)
         self.toggle_file_tree_action.triggered.connect(self.toggle_file_tree)
         self.nav_bar.addAction(self.toggle_file_tree_action)
+        
+        # 搜索面板切换按钮
+        self.toggle_search_action = QAction(QIcon(), "搜索", self)
+        self.toggle_search_action.setCheckable(True)
+        self.toggle_search_action.setShortcut(self.shortcut_manager.get_qkeysequence('search_workspace'))
+        self.toggle_search_action.triggered.connect(self.toggle_search_panel)
+        self.nav_bar.addAction(self.toggle_search_action)
 
     def toggle_file_tree(self):
         """切换文件树的可见性"""
@@ -100,13 +153,18 @@ class MainWindow(QMainWindow):
         else:
             self.file_tree.show()
         
-    def apply_theme(self):
-        """应用主题"""
-        theme = self.settings.value("theme", "dark")
-        if theme == "light":
-            self.setStyleSheet(get_vscode_light_style())
+    def toggle_search_panel(self):
+        """切换搜索面板的可见性"""
+        if self.search_panel.isVisible() and self.search_panel.search_edit.hasFocus():
+            self.search_panel.hide()
         else:
-            self.setStyleSheet(get_vscode_dark_style())
+            self.search_panel.show()
+            self.search_panel.focus_search()
+        self.toggle_search_action.setChecked(self.search_panel.isVisible())
+        
+    def apply_theme(self):
+        """应用主题（样式表设置在QApplication上，只在主题变化时重新应用）"""
+        apply_theme(QApplication.instance(), self.settings.value("theme", "dark"))
             
     def create_menu_bar(self):
         menubar = self.menuBar()
@@ -168,6 +226,13 @@ class MainWindow(QMainWindow):
         paste_action.triggered.connect(lambda: self.editor_tabs.current_editor_action('paste'))
         edit_menu.addAction(paste_action)
         
+        edit_menu.addSeparator()
+        
+        find_replace_action = QAction('在工作区中查找替换(&R)', self)
+        find_replace_action.setShortcut(self.shortcut_manager.get_qkeysequence('find_replace'))
+        find_replace_action.triggered.connect(self.show_find_replace)
+        edit_menu.addAction(find_replace_action)
+        
         # 视图菜单
         view_menu = menubar.addMenu('视图(&V)')
         
@@ -179,6 +244,14 @@ class MainWindow(QMainWindow):
         # 工具菜单
         tools_menu = menubar.addMenu('工具(&T)')
         
+        stats_action = QAction('字数统计(&W)', self)
+        stats_action.triggered.connect(self.show_stats)
+        tools_menu.addAction(stats_action)
+        
+        consistency_action = QAction('一致性检查(&C)', self)
+        consistency_action.triggered.connect(self.show_consistency)
+        tools_menu.addAction(consistency_action)
+        
         settings_action = QAction('设置(&S)', self)
         settings_action.triggered.connect(self.show_settings)
         tools_menu.addAction(settings_action)
@@ -222,15 +295,66 @@ class MainWindow(QMainWindow):
         
     def show_settings(self):
         """显示设置对话框"""
+        from .settings_dialog import SettingsDialog
         dialog = SettingsDialog(self, self.work_dir)
+        if dialog.exec_():
+            # 重新加载共享AIHandler的配置
+            ai_handler = self.editor_components.ai_handler
+            ai_handler.config = ai_handler.load_config()
+            self.apply_theme()
+            if self.chat_widget is not None:
+                self.chat_widget.ai_handler.config = self.chat_widget.ai_handler.load_config()
+                self.chat_widget.update_context_label()
+        
+    def show_find_replace(self):
+        """显示工作区查找替换对话框（非模态，便于跳转到匹配位置）"""
+        if self.find_replace_dialog is None:
+            from .find_replace_dialog import FindReplaceDialog
+            self.find_replace_dialog = FindReplaceDialog(self)
+        editor = self.editor_tabs.currentWidget()
+        if hasattr(editor, 'textCursor') and editor.textCursor().hasSelection():
+            self.find_replace_dialog.find_edit.setText(editor.textCursor().selectedText())
+        self.find_replace_dialog.show()
+        self.find_replace_dialog.raise_()
+        self.find_replace_dialog.find_edit.setFocus()
+        
+    def show_stats(self):
+        """显示字数统计对话框"""
+        from .stats_dialog import StatsDialog
+        dialog = StatsDialog(self)
         dialog.exec_()
         
+    def sync_text_indexes(self):
+        """按标记为“正文”的目录同步段落索引"""
+        categories = self.file_tree.directory_categories
+        directories = [path for path, category in categories.items() if category == '正文']
+        self.repetition_index.set_directories(directories)
+        self.passage_index.set_directories(directories)
+        
+    def show_consistency(self):
+        """显示一致性检查对话框（非模态，便于跳转到章节中的位置），每次打开时重新扫描"""
+        if self.consistency_dialog is None:
+            from .consistency_dialog import ConsistencyDialog
+            self.consistency_dialog = ConsistencyDialog(self)
+        self.consistency_dialog.show()
+        self.consistency_dialog.raise_()
+        self.consistency_dialog.start_scan()
+        
+    def ensure_chat_widget(self):
+        """首次使用时创建聊天窗口"""
+        if self.chat_widget is None:
+            from .chat_widget import ChatWidget
+            self.chat_widget = ChatWidget(self)
+            self.chat_container.layout().addWidget(self.chat_widget)
+        return self.chat_widget
+        
     def toggle_chat_widget(self):
         """切换聊天窗口显示"""
-        if self.chat_widget.isVisible():
-            self.chat_widget.hide()
+        if self.chat_container.isVisible():
+            self.chat_container.hide()
         else:
-            self.chat_widget.show()
+            self.ensure_chat_widget()
+            self.chat_container.show()
             
     def save_state(self):
         """保存程序状态"""
@@ -242,51 +366,85 @@ class MainWindow(QMainWindow):
                 'height': self.height()
             },
             'splitter_sizes': self.main_splitter.sizes(),
-            'chat_visible': self.chat_widget.isVisible(),
+            'chat_visible': self.chat_container.isVisible(),
             'workspace': self.file_tree.root_path,
+            'file_tree': self.file_tree.get_tree_state(),
             'open_files': self.editor_tabs.get_open_files(),
+            'view_states': self.editor_tabs.get_view_states(),
             'active_file': self.editor_tabs.get_active_file()
         }
         self.state_manager.save_state(state)
         
+    def save_checkpoint(self):
+        """保存会话检查点（会话恢复之后才保存，避免覆盖尚未恢复的状态）"""
+        if self.session_restored:
+            self.save_state()
+            
     def load_state(self):
-        """加载程序状态"""
-        state = self.state_manager.load_state()
-        if state:
-            # 恢复窗口位置和大小
-            if 'window_geometry' in state:
-                geo = state['window_geometry']
-                self.setGeometry(geo['x'], geo['y'], geo['width'], geo['height'])
-                
-            # 恢复分割器位置
-            if 'splitter_sizes' in state and len(state['splitter_sizes']) == self.main_splitter.count():
-                self.main_splitter.setSizes(state['splitter_sizes'])
-                
-            # 恢复聊天窗口可见性
-            if 'chat_visible' in state and state['chat_visible']:
-                self.chat_widget.show()
-                
-            # 恢复工作区
-            if 'workspace' in state and state['workspace']:
-                self.file_tree.set_root_path(state['workspace'])
-                
-            # 恢复打开的文件
-            if 'open_files' in state:
-                for file_path in state['open_files']:
-                    if os.path.exists(file_path):
-                        self.editor_tabs.open_file(file_path)
-                        
-            # 恢复活动文件
-            if 'active_file' in state:
-                self.editor_tabs.set_active_file(state['active_file'])
+        """加载程序状态，在窗口显示前只恢复位置、大小和布局"""
+        state = self.saved_state = self.state_manager.load_state() or {}
+        
+        # 恢复窗口位置和大小
+        if 'window_geometry' in state:
+            geo = state['window_geometry']
+            self.setGeometry(geo['x'], geo['y'], geo['width'], geo['height'])
+            
+        # 恢复分割器位置
+        if 'splitter_sizes' in state and len(state['splitter_sizes']) == self.main_splitter.count():
+            self.main_splitter.setSizes(state['splitter_sizes'])
+            
+        # 恢复聊天窗口可见性
+        self.chat_container.setVisible(state.get('chat_visible', True))
+        
+    def restore_session(self):
+        """窗口显示后恢复聊天窗口、工作区和打开的文件"""
+        state = self.saved_state
+        
+        # 恢复工作区
+        if state.get('workspace'):
+            self.file_tree.set_root_path(state['workspace'])
+            self.file_tree.restore_tree_state(state.get('file_tree'))
+            
+        # 聊天窗口打开该工作区最近的对话
+        if not self.chat_container.isHidden():
+            self.ensure_chat_widget()
+            
+        # 恢复打开的文件（只创建占位页，内容在首次激活时加载）
+        if 'open_files' in state:
+            view_states = state.get('view_states', {})
+            for file_path in state['open_files']:
+                if os.path.exists(file_path):
+                    self.editor_tabs.add_lazy_tab(file_path, view_states.get(file_path))
+                    
+        # 恢复活动文件
+        self.editor_tabs.set_active_file(state.get('active_file'))
+        self.session_restored = True
                 
     def closeEvent(self, event):
         """关闭事件处理"""
+        # 替换进行中时不关闭，避免文件只替换了一部分
+        if self.find_replace_dialog is not None:
+            if self.find_replace_dialog.replace_thread:
+                event.ignore()
+                return
+            self.find_replace_dialog.stop_find()
+        if self.consistency_dialog is not None:
+            self.consistency_dialog.stop_scan()
+            
         # 保存所有未保存的文件
         if not self.editor_tabs.save_all_files():
             event.ignore()
             return
             
-        # 保存程序状态
-        self.save_state()
+        # 保存程序状态（会话尚未恢复时保留原状态），并立即写入所有配置文件
+        self.checkpoint_timer.stop()
+        self.save_checkpoint()
+        flush_all()
+        self.file_index.shutdown()
+        self.workspace_search.shutdown()
+        self.repetition_index.shutdown()
+        self.passage_index.shutdown()
+        self.editor_components.ai_handler.cancel()
+        if self.chat_widget is not None:
+            self.chat_widget.shutdown()
         event.accept()
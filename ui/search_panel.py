@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QLineEdit, QLabel,
+                             QTreeWidget, QTreeWidgetItem)
+from PyQt5.QtCore import Qt, QTimer
+
+
+class SearchPanel(QWidget):
+    """工作区全文搜索面板"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_window = parent
+
+        self.init_ui()
+
+        # 输入停顿后再搜索
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.run_search)
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("在工作区中搜索")
+        self.search_edit.textChanged.connect(lambda: self.search_timer.start())
+        self.search_edit.returnPressed.connect(self.run_search)
+        layout.addWidget(self.search_edit)
+
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: #888;")
+        layout.addWidget(self.status_label)
+
+        self.result_tree = QTreeWidget()
+        self.result_tree.setHeaderHidden(True)
+        self.result_tree.itemActivated.connect(self.on_item_activated)
+        self.result_tree.itemClicked.connect(self.on_item_activated)
+        layout.addWidget(self.result_tree)
+
+        self.setLayout(layout)
+
+    def focus_search(self):
+        """聚焦到搜索框，并用编辑器中选中的文本作为查询"""
+        editor = self.parent_window.editor_tabs.currentWidget()
+        if hasattr(editor, 'textCursor') and editor.textCursor().hasSelection():
+            self.search_edit.setText(editor.textCursor().selectedText())
+        self.search_edit.setFocus()
+        self.search_edit.selectAll()
+
+    def on_index_progress(self, done, total):
+        """显示索引进度"""
+        if done < total:
+            self.status_label.setText(f"正在建立索引 {done}/{total}")
+        else:
+            self.status_label.clear()
+
+    def run_search(self):
+        """执行搜索"""
+        self.search_timer.stop()
+        query = self.search_edit.text()
+        self.result_tree.clear()
+        if not query.strip():
+            self.status_label.clear()
+            return
+
+        start = time.perf_counter()
+        results = self.parent_window.workspace_search.search(query)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        root_path = self.parent_window.file_tree.root_path or ''
+        for result in results:
+            file_item = QTreeWidgetItem([
+                f"{os.path.relpath(result['path'], root_path)} ({len(result['hits'])})"
+            ])
+            file_item.setData(0, Qt.UserRole, (result['path'], result['hits'][0], len(query.strip())))
+            for position, line, snippet in result['snippets']:
+                hit_item = QTreeWidgetItem([f"{line}: {snippet}"])
+                hit_item.setData(0, Qt.UserRole, (result['path'], position, len(query.strip())))
+                file_item.addChild(hit_item)
+            self.result_tree.addTopLevelItem(file_item)
+            file_item.setExpanded(True)
+
+        self.status_label.setText(f"{len(results)} 个文件，耗时 {elapsed:.0f} ms")
+
+    def on_item_activated(self, item, column=0):
+        """跳转到命中位置"""
+        data = item.data(0, Qt.UserRole)
+        if data:
+            file_path, position, length = data
+            self.parent_window.editor_tabs.goto_position(file_path, position, length)
@@ -4,11 +4,16 @@ import os
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTabWidget,
                              QWidget, QLabel, QLineEdit, QPushButton,
                              QTextEdit, QFormLayout, QMessageBox, QComboBox,
-                             QKeySequenceEdit, QScrollArea)
+                             QKeySequenceEdit, QScrollArea, QSpinBox,
+                             QCheckBox, QTableWidget, QTableWidgetItem,
+                             QHeaderView)
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QKeySequence
 
 from core.ai_handler import AIHandler
+from core.endpoints import endpoint_pool
+from core.backends import BACKEND_NAMES
+from core.usage_ledger import ACTION_NAMES
 from core.shortcut_manager import ShortcutManager
 
 
@@ -37,10 +42,18 @@ class SettingsDialog(QDialog):
         appearance_tab = self.create_appearance_tab()
         self.tab_widget.addTab(appearance_tab, "外观")
         
+        # 编辑器设置标签页
+        editor_tab = self.create_editor_tab()
+        self.tab_widget.addTab(editor_tab, "编辑器")
+        
         # API设置标签页
         api_tab = self.create_api_tab()
         self.tab_widget.addTab(api_tab, "API设置")
         
+        # 本地模型和各动作使用的后端
+        backends_tab = self.create_backends_tab()
+        self.tab_widget.addTab(backends_tab, "本地模型")
+        
         # 提示词设置标签页
         prompts_tab = self.create_prompts_tab()
         self.tab_widget.addTab(prompts_tab, "提示词设置")
@@ -79,6 +92,37 @@ class SettingsDialog(QDialog):
         widget.setLayout(layout)
         return widget
         
+    def create_editor_tab(self):
+        """创建编辑器设置标签页"""
+        widget = QWidget()
+        layout = QFormLayout()
+        
+        # 标签页休眠
+        self.max_live_tabs_spin = QSpinBox()
+        self.max_live_tabs_spin.setRange(1, 200)
+        layout.addRow("最多保持加载的标签页:", self.max_live_tabs_spin)
+        
+        self.tab_memory_budget_spin = QSpinBox()
+        self.tab_memory_budget_spin.setRange(16, 8192)
+        self.tab_memory_budget_spin.setSuffix(" MB")
+        layout.addRow("标签页内存预算:", self.tab_memory_budget_spin)
+        
+        self.hibernate_keep_undo_check = QCheckBox("休眠时保留撤销历史")
+        layout.addRow(self.hibernate_keep_undo_check)
+        
+        info_label = QLabel(
+            "说明：\n"
+            "超出预算时，最久未使用且未修改的标签页会被休眠以释放内存，\n"
+            "切换回该标签页时自动重新加载，光标和滚动位置保持不变。\n"
+            "将鼠标悬停在标签上可查看其内存占用。"
+        )
+        info_label.setWordWrap(True)
+        info_label.setStyleSheet("color: #666; margin-top: 20px;")
+        layout.addRow(info_label)
+        
+        widget.setLayout(layout)
+        return widget
+        
     def create_api_tab(self):
         """创建API设置标签页"""
         widget = QWidget()
@@ -100,12 +144,180 @@ class SettingsDialog(QDialog):
         self.model_edit.setPlaceholderText("gpt-3.5-turbo")
         layout.addRow("模型名称:", self.model_edit)
         
+        # 备用端点，留空的字段沿用上面的设置
+        self.endpoint_table = QTableWidget(0, 5)
+        self.endpoint_table.setHorizontalHeaderLabels(["名称", "Base URL", "API Key", "模型", "权重"])
+        self.endpoint_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.endpoint_table.verticalHeader().hide()
+        self.endpoint_table.setMinimumHeight(120)
+        endpoint_layout = QVBoxLayout()
+        endpoint_layout.addWidget(self.endpoint_table)
+        endpoint_buttons = QHBoxLayout()
+        add_endpoint_button = QPushButton("添加")
+        add_endpoint_button.clicked.connect(lambda: self.add_endpoint_row({}))
+        endpoint_buttons.addWidget(add_endpoint_button)
+        remove_endpoint_button = QPushButton("删除")
+        remove_endpoint_button.clicked.connect(self.remove_endpoint_row)
+        endpoint_buttons.addWidget(remove_endpoint_button)
+        endpoint_buttons.addStretch()
+        endpoint_layout.addLayout(endpoint_buttons)
+        layout.addRow("备用端点:", endpoint_layout)
+        
+        self.routing_combo = QComboBox()
+        self.routing_combo.addItem("按健康度（首字延迟和错误率）", 'health')
+        self.routing_combo.addItem("按顺序（主端点优先）", 'priority')
+        layout.addRow("端点选择:", self.routing_combo)
+        
+        self.hedge_delay_spin = QSpinBox()
+        self.hedge_delay_spin.setRange(0, 60000)
+        self.hedge_delay_spin.setSingleStep(500)
+        self.hedge_delay_spin.setSuffix(" ms")
+        self.hedge_delay_spin.setSpecialValueText("关闭")
+        layout.addRow("首字对冲:", self.hedge_delay_spin)
+        
+        self.endpoint_health_label = QLabel()
+        self.endpoint_health_label.setStyleSheet("color: #888;")
+        layout.addRow("端点状态:", self.endpoint_health_label)
+        
+        # 对话历史预算
+        self.chat_budget_spin = QSpinBox()
+        self.chat_budget_spin.setRange(500, 200000)
+        self.chat_budget_spin.setSingleStep(500)
+        self.chat_budget_spin.setSuffix(" tokens")
+        layout.addRow("对话历史预算:", self.chat_budget_spin)
+        
+        # @引用的内容上限
+        self.mention_limit_spin = QSpinBox()
+        self.mention_limit_spin.setRange(200, 100000)
+        self.mention_limit_spin.setSingleStep(500)
+        self.mention_limit_spin.setSuffix(" tokens")
+        layout.addRow("单个引用上限:", self.mention_limit_spin)
+        
+        self.mention_total_spin = QSpinBox()
+        self.mention_total_spin.setRange(200, 200000)
+        self.mention_total_spin.setSingleStep(1000)
+        self.mention_total_spin.setSuffix(" tokens")
+        layout.addRow("引用总上限:", self.mention_total_spin)
+        
+        # 用量统计
+        self.request_usage_check = QCheckBox("请求接口返回实际用量")
+        layout.addRow("用量统计:", self.request_usage_check)
+        
+        # 长文本分段处理
+        self.chunk_limit_spin = QSpinBox()
+        self.chunk_limit_spin.setRange(500, 200000)
+        self.chunk_limit_spin.setSingleStep(500)
+        self.chunk_limit_spin.setSuffix(" tokens")
+        layout.addRow("分段上限:", self.chunk_limit_spin)
+        
+        self.chunk_concurrency_spin = QSpinBox()
+        self.chunk_concurrency_spin.setRange(1, 16)
+        layout.addRow("分段并发数:", self.chunk_concurrency_spin)
+        
+        self.reduce_summaries_check = QCheckBox("分段缩写后合并为一篇")
+        layout.addRow("分段缩写:", self.reduce_summaries_check)
+        
+        # 续写时检索的前文片段，0表示不检索
+        self.retrieval_budget_spin = QSpinBox()
+        self.retrieval_budget_spin.setRange(0, 100000)
+        self.retrieval_budget_spin.setSingleStep(500)
+        self.retrieval_budget_spin.setSuffix(" tokens")
+        layout.addRow("前文检索预算:", self.retrieval_budget_spin)
+        
         # 添加说明
         info_label = QLabel(
             "说明：\n"
             "1. API Key: 您的OpenAI API密钥\n"
             "2. Base URL: API端点地址，默认为OpenAI官方地址\n"
-            "3. 模型名称: 使用的模型，如gpt-3.5-turbo, gpt-4等"
+            "3. 模型名称: 使用的模型，如gpt-3.5-turbo, gpt-4等\n"
+            "4. 对话历史预算: 聊天时原样发送的最近对话的token上限，更早的对话会自动合并为摘要\n"
+            "5. 引用上限: 聊天中@引用的文件和文本的token上限，超出时只保留与问题相关的段落或开头和结尾\n"
+            "6. 用量统计: 在“工具 > 字数统计”中查看；接口不支持返回用量时取消勾选，改为按估算记录\n"
+            "7. 备用端点: 主端点连接失败或返回5xx时自动改用备用端点；首字对冲不为“关闭”时，"
+            "首字超过设定时间未到达会同时请求下一个端点，采用先返回的结果\n"
+            "8. 分段上限: 扩写、缩写、自定义指令选中的文本超过这个长度时，按段落分成多段同时处理，结果按原文顺序输出"
+        )
+        info_label.setWordWrap(True)
+        info_label.setStyleSheet("color: #666; margin-top: 20px;")
+        layout.addRow(info_label)
+        
+        widget.setLayout(layout)
+        return widget
+        
+    def add_endpoint_row(self, endpoint):
+        """在备用端点表格中添加一行，名称前的勾选框表示是否启用"""
+        row = self.endpoint_table.rowCount()
+        self.endpoint_table.insertRow(row)
+        values = [endpoint.get('name', ''), endpoint.get('base_url', ''), endpoint.get('api_key', ''),
+                  endpoint.get('model', ''), str(endpoint.get('weight', 1))]
+        for column, value in enumerate(values):
+            self.endpoint_table.setItem(row, column, QTableWidgetItem(value))
+        name_item = self.endpoint_table.item(row, 0)
+        name_item.setFlags(name_item.flags() | Qt.ItemIsUserCheckable)
+        name_item.setCheckState(Qt.Checked if endpoint.get('enabled', True) else Qt.Unchecked)
+        
+    def remove_endpoint_row(self):
+        """删除选中的备用端点"""
+        rows = sorted({index.row() for index in self.endpoint_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            self.endpoint_table.removeRow(row)
+            
+    def get_endpoints(self):
+        """读取备用端点表格，跳过完全没有填写的行；Base URL、API Key、模型留空时使用主端点的设置"""
+        endpoints = []
+        for row in range(self.endpoint_table.rowCount()):
+            values = [self.endpoint_table.item(row, column).text().strip() for column in range(5)]
+            name, base_url, api_key, model, weight = values
+            if not (base_url or api_key or model):
+                continue
+            try:
+                weight = float(weight)
+            except ValueError:
+                weight = 1.0
+            endpoints.append({
+                'name': name, 'base_url': base_url, 'api_key': api_key, 'model': model,
+                'weight': weight if weight > 0 else 1.0,
+                'enabled': self.endpoint_table.item(row, 0).checkState() == Qt.Checked,
+            })
+        return endpoints
+        
+    def create_backends_tab(self):
+        """创建本地模型和后端选择标签页"""
+        widget = QWidget()
+        layout = QFormLayout()
+        
+        self.local_url_edit = QLineEdit()
+        self.local_url_edit.setPlaceholderText("http://127.0.0.1:8080")
+        layout.addRow("本地服务地址:", self.local_url_edit)
+        
+        self.local_api_combo = QComboBox()
+        self.local_api_combo.addItem("OpenAI兼容接口", 'openai')
+        self.local_api_combo.addItem("llama.cpp原生接口", 'llamacpp')
+        layout.addRow("接口类型:", self.local_api_combo)
+        
+        self.local_model_edit = QLineEdit()
+        self.local_model_edit.setPlaceholderText("留空使用服务加载的模型")
+        layout.addRow("本地模型名称:", self.local_model_edit)
+        
+        self.local_key_edit = QLineEdit()
+        self.local_key_edit.setEchoMode(QLineEdit.Password)
+        self.local_key_edit.setPlaceholderText("本地服务一般不需要")
+        layout.addRow("本地API Key:", self.local_key_edit)
+        
+        # 各动作使用的后端
+        self.action_backend_combos = {}
+        for action, name in ACTION_NAMES.items():
+            combo = QComboBox()
+            for backend, backend_name in BACKEND_NAMES.items():
+                combo.addItem(backend_name, backend)
+            self.action_backend_combos[action] = combo
+            layout.addRow(f"{name}:", combo)
+        
+        info_label = QLabel(
+            "说明：\n"
+            "1. 本地服务可以是llama.cpp server、Ollama、LM Studio等提供OpenAI兼容接口的程序\n"
+            "2. llama.cpp原生接口：续写、扩写等动作直接续写提示词，聊天仍使用兼容接口\n"
+            "3. 可以为每个动作单独选择后端，例如缩写使用本地模型，续写使用远程模型"
         )
         info_label.setWordWrap(True)
         info_label.setStyleSheet("color: #666; margin-top: 20px;")
@@ -123,7 +335,7 @@ class SettingsDialog(QDialog):
         layout.addWidget(QLabel("续写提示词:"))
         self.continue_prompt_edit = QTextEdit()
         self.continue_prompt_edit.setMaximumHeight(80)
-        self.continue_prompt_edit.setPlaceholderText("使用 {context} 和 {setting} 作为占位符")
+        self.continue_prompt_edit.setPlaceholderText("使用 {context}, {setting} 和 {retrieved} 作为占位符")
         layout.addWidget(self.continue_prompt_edit)
         
         # 扩写提示词
@@ -153,7 +365,8 @@ class SettingsDialog(QDialog):
             "在提示词中使用 {context}, {prompt}, {setting} 作为占位符。\n"
             "{context} 将被替换为上下文或选中文本。\n"
             "{prompt} 将被替换为自定义指令的输入内容。\n"
-            "{setting} 将被替换为“设定”目录中所有文件的内容汇总。"
+            "{setting} 将被替换为“设定”目录中所有文件的内容汇总。\n"
+            "{retrieved} 将被替换为其他正文章节中与上文末尾最相关的片段（仅续写）。"
         )
         info_label.setWordWrap(True)
         info_label.setStyleSheet("color: #666; margin-top: 20px;")
@@ -186,7 +399,9 @@ class SettingsDialog(QDialog):
             'ai_expand': 'AI扩写',
             'ai_summarize': 'AI缩写',
             'ai_custom': 'AI自定义指令',
-            'toggle_chat': '切换聊天窗口'
+            'toggle_chat': '切换聊天窗口',
+            'search_workspace': '在工作区中搜索',
+            'find_replace': '在工作区中查找替换'
         }
         
         for name, description in shortcut_map.items():
@@ -217,16 +432,45 @@ class SettingsDialog(QDialog):
         else:
             self.theme_combo.setCurrentIndex(0)
             
+        # 编辑器设置
+        settings = self.parent_window.settings
+        self.max_live_tabs_spin.setValue(settings.value("max_live_tabs", 10, type=int))
+        self.tab_memory_budget_spin.setValue(settings.value("tab_memory_budget", 256, type=int))
+        self.hibernate_keep_undo_check.setChecked(settings.value("hibernate_keep_undo", True, type=bool))
+            
         # API设置
         config = self.ai_handler.config
         self.api_key_edit.setText(config.get('api_key', ''))
         self.base_url_edit.setText(config.get('base_url', 'https://api.openai.com/v1'))
         self.model_edit.setText(config.get('model', 'gpt-3.5-turbo'))
+        self.chat_budget_spin.setValue(int(config.get('chat_token_budget', 4000)))
+        self.mention_limit_spin.setValue(int(config.get('mention_token_limit', 2000)))
+        self.mention_total_spin.setValue(int(config.get('mention_total_limit', 8000)))
+        self.request_usage_check.setChecked(bool(config.get('request_usage', True)))
+        self.chunk_limit_spin.setValue(int(config.get('chunk_token_limit', 3000)))
+        self.chunk_concurrency_spin.setValue(int(config.get('chunk_concurrency', 4)))
+        self.reduce_summaries_check.setChecked(bool(config.get('reduce_summaries', True)))
+        self.retrieval_budget_spin.setValue(int(config.get('retrieval_token_budget', 1500)))
+        for endpoint in config.get('endpoints', []):
+            self.add_endpoint_row(endpoint)
+        self.routing_combo.setCurrentIndex(max(0, self.routing_combo.findData(config.get('routing', 'health'))))
+        self.hedge_delay_spin.setValue(int(config.get('hedge_delay', 0)))
+        self.endpoint_health_label.setText(endpoint_pool().describe(config) or "未配置")
+        
+        # 本地模型设置
+        local = config.get('local_backend', {})
+        self.local_url_edit.setText(local.get('base_url', ''))
+        self.local_api_combo.setCurrentIndex(max(0, self.local_api_combo.findData(local.get('api', 'openai'))))
+        self.local_model_edit.setText(local.get('model', ''))
+        self.local_key_edit.setText(local.get('api_key', ''))
+        action_backends = config.get('action_backends', {})
+        for action, combo in self.action_backend_combos.items():
+            combo.setCurrentIndex(max(0, combo.findData(action_backends.get(action, 'openai'))))
         
         # 提示词设置
         prompts = config.get('prompts', {})
         self.continue_prompt_edit.setPlainText(
-            prompts.get('continue', '## 设定\n{setting}\n请根据上文内容和小说设定，继续写作，保持风格和语气一致：\n\n{context}')
+            prompts.get('continue', '## 设定\n{setting}\n## 前文中的相关片段\n{retrieved}\n请根据上文内容和小说设定，继续写作，保持风格和语气一致：\n\n{context}')
         )
         self.expand_prompt_edit.setPlainText(
             prompts.get('expand', '## 设定\n{setting}\n请将以下内容进行扩写，增加更多细节和描述，但保持原意不变：\n\n{context}')
@@ -262,17 +506,43 @@ class SettingsDialog(QDialog):
         theme = "dark" if self.theme_combo.currentIndex() == 0 else "light"
         self.parent_window.settings.setValue("theme", theme)
         
+        # 保存编辑器设置
+        self.parent_window.settings.setValue("max_live_tabs", self.max_live_tabs_spin.value())
+        self.parent_window.settings.setValue("tab_memory_budget", self.tab_memory_budget_spin.value())
+        self.parent_window.settings.setValue("hibernate_keep_undo", self.hibernate_keep_undo_check.isChecked())
+        
         # 更新配置
         self.ai_handler.config['api_key'] = self.api_key_edit.text().strip()
         self.ai_handler.config['base_url'] = self.base_url_edit.text().strip()
         self.ai_handler.config['model'] = self.model_edit.text().strip()
+        self.ai_handler.config['chat_token_budget'] = self.chat_budget_spin.value()
+        self.ai_handler.config['mention_token_limit'] = self.mention_limit_spin.value()
+        self.ai_handler.config['mention_total_limit'] = self.mention_total_spin.value()
+        self.ai_handler.config['request_usage'] = self.request_usage_check.isChecked()
+        self.ai_handler.config['chunk_token_limit'] = self.chunk_limit_spin.value()
+        self.ai_handler.config['chunk_concurrency'] = self.chunk_concurrency_spin.value()
+        self.ai_handler.config['reduce_summaries'] = self.reduce_summaries_check.isChecked()
+        self.ai_handler.config['retrieval_token_budget'] = self.retrieval_budget_spin.value()
+        self.ai_handler.config['endpoints'] = self.get_endpoints()
+        self.ai_handler.config['routing'] = self.routing_combo.currentData()
+        self.ai_handler.config['hedge_delay'] = self.hedge_delay_spin.value()
+        self.ai_handler.config['local_backend'] = {
+            'base_url': self.local_url_edit.text().strip(),
+            'api': self.local_api_combo.currentData(),
+            'model': self.local_model_edit.text().strip(),
+            'api_key': self.local_key_edit.text().strip(),
+        }
+        self.ai_handler.config['action_backends'] = {
+            action: combo.currentData() for action, combo in self.action_backend_combos.items()
+        }
         
-        self.ai_handler.config['prompts'] = {
+        # 界面上没有的提示词（如分段合并）保留原值
+        self.ai_handler.config['prompts'].update({
             'continue': self.continue_prompt_edit.toPlainText(),
             'expand': self.expand_prompt_edit.toPlainText(),
             'summarize': self.summarize_prompt_edit.toPlainText(),
             'custom': self.custom_prompt_edit.toPlainText()
-        }
+        })
         
         # 保存快捷键设置
         for name, key_edit in self.shortcut_edits.items():
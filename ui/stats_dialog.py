@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+import os
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTabWidget,
+                             QTreeWidget, QTreeWidgetItem, QTableWidget,
+                             QTableWidgetItem, QLabel, QPushButton,
+                             QHeaderView, QWidget)
+from PyQt5.QtCore import Qt, QThread
+
+from core.text_stats import StatsWorker
+from core.usage_ledger import UsageLedger, ACTION_NAMES
+
+
+class StatsDialog(QDialog):
+    """项目字数统计对话框"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_window = parent
+        self.stats_thread = None
+        self.stats_worker = None
+
+        self.setWindowTitle("字数统计")
+        self.resize(600, 500)
+
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        layout = QVBoxLayout()
+
+        self.summary_label = QLabel("统计中...")
+        layout.addWidget(self.summary_label)
+
+        self.tab_widget = QTabWidget()
+
+        # 章节统计
+        self.chapter_tree = QTreeWidget()
+        self.chapter_tree.setHeaderLabels(["章节", "字数", "字符", "段落"])
+        self.chapter_tree.header().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.chapter_tree.itemDoubleClicked.connect(self.on_chapter_double_clicked)
+        self.tab_widget.addTab(self.chapter_tree, "章节")
+
+        # 每日写作量
+        self.daily_table = QTableWidget(0, 3)
+        self.daily_table.setHorizontalHeaderLabels(["日期", "总字数", "当日写作"])
+        self.daily_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.daily_table.verticalHeader().hide()
+        self.daily_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.tab_widget.addTab(self.daily_table, "每日")
+
+        # AI用量
+        usage_widget = QWidget()
+        usage_layout = QVBoxLayout()
+        usage_layout.setContentsMargins(0, 0, 0, 0)
+        self.usage_label = QLabel()
+        usage_layout.addWidget(self.usage_label)
+        self.usage_table = QTableWidget(0, 6)
+        self.usage_table.setHorizontalHeaderLabels(["日期", "模型", "操作", "请求数", "输入tokens", "输出tokens"])
+        self.usage_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.usage_table.verticalHeader().hide()
+        self.usage_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        usage_layout.addWidget(self.usage_table)
+        usage_widget.setLayout(usage_layout)
+        self.tab_widget.addTab(usage_widget, "用量")
+
+        layout.addWidget(self.tab_widget)
+
+        # 按钮布局
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+
+        self.refresh_button = QPushButton("刷新")
+        self.refresh_button.clicked.connect(self.refresh)
+        button_layout.addWidget(self.refresh_button)
+
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.accept)
+        button_layout.addWidget(close_button)
+
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def get_text_directories(self):
+        """获取标记为“正文”的目录"""
+        categories = self.parent_window.file_tree.directory_categories
+        return sorted(path for path, category in categories.items() if category == '正文')
+
+    def refresh(self):
+        """在后台线程中重新统计"""
+        if self.stats_thread is not None:
+            return
+
+        self.refresh_usage()
+
+        directories = self.get_text_directories()
+        if not directories:
+            self.summary_label.setText("没有标记为“正文”的目录")
+            return
+
+        self.summary_label.setText("统计中...")
+        self.refresh_button.setEnabled(False)
+
+        self.stats_thread = QThread()
+        self.stats_worker = StatsWorker(self.parent_window.work_dir, directories,
+                                        self.parent_window.editor_tabs.get_live_counts())
+        self.stats_worker.moveToThread(self.stats_thread)
+
+        self.stats_thread.started.connect(self.stats_worker.run)
+        self.stats_worker.finished.connect(self.on_stats_finished)
+        self.stats_worker.error.connect(self.on_stats_error)
+
+        self.stats_thread.start()
+
+    def refresh_usage(self):
+        """显示当前工作区的AI用量（用量记录常驻内存，直接读取）"""
+        ledger = UsageLedger(self.parent_window.work_dir, self.parent_window.file_tree.root_path)
+        rows = ledger.rows()
+        self.usage_table.setRowCount(len(rows))
+        for row, (day, model, action, requests, prompt, completion, estimated) in enumerate(rows):
+            values = [day, model, ACTION_NAMES.get(action, action), str(requests), str(prompt), str(completion)]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if estimated:
+                    item.setToolTip(f"其中 {estimated} 次请求的用量为估算值")
+                self.usage_table.setItem(row, column, item)
+
+        requests, prompt, completion = ledger.totals()
+        today = ledger.totals(rows[0][0]) if rows else (0, 0, 0)
+        self.usage_label.setText(
+            f"累计 {requests} 次请求，输入 {prompt} / 输出 {completion} tokens    "
+            f"最近一天 {today[0]} 次请求，输入 {today[1]} / 输出 {today[2]} tokens")
+
+    def stop_thread(self):
+        """结束统计线程"""
+        if self.stats_thread:
+            self.stats_thread.quit()
+            self.stats_thread.wait()
+            self.stats_thread = None
+        self.stats_worker = None
+        self.refresh_button.setEnabled(True)
+
+    def on_stats_finished(self, result):
+        """统计完成"""
+        self.stop_thread()
+
+        self.chapter_tree.clear()
+        for directory in result['directories']:
+            dir_item = QTreeWidgetItem([
+                os.path.basename(directory['path']) or directory['path'],
+                str(directory['words']), str(directory['chars']), str(directory['paragraphs'])
+            ])
+            dir_item.setToolTip(0, directory['path'])
+            for chapter in directory['chapters']:
+                chapter_item = QTreeWidgetItem([
+                    os.path.relpath(chapter['path'], directory['path']),
+                    str(chapter['words']), str(chapter['chars']), str(chapter['paragraphs'])
+                ])
+                chapter_item.setData(0, Qt.UserRole, chapter['path'])
+                dir_item.addChild(chapter_item)
+            self.chapter_tree.addTopLevelItem(dir_item)
+            dir_item.setExpanded(True)
+
+        daily = list(reversed(result['daily']))
+        self.daily_table.setRowCount(len(daily))
+        for row, entry in enumerate(daily):
+            self.daily_table.setItem(row, 0, QTableWidgetItem(entry['date']))
+            self.daily_table.setItem(row, 1, QTableWidgetItem(str(entry['total'])))
+            self.daily_table.setItem(row, 2, QTableWidgetItem(f"{entry['written']:+d}"))
+
+        written_today = daily[0]['written'] if daily else 0
+        self.summary_label.setText(f"正文总字数: {result['total_words']}    今日写作: {written_today:+d}")
+
+    def on_stats_error(self, error_msg):
+        """统计出错"""
+        self.stop_thread()
+        self.summary_label.setText(f"统计失败: {error_msg}")
+
+    def on_chapter_double_clicked(self, item, column):
+        """双击章节打开文件"""
+        file_path = item.data(0, Qt.UserRole)
+        if file_path:
+            self.parent_window.open_file(file_path)
+
+    def done(self, result):
+        """关闭前等待统计线程结束"""
+        self.stop_thread()
+        super().done(result)
@@ -16,6 +16,13 @@ class StatusBar(QStatusBar):
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
         
+        self.prompt_tokens_label = QLabel()
+        layout.addWidget(self.prompt_tokens_label)
+        
+        # 分段处理时显示已完成的段数
+        self.chunk_progress_label = QLabel()
+        layout.addWidget(self.chunk_progress_label)
+        
         self.char_count_label = QLabel("生成字符数: 0")
         layout.addWidget(self.char_count_label)
         
@@ -25,6 +32,10 @@ class StatusBar(QStatusBar):
         
         self.ai_progress_widget.setLayout(layout)
         
+        # 字数统计显示
+        self.text_stats_label = QLabel()
+        self.addPermanentWidget(self.text_stats_label)
+        
         self.addPermanentWidget(self.ai_progress_widget)
         self.ai_progress_widget.hide()
         
@@ -33,18 +44,37 @@ class StatusBar(QStatusBar):
     def show_ai_progress(self):
         """显示AI进度"""
         self.char_count = 0
+        self.prompt_tokens_label.setText("提示词: 计算中")
         self.char_count_label.setText("生成字符数: 0")
+        self.chunk_progress_label.hide()
         self.ai_progress_widget.show()
         
     def hide_ai_progress(self):
         """隐藏AI进度"""
         self.ai_progress_widget.hide()
         
+    def update_prompt_tokens(self, tokens):
+        """显示发送的提示词的token数"""
+        self.prompt_tokens_label.setText(f"提示词: {tokens} tokens")
+        
+    def update_chunk_progress(self, done, total):
+        """显示分段处理的进度"""
+        self.chunk_progress_label.setText(f"分段: {done}/{total}")
+        self.chunk_progress_label.show()
+        
     def update_char_count(self, count):
         """更新字符数"""
         self.char_count += count
         self.char_count_label.setText(f"生成字符数: {self.char_count}")
         
+    def update_text_stats(self, totals):
+        """更新当前文档的字数统计，totals为None时清空"""
+        if totals is None:
+            self.text_stats_label.clear()
+            return
+        chars, words, paragraphs = totals
+        self.text_stats_label.setText(f"字数: {words}  字符: {chars}  段落: {paragraphs}")
+        
     def stop_ai_generation(self):
         """停止AI生成"""
         if self.parent_window:
@@ -22,6 +22,18 @@ def get_vscode_light_style():
     return  open(resource_path("ui/style/light.qss"), "r", encoding='utf8').read()
 
 
+_applied_theme = None
+
+
+def apply_theme(app, theme):
+    """把主题样式表应用到整个程序，主题未变化时不重复读取和应用"""
+    global _applied_theme
+    if theme == _applied_theme:
+        return
+    app.setStyleSheet(get_vscode_light_style() if theme == "light" else get_vscode_dark_style())
+    _applied_theme = theme
+
+
 def get_vscode_style():
     """获取VSCode风格的样式表（兼容旧版本）"""
     return get_vscode_dark_style()
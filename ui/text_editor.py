@@ -1,13 +1,45 @@
 # -*- coding: utf-8 -*-
 
 import os
+import zlib
 from PyQt5.QtWidgets import (QPlainTextEdit, QMenu, QAction, QWidget,
                              QVBoxLayout, QHBoxLayout, QPushButton,
-                             QLabel, QTextEdit, QInputDialog, QLineEdit)
-from PyQt5.QtCore import Qt, QPoint, QTimer, pyqtSignal, QThread
+                             QLabel, QTextEdit, QInputDialog, QLineEdit, QToolTip)
+from PyQt5.QtCore import Qt, QPoint, QTimer, pyqtSignal, QThread, QObject, QEvent
 from PyQt5.QtGui import QTextCursor, QFont, QTextCharFormat, QColor
 
 from core.ai_handler import AIHandler, AIWorker
+from core.chunking import ChunkedWorker, DEFAULT_CHUNK_TOKENS
+from core.tokens import estimate_tokens
+from core.text_stats import DocumentCounter, utf16_offset
+from core.file_utils import atomic_write_text
+from core.entities import EntityDictionary
+from ui.entity_highlighter import EntityHighlighter
+
+
+def diff_range(old, new):
+    """计算两段文本的差异区间，返回(起始位置, 旧文本结束位置, 新文本片段)"""
+    # 二分查找公共前缀长度，切片比较在C层完成
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[:mid] == new[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    prefix = low
+
+    # 二分查找公共后缀长度（不与前缀重叠）
+    low, high = 0, min(len(old), len(new)) - prefix
+    while low < high:
+        mid = (low + high + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            low = mid
+        else:
+            high = mid - 1
+    suffix = low
+
+    return prefix, len(old) - suffix, new[prefix:len(new) - suffix]
 
 
 class FloatingMenu(QWidget):
@@ -50,45 +82,171 @@ class FloatingMenu(QWidget):
         self.raise_()
 
 
-class TextEditor(QPlainTextEdit):
+class AIPreview(QWidget):
+    """AI生成内容的预览面板
+
+    生成的文本先写入这里，不修改文档；应用时作为一次编辑写入文档，放弃时原文不变。
+    """
+    accepted = pyqtSignal()
+    discarded = pyqtSignal()
+    
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.parent_window = parent
-        self.file_path = None
-        self.auto_save_timer = QTimer()
-        self.floating_menu = FloatingMenu(self)
+        self.setObjectName("AIPreview")
+        self.setAttribute(Qt.WA_StyledBackground)
+        
+        layout = QVBoxLayout()
+        layout.setContentsMargins(6, 6, 6, 6)
+        layout.setSpacing(4)
+        
+        header = QHBoxLayout()
+        self.title = ""
+        self.title_label = QLabel()
+        header.addWidget(self.title_label, 1)
+        
+        self.accept_button = QPushButton("应用")
+        self.accept_button.setToolTip("Ctrl+Enter")
+        self.accept_button.clicked.connect(self.accepted.emit)
+        header.addWidget(self.accept_button)
+        
+        discard_button = QPushButton("放弃")
+        discard_button.setToolTip("Esc")
+        discard_button.clicked.connect(self.discarded.emit)
+        header.addWidget(discard_button)
+        layout.addLayout(header)
+        
+        # 与正文重复的段落和常用语
+        self.warning_label = QLabel()
+        self.warning_label.setObjectName("RepetitionWarning")
+        self.warning_label.setWordWrap(True)
+        self.warning_label.hide()
+        layout.addWidget(self.warning_label)
+        
+        self.text_view = QPlainTextEdit()
+        self.text_view.setReadOnly(True)
+        self.text_view.setUndoRedoEnabled(False)
+        layout.addWidget(self.text_view)
+        
+        self.setLayout(layout)
+        self.hide()
+        
+    def start(self, title):
+        """开始一次新的预览"""
+        self.title = title
+        self.title_label.setToolTip("")
+        self.set_running(True)
+        self.clear_text()
+        self.show()
+        self.raise_()
         
-        self.continue_button = QPushButton("续写", self)
+    def append_text(self, text):
+        """追加生成的文本"""
+        cursor = self.text_view.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text)
+        self.text_view.setTextCursor(cursor)
+        self.text_view.ensureCursorVisible()
+        self.accept_button.setEnabled(not self.text_view.document().isEmpty())
+        
+    def clear_text(self):
+        self.text_view.clear()
+        self.accept_button.setEnabled(False)
+        self.show_repetition(None)
+        
+    def text(self):
+        return self.text_view.toPlainText()
+        
+    def set_running(self, running):
+        self.title_label.setText(f"{self.title}（生成中）" if running else self.title)
+        
+    def show_error(self, error_msg):
+        """在标题中显示生成失败的原因"""
+        self.title_label.setText(f"{self.title}（生成失败：{error_msg}）")
+        self.title_label.setToolTip(error_msg)
+        
+    def show_repetition(self, result):
+        """标出与正文近似重复的段落和反复使用的短语，result为None时清除"""
+        selections = []
+        lines = []
+        if result:
+            # 检测结果中的位置按Python字符计，转为UTF-16位置
+            document = self.text_view.document()
+            text = self.text()
+            for offset, length, file_path, position, _, similarity, snippet in result['duplicates']:
+                cursor = QTextCursor(document)
+                cursor.setPosition(utf16_offset(text, offset))
+                cursor.setPosition(utf16_offset(text, offset + length), QTextCursor.KeepAnchor)
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = cursor
+                selection.format.setBackground(QColor(206, 145, 40, 70))
+                selections.append(selection)
+                source = os.path.basename(file_path) if file_path else "本次生成的内容"
+                lines.append(f"与 {source} 中的段落相似 {similarity:.0%}：{snippet}…")
+            for position, length, phrase, count in result['phrases']:
+                cursor = QTextCursor(document)
+                cursor.setPosition(utf16_offset(text, position))
+                cursor.setPosition(utf16_offset(text, position + length), QTextCursor.KeepAnchor)
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = cursor
+                selection.format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+                selection.format.setUnderlineColor(QColor('#ce9128'))
+                selections.append(selection)
+                lines.append(f"常用语“{phrase}”" + (f"在正文中出现 {count} 次" if count else "在生成内容中重复"))
+        self.text_view.setExtraSelections(selections)
+        
+        if lines:
+            duplicates, phrases = len(result['duplicates']), len(result['phrases'])
+            parts = []
+            if duplicates:
+                parts.append(f"{duplicates} 个段落与已有内容相似")
+            if phrases:
+                parts.append(f"{phrases} 处常用语")
+            self.warning_label.setText("，".join(parts))
+            self.warning_label.setToolTip("\n".join(lines[:30]))
+            self.warning_label.show()
+        else:
+            self.warning_label.hide()
+
+
+class EditorComponents(QObject):
+    """窗口级共享的编辑器辅助组件
+
+    浮动菜单、续写按钮、计时器、AIHandler和快捷键在同一时间只会被一个编辑器使用，
+    因此整个窗口只创建一份，附着到当前获得焦点的编辑器上。
+    """
+    def __init__(self, parent_window=None):
+        super().__init__(parent_window)
+        self.parent_window = parent_window
+        self.editor = None  # 当前附着的编辑器
+        self.auto_save_editor = None  # 等待自动保存的编辑器
+        
+        self.floating_menu = FloatingMenu(parent_window)
+        
+        self.continue_button = QPushButton("续写")
         self.continue_button.setObjectName("ContinueButton")
         self.continue_button.hide()
-        self.continue_button.clicked.connect(lambda: self.ai_action('continue'))
         
-        self.ai_handler = AIHandler(parent.work_dir if parent else None)
-        self.ai_worker = None
-        self.ai_thread = None
+        self.ai_handler = AIHandler(parent_window.work_dir if parent_window else None)
+        
+        # 设定中的实体名，所有编辑器共用
+        self.entity_dictionary = EntityDictionary(parent_window.work_dir if parent_window else None, self)
         
         self.continue_writing_timer = QTimer(self)
         self.continue_writing_timer.setSingleShot(True)
         self.continue_writing_timer.setInterval(2000)  # 2秒
         
-        # 设置编辑器属性
-        self.setFont(QFont("Consolas", 11))
-        self.setTabStopWidth(40)
-        
         # 设置自动保存
-        self.auto_save_timer.timeout.connect(self.auto_save)
+        self.auto_save_timer = QTimer(self)
+        self.auto_save_timer.setSingleShot(True)
         self.auto_save_timer.setInterval(1000)  # 1秒后自动保存
         
         # 连接信号
-        self.textChanged.connect(self.on_text_changed)
+        self.continue_button.clicked.connect(lambda: self.editor_action('continue'))
         self.continue_writing_timer.timeout.connect(self.show_continue_button)
-        self.selectionChanged.connect(self.on_selection_changed)
-        self.floating_menu.expand_clicked.connect(lambda: self.ai_action('expand'))
-        self.floating_menu.summarize_clicked.connect(lambda: self.ai_action('summarize'))
-        self.floating_menu.custom_clicked.connect(lambda: self.ai_action('custom'))
-        
-        # AI生成位置标记
-        self.ai_insert_position = None
+        self.auto_save_timer.timeout.connect(self.auto_save)
+        self.floating_menu.expand_clicked.connect(lambda: self.editor_action('expand'))
+        self.floating_menu.summarize_clicked.connect(lambda: self.editor_action('summarize'))
+        self.floating_menu.custom_clicked.connect(lambda: self.editor_action('custom'))
         
         # 设置快捷键
         self.setup_shortcuts()
@@ -100,30 +258,246 @@ class TextEditor(QPlainTextEdit):
         
         shortcut_manager = self.parent_window.shortcut_manager
         
-        continue_action = QAction(self)
+        continue_action = QAction(self.parent_window)
         continue_action.setShortcut(shortcut_manager.get_qkeysequence('ai_continue'))
-        continue_action.triggered.connect(lambda: self.ai_action('continue'))
-        self.addAction(continue_action)
+        continue_action.triggered.connect(self.continue_current_editor)
+        self.parent_window.addAction(continue_action)
+        
+    def continue_current_editor(self):
+        """对当前标签页的编辑器执行续写"""
+        editor = self.parent_window.editor_tabs.currentWidget()
+        if isinstance(editor, TextEditor):
+            editor.ai_action('continue')
+        
+    def attach(self, editor):
+        """附着到获得焦点的编辑器"""
+        if self.editor is not editor:
+            self.editor = editor
+            self.continue_writing_timer.stop()
+            self.continue_button.setParent(editor)
+        self.floating_menu.hide()
+        self.continue_button.hide()
+        
+    def detach(self, editor):
+        """编辑器即将销毁时解除附着，避免共享组件随之被删除"""
+        if self.auto_save_editor is editor:
+            self.auto_save_timer.stop()
+            self.auto_save_editor = None
+        if self.editor is editor:
+            self.editor = None
+            self.continue_writing_timer.stop()
+            self.floating_menu.hide()
+            self.continue_button.hide()
+            self.continue_button.setParent(None)
+            
+    def editor_action(self, action):
+        """对当前附着的编辑器执行AI动作"""
+        if self.editor:
+            self.editor.ai_action(action)
+            
+    def schedule_auto_save(self, editor):
+        """编辑器失去焦点后延迟保存"""
+        if self.auto_save_editor is not None and self.auto_save_editor is not editor:
+            # 上一个编辑器尚未保存，立即保存
+            self.auto_save()
+        self.auto_save_editor = editor
+        self.auto_save_timer.start()
+        
+    def cancel_auto_save(self, editor):
+        """编辑器重新获得焦点时停止自动保存计时器"""
+        if self.auto_save_editor is editor:
+            self.auto_save_timer.stop()
+            self.auto_save_editor = None
+            
+    def auto_save(self):
+        """自动保存"""
+        self.auto_save_timer.stop()
+        editor, self.auto_save_editor = self.auto_save_editor, None
+        if editor:
+            editor.save_file()
+            
+    def restart_continue_timer(self, editor):
+        """文本改变时重置续写计时器"""
+        if editor is not self.editor:
+            return
+        self.continue_button.hide()
+        self.continue_writing_timer.start()
+        
+    def show_continue_button(self):
+        """显示续写按钮"""
+        editor = self.editor
+        if editor is None or editor.toPlainText().strip() == "":
+            return
+            
+        cursor = editor.textCursor()
+        cursor_rect = editor.cursorRect(cursor)
+        
+        pos = cursor_rect.bottomRight()
+        self.continue_button.move(pos.x(), pos.y() + 5)
+        self.continue_button.show()
+        self.continue_button.raise_()
+
+
+class TextEditor(QPlainTextEdit):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent_window = parent
+        self.file_path = None
+        
+        # 窗口级共享组件，没有主窗口时单独创建
+        if parent is not None and hasattr(parent, 'editor_components'):
+            self.components = parent.editor_components
+        else:
+            self.components = EditorComponents(None)
             
+        self.ai_worker = None
+        self.ai_thread = None
+        
+        # 设置编辑器属性
+        self.setFont(QFont("Consolas", 11))
+        self.setTabStopWidth(40)
+        
+        # 增量字数统计
+        self.counter = DocumentCounter(self.document())
+        
+        # 高亮设定中的实体名
+        self.entity_highlighter = EntityHighlighter(self, self.components.entity_dictionary)
+        self.components.entity_dictionary.refresh()
+        
+        # 连接信号
+        self.textChanged.connect(self.on_text_changed)
+        self.selectionChanged.connect(self.on_selection_changed)
+        
+        # AI生成的内容先显示在预览面板中，target_cursor跟踪将被替换的原文范围
+        self.ai_preview = None
+        self.ai_target_cursor = None
+        self.ai_action_name = None
+        
+    def get_view_state(self):
+        """获取光标和滚动位置"""
+        return {
+            'cursor': self.textCursor().position(),
+            'scroll': self.verticalScrollBar().value()
+        }
+
+    def restore_view_state(self, state):
+        """恢复光标和滚动位置"""
+        if not state:
+            return
+
+        cursor = self.textCursor()
+        cursor.setPosition(min(state.get('cursor', 0), self.document().characterCount() - 1))
+        self.setTextCursor(cursor)
+
+        # 等待布局完成后再恢复滚动位置
+        scroll = state.get('scroll', 0)
+        QTimer.singleShot(0, lambda: self.verticalScrollBar().setValue(scroll))
+
+    def estimate_memory(self):
+        """估算文档占用的内存（字节）：文本按UTF-16存储，另加每个文本块的布局开销和撤销栈"""
+        document = self.document()
+        return (document.characterCount() * 2
+                + document.blockCount() * 256
+                + document.availableUndoSteps() * 128)
+
+    def capture_undo_history(self, limit):
+        """逐步撤销并记录每一步的差异，返回压缩后的撤销历史，用于休眠后恢复
+
+        会修改当前文档，只应在编辑器即将释放时调用。
+        """
+        document = self.document()
+        steps = min(document.availableUndoSteps(), limit)
+        if steps <= 0:
+            return None
+
+        self.blockSignals(True)
+        edits = []
+        newer = self.toPlainText()
+        for _ in range(steps):
+            document.undo()
+            older = self.toPlainText()
+            edits.append(diff_range(older, newer))
+            newer = older
+        self.blockSignals(False)
+
+        # 最早的状态整体压缩保存，之后每一步只保存差异
+        edits.reverse()
+        return {
+            'base': zlib.compress(newer.encode('utf-8')),
+            'edits': edits
+        }
+
+    def restore_undo_history(self, history):
+        """从压缩的撤销历史重建撤销栈，最终内容与当前文档一致"""
+        if not history:
+            return
+
+        current = self.toPlainText()
+        document = self.document()
+
+        self.blockSignals(True)
+        document.setUndoRedoEnabled(False)
+        self.setPlainText(zlib.decompress(history['base']).decode('utf-8'))
+        document.setUndoRedoEnabled(True)
+
+        # 每一步差异作为一次独立的撤销步骤重新应用，最后一步对齐到当前内容；
+        # 差异的位置按Python字符计，按每一步当时的文本换算为UTF-16位置
+        cursor = QTextCursor(document)
+        text = self.toPlainText()
+
+        def replace(start, end, new_text):
+            cursor.setPosition(utf16_offset(text, start))
+            cursor.setPosition(utf16_offset(text, end), QTextCursor.KeepAnchor)
+            cursor.insertText(new_text)
+            return text[:start] + new_text + text[end:]
+
+        for start, end, new_text in history['edits']:
+            text = replace(start, end, new_text)
+        start, end, new_text = diff_range(text, current)
+        if start != end or new_text:
+            replace(start, end, new_text)
+        document.setModified(False)
+        self.blockSignals(False)
+
+    def apply_edits(self, edits):
+        """把一组不重叠的修改 [(起始, 结束, 新文本)] 作为一次撤销步骤应用到文档
+
+        位置为Python字符串下标，文档中含有BMP以外的字符时换算为UTF-16位置。
+        从后往前应用，前面的位置不受影响，光标和滚动位置保持不变。
+        """
+        if not edits:
+            return
+        text = self.toPlainText()
+        astral = any(ord(c) > 0xffff for c in text)
+
+        def position(index):
+            return len(text[:index].encode('utf-16-le')) // 2 if astral else index
+
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        for start, end, new_text in sorted(edits, reverse=True):
+            cursor.setPosition(position(start))
+            cursor.setPosition(position(end), QTextCursor.KeepAnchor)
+            cursor.insertText(new_text)
+        cursor.endEditBlock()
+
     def focusOutEvent(self, event):
         """失去焦点时自动保存"""
         super().focusOutEvent(event)
         if self.document().isModified() and self.file_path:
-            self.auto_save_timer.start()
+            self.components.schedule_auto_save(self)
             
     def focusInEvent(self, event):
-        """获得焦点时停止自动保存计时器"""
+        """获得焦点时附着共享组件并停止自动保存计时器"""
         super().focusInEvent(event)
-        self.auto_save_timer.stop()
-        self.floating_menu.hide()
-        self.continue_button.hide()
+        self.components.attach(self)
+        self.components.cancel_auto_save(self)
         
     def save_file(self):
         """保存当前文件"""
         if self.file_path and self.document().isModified():
             try:
-                with open(self.file_path, 'w', encoding='utf-8') as f:
-                    f.write(self.toPlainText())
+                atomic_write_text(self.file_path, self.toPlainText())
                 self.document().setModified(False)
                 
                 # 更新标签页标题
@@ -132,35 +506,20 @@ class TextEditor(QPlainTextEdit):
                     index = tabs.indexOf(self)
                     if index != -1:
                         tabs.setTabText(index, os.path.basename(self.file_path))
+                    tabs.file_saved.emit(self.file_path)
                         
             except Exception as e:
                 print(f"保存文件失败: {e}")
 
-    def auto_save(self):
-        """自动保存"""
-        self.auto_save_timer.stop()
-        self.save_file()
-                
     def on_text_changed(self):
         """文本改变时重置续写计时器"""
-        self.continue_button.hide()
-        self.continue_writing_timer.start()
-
-    def show_continue_button(self):
-        """显示续写按钮"""
-        if self.toPlainText().strip() == "":
-            return
-            
-        cursor = self.textCursor()
-        cursor_rect = self.cursorRect(cursor)
-        
-        pos = cursor_rect.bottomRight()
-        self.continue_button.move(pos.x(), pos.y() + 5)
-        self.continue_button.show()
-        self.continue_button.raise_()
+        self.components.restart_continue_timer(self)
         
     def on_selection_changed(self):
         """选择文本改变时的处理"""
+        if self.components.editor is not self:
+            return
+            
         cursor = self.textCursor()
         if cursor.hasSelection():
             # 获取选中文本的位置
@@ -171,22 +530,30 @@ class TextEditor(QPlainTextEdit):
             global_pos.setY(global_pos.y() + 5)
             
             # 显示浮动菜单
-            self.floating_menu.show_at_position(global_pos)
+            self.components.floating_menu.show_at_position(global_pos)
         else:
-            self.floating_menu.hide()
+            self.components.floating_menu.hide()
             
     def ai_action(self, action):
         """执行AI动作"""
+        if self.ai_thread:
+            return
+        if self.ai_target_cursor is not None:
+            # 上一次的预览还没有应用或放弃，不覆盖它
+            self.components.floating_menu.hide()
+            self.place_ai_preview()
+            if self.parent_window:
+                self.parent_window.status_bar.showMessage("请先应用（Ctrl+Enter）或放弃（Esc）当前的AI预览", 5000)
+            return
         cursor = self.textCursor()
         
         if action == 'continue':
-            self.continue_button.hide()
+            self.components.continue_button.hide()
             # 续写：获取所有文本作为上下文
             context = self.toPlainText()
             
-            # 移动到文档末尾
+            # 生成的内容将插入到文档末尾
             cursor.movePosition(QTextCursor.End)
-            self.ai_insert_position = cursor.position()
             
         elif action in ['expand', 'summarize', 'custom']:
             # 扩写/缩写/自定义：获取选中的文本
@@ -194,7 +561,6 @@ class TextEditor(QPlainTextEdit):
                 return
                 
             context = cursor.selectedText()
-            self.ai_insert_position = cursor.position()
             
             # 如果是自定义指令，弹出输入框
             if action == 'custom':
@@ -207,55 +573,116 @@ class TextEditor(QPlainTextEdit):
                     return
                 # 保存自定义指令
                 self.custom_prompt = prompt
-                
-            # 删除选中的文本（将被AI生成的内容替换）
-            cursor.removeSelectedText()
+        else:
+            return
             
         # 隐藏浮动菜单
-        self.floating_menu.hide()
+        self.components.floating_menu.hide()
         
-        # 设置光标到插入位置
-        cursor.setPosition(self.ai_insert_position)
-        self.setTextCursor(cursor)
+        # 原文保持不变，生成的内容显示在预览面板中，应用时再替换选中的文本
+        self.ai_target_cursor = QTextCursor(cursor)
+        self.ai_action_name = action
+        self.highlight_ai_target()
+        self.show_ai_preview()
         
         # 更新状态栏
         if self.parent_window:
             self.parent_window.status_bar.show_ai_progress()
         
-        # 创建并启动AI工作线程
+        # 创建并启动AI工作线程；选中的文本超过上限时分段并发处理
+        ai_handler = self.components.ai_handler
+        limit = int(ai_handler.config.get('chunk_token_limit', DEFAULT_CHUNK_TOKENS))
+        chunked = action != 'continue' and estimate_tokens(context) > limit
         self.ai_thread = QThread()
-        self.ai_worker = AIWorker(self.ai_handler, action, context)
+        if chunked:
+            self.ai_worker = ChunkedWorker(ai_handler, action, context)
+        else:
+            self.ai_worker = AIWorker(ai_handler, action, context)
         if action == 'custom':
             self.ai_worker.custom_prompt = self.custom_prompt
+        elif action == 'continue':
+            self.ai_worker.file_path = self.file_path
         self.ai_worker.moveToThread(self.ai_thread)
         
         # 连接信号
         self.ai_thread.started.connect(self.ai_worker.run)
         self.ai_worker.chunk_received.connect(self.on_ai_chunk_received)
+        if self.parent_window:
+            self.ai_worker.prompt_built.connect(self.parent_window.status_bar.update_prompt_tokens)
+        if chunked:
+            self.ai_worker.restart.connect(self.on_ai_restart)
+            if self.parent_window:
+                self.ai_worker.progress.connect(self.parent_window.status_bar.update_chunk_progress)
         self.ai_worker.finished.connect(self.on_ai_finished)
         self.ai_worker.error.connect(self.on_ai_error)
         
         # 启动线程
         self.ai_thread.start()
         
-    def on_ai_chunk_received(self, chunk):
-        """接收AI生成的文本块"""
-        cursor = self.textCursor()
-        cursor.setPosition(self.ai_insert_position)
-        
-        # 插入文本
-        cursor.insertText(chunk)
+    def show_ai_preview(self):
+        """在原文下方显示预览面板"""
+        if self.ai_preview is None:
+            self.ai_preview = AIPreview(self.viewport())
+            self.ai_preview.accepted.connect(self.accept_ai_preview)
+            self.ai_preview.discarded.connect(self.discard_ai_preview)
+            self.updateRequest.connect(self.on_update_request)
+        names = {'continue': '续写', 'expand': '扩写', 'summarize': '缩写', 'custom': '自定义指令'}
+        self.ai_preview.start(f"{names[self.ai_action_name]}预览")
+        self.place_ai_preview()
+        
+    def place_ai_preview(self):
+        """把预览面板放在原文范围的下方，下方放不下时放在上方"""
+        preview = self.ai_preview
+        if preview is None or not preview.isVisible() or self.ai_target_cursor is None:
+            return
+        viewport = self.viewport()
+        width = max(200, viewport.width() - 20)
+        height = max(120, viewport.height() * 2 // 5)
+        start = QTextCursor(self.document())
+        start.setPosition(self.ai_target_cursor.selectionStart())
+        end = QTextCursor(self.document())
+        end.setPosition(self.ai_target_cursor.selectionEnd())
+        top = self.cursorRect(start).top()
+        bottom = self.cursorRect(end).bottom() + 4
+        if bottom + height > viewport.height() and top - height - 4 >= 0:
+            y = top - height - 4
+        else:
+            y = max(0, min(bottom, viewport.height() - height))
+        preview.setGeometry(10, y, width, height)
         
-        # 更新插入位置
-        self.ai_insert_position = cursor.position()
+    def on_update_request(self, rect, dy):
+        """滚动时让预览面板跟随原文"""
+        if dy:
+            self.place_ai_preview()
+            
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.place_ai_preview()
+        
+    def highlight_ai_target(self):
+        """标出将被替换的原文"""
+        selections = []
+        if self.ai_target_cursor is not None and self.ai_target_cursor.hasSelection():
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = self.ai_target_cursor
+            selection.format.setBackground(QColor(38, 79, 120, 90))
+            selections.append(selection)
+        self.setExtraSelections(selections)
         
-        # 确保文本可见
-        self.setTextCursor(cursor)
-        self.ensureCursorVisible()
+    def on_ai_chunk_received(self, chunk):
+        """接收AI生成的文本块，写入预览面板"""
+        if self.ai_preview is None:
+            return
+        self.ai_preview.append_text(chunk)
         
         # 更新状态栏字符数
         if self.parent_window:
             self.parent_window.status_bar.update_char_count(len(chunk))
+            
+    def on_ai_restart(self):
+        """清空预览，重新输出（分段缩写的合并结果替换各段结果）"""
+        if self.ai_preview is not None:
+            self.ai_preview.clear_text()
         
     def on_ai_finished(self):
         """AI生成完成"""
@@ -265,14 +692,30 @@ class TextEditor(QPlainTextEdit):
             self.ai_thread = None
         self.ai_worker = None
         
+        if self.ai_preview is not None:
+            self.ai_preview.set_running(False)
+            self.check_repetition()
+        
         # 隐藏状态栏进度
         if self.parent_window:
             self.parent_window.status_bar.hide_ai_progress()
+            
+    def check_repetition(self):
+        """检查生成的内容是否与正文重复"""
+        text = self.ai_preview.text()
+        if not text or not self.parent_window or not hasattr(self.parent_window, 'repetition_index'):
+            return
+        try:
+            self.ai_preview.show_repetition(self.parent_window.repetition_index.check(text))
+        except Exception as e:
+            print(f"重复检测失败: {e}")
         
     def on_ai_error(self, error_msg):
-        """AI生成错误"""
+        """AI生成错误，原文保持不变，已生成的部分仍可在预览中应用或放弃"""
         print(f"AI生成错误: {error_msg}")
         self.on_ai_finished()
+        if self.ai_preview is not None:
+            self.ai_preview.show_error(error_msg)
         
         # 在状态栏显示错误
         if self.parent_window:
@@ -283,11 +726,67 @@ class TextEditor(QPlainTextEdit):
         if self.ai_worker:
             self.ai_worker.stop()
             
+    def accept_ai_preview(self):
+        """把预览的内容作为一次编辑写入文档，替换原文"""
+        if self.ai_target_cursor is None or not self.ai_preview.text():
+            return
+        self.stop_ai_generation()
+        text = self.ai_preview.text()
+        cursor = self.ai_target_cursor
+        cursor.beginEditBlock()
+        cursor.insertText(text)
+        cursor.endEditBlock()
+        self.setTextCursor(cursor)
+        self.ensureCursorVisible()
+        self.close_ai_preview()
+        
+    def discard_ai_preview(self):
+        """放弃预览的内容，原文不变"""
+        self.stop_ai_generation()
+        self.close_ai_preview()
+        
+    def close_ai_preview(self):
+        self.ai_target_cursor = None
+        self.ai_action_name = None
+        self.setExtraSelections([])
+        if self.ai_preview is not None:
+            self.ai_preview.hide()
+        self.setFocus()
+        
+    def keyPressEvent(self, event):
+        """预览显示时Ctrl+Enter应用，Esc放弃"""
+        if self.ai_target_cursor is not None:
+            if event.key() in (Qt.Key_Return, Qt.Key_Enter) and event.modifiers() & Qt.ControlModifier:
+                self.accept_ai_preview()
+                return
+            if event.key() == Qt.Key_Escape:
+                self.discard_ai_preview()
+                return
+        super().keyPressEvent(event)
+            
+    def viewportEvent(self, event):
+        """鼠标悬停在实体名上时显示设定中的说明"""
+        if event.type() == QEvent.ToolTip:
+            cursor = self.cursorForPosition(event.pos())
+            offset = cursor.positionInBlock()
+            if offset > 0 and self.cursorRect(cursor).x() > event.pos().x():
+                offset -= 1
+            name = self.entity_highlighter.entity_at(cursor.block(), offset)
+            if name:
+                QToolTip.showText(event.globalPos(), self.components.entity_dictionary.describe(name), self.viewport())
+            else:
+                QToolTip.hideText()
+                event.ignore()
+            return True
+        return super().viewportEvent(event)
+        
     def mousePressEvent(self, event):
         """鼠标点击事件"""
         super().mousePressEvent(event)
         # 点击时隐藏浮动菜单
-        if not self.floating_menu.geometry().contains(event.globalPos()):
-            self.floating_menu.hide()
-        if not self.continue_button.geometry().contains(event.pos()):
-            self.continue_button.hide()
+        floating_menu = self.components.floating_menu
+        if not floating_menu.geometry().contains(event.globalPos()):
+            floating_menu.hide()
+        continue_button = self.components.continue_button
+        if not continue_button.geometry().contains(event.pos()):
+            continue_button.hide()